@@ -0,0 +1,323 @@
+"""Bulk ingestion of nodes and edges from iterables or numpy arrays, written in chunks.
+
+Use through Connection.load_nodes and Connection.load_edges. Unlike Connection.add_nodes and add_edges, the input is
+never held in memory in its entirety: rows are generated, written with a single DBAPI executemany per table and
+committed one chunk at a time."""
+
+import time
+
+from six import iteritems
+from six.moves import range, zip
+
+from . import config, flexible_value
+from .orm import Node, Edge, NodeProperty, EdgeProperty
+
+def chunks(iterable, chunk_size):
+    """Yield lists of at most chunk_size consecutive items from iterable"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk)==chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk)>0:
+        yield chunk
+
+def _to_list(values):
+    # numpy arrays are converted with tolist(), giving python scalars that all database drivers accept
+    if hasattr(values, 'tolist'):
+        return values.tolist()
+    else:
+        return list(values)
+
+def _slices(data, chunk_size):
+    """Yield lists of at most chunk_size consecutive items from a sequence, numpy array or any other iterable"""
+    if hasattr(data, '__len__') and hasattr(data, '__getitem__'):
+        for start in range(0, len(data), chunk_size):
+            yield _to_list(data[start:start+chunk_size])
+    else:
+        for chunk in chunks(data, chunk_size):
+            yield chunk
+
+def _property_slices(properties, chunk_size, as_dicts=True):
+    """Yield lists of at most chunk_size property dictionaries.
+
+    :param properties: either an iterable of property dictionaries, one per node or edge; or a dictionary mapping
+      each property name to a sequence or numpy array of values, one per node or edge. Values of None are omitted.
+    :param as_dicts: if False, chunks of a dictionary of arrays are instead yielded as (names, lists of values), to be
+      converted later by _property_dicts
+    """
+    if isinstance(properties, dict):
+        if len(properties)==0:
+            raise ValueError("At least one property array must be given")
+        names = list(properties.keys())
+        lengths = set(len(properties[name]) for name in names)
+        if len(lengths)>1:
+            raise ValueError("All property arrays must have the same length")
+        column_slices = [_slices(properties[name], chunk_size) for name in names]
+        for column_values in zip(*column_slices):
+            if as_dicts:
+                yield _property_dicts(names, column_values)
+            else:
+                yield names, column_values
+    else:
+        for chunk in _slices(properties, chunk_size):
+            yield chunk
+
+def _property_dicts(names, column_values):
+    """Convert lists of values for each of the named properties into a list of property dictionaries"""
+    return [dict((name, value) for name, value in zip(names, row) if value is not None)
+            for row in zip(*column_values)]
+
+
+class IngestionReport(object):
+    """Summarises the progress of a bulk load"""
+
+    def __init__(self):
+        self.rows = 0 # number of nodes or edges written
+        self.property_rows = 0 # number of property values written
+        self.chunks = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        if self.seconds>0:
+            return self.rows/self.seconds
+        else:
+            return float('nan')
+
+    def __repr__(self):
+        return "<IngestionReport rows=%d property_rows=%d chunks=%d seconds=%.3f rows_per_second=%.1f>"%(
+            self.rows, self.property_rows, self.chunks, self.seconds, self.rows_per_second)
+
+
+def executemany(connection, table, column_names, rows):
+    """Insert rows, given as tuples of values for the named columns, with a single DBAPI executemany.
+
+    Passing the rows straight to the DBAPI cursor avoids SQLAlchemy's per-row parameter processing, which would
+    otherwise take as long as the insert itself. Drivers that support it (e.g. MySQLdb) turn this into multi-row
+    INSERT statements.
+
+    :param connection: the sqlalchemy Connection to insert with
+    """
+    compiled = table.insert(inline=True).compile(dialect=connection.dialect, column_keys=column_names)
+    if compiled.positional:
+        if list(compiled.positiontup)!=list(column_names):
+            order = [column_names.index(name) for name in compiled.positiontup]
+            rows = [tuple(row[i] for i in order) for row in rows]
+    else:
+        rows = [dict(zip(column_names, row)) for row in rows]
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.executemany(str(compiled), rows)
+    finally:
+        cursor.close()
+
+property_column_names = {NodeProperty: ['node_id', 'category_id', 'value_int', 'value_float', 'value_str'],
+                         EdgeProperty: ['edge_id', 'category_id', 'value_int', 'value_float', 'value_str']}
+
+def property_rows(first_parent_id, properties, category_id_for_name):
+    """Return a list of tuples giving the column values (see property_column_names) for a sequence of property dicts.
+
+    :param first_parent_id: the ID of the node or edge to which the first dictionary of properties belongs; the
+      remainder belong to consecutive IDs
+    :param category_id_for_name: a function mapping a property name to its category ID
+    """
+    rows = []
+    for i, props in enumerate(properties):
+        for category, value in iteritems(props):
+            rows.append((first_parent_id + i, category_id_for_name(category)) +
+                        flexible_value.flexible_value_tuple(value))
+    return rows
+
+
+class BulkLoader(object):
+    """Writes chunks of nodes or edges, with their properties, committing after each chunk"""
+
+    def __init__(self, graph_connection, progress=None):
+        """
+        :param graph_connection: the graff Connection to write to
+        :param progress: if not None, a function that is called with the IngestionReport after each chunk is committed
+        """
+        self._graph_connection = graph_connection
+        self._session = graph_connection.get_sqlalchemy_session()
+        self._progress = progress
+        self.report = IngestionReport()
+
+    def write_chunk(self, class_, column_names, rows, properties, property_class):
+        """Insert rows into the table for class_ (Node or Edge), plus their properties, and commit.
+
+        :param column_names: the names of the columns for which values are given
+        :param rows: a list of tuples giving the column values for each new node or edge
+        :param properties: a list of property dictionaries, one per row; or None
+        """
+        start = time.time()
+        first_id = self._graph_connection.id_allocator.reserve(class_, len(rows))
+        rows = [(first_id + i,) + row for i, row in enumerate(rows)]
+        if properties is not None:
+            category_ids = self._graph_connection._get_property_category_ids(properties)
+            properties = property_rows(first_id, properties, category_ids.__getitem__)
+        self.write_prepared_chunk(class_, ['id'] + column_names, rows, property_class, properties, start)
+
+    def write_prepared_chunk(self, class_, column_names, rows, property_class, properties, start=None):
+        """Insert rows, which already include their IDs, into the table for class_, plus their properties, and commit.
+
+        :param properties: a list of tuples as returned by property_rows; or None
+        :param start: the time at which preparation of this chunk started, for the IngestionReport
+        """
+        if start is None:
+            start = time.time()
+        connection = self._session.connection()
+        executemany(connection, class_.__table__, column_names, rows)
+        if properties:
+            executemany(connection, property_class.__table__, property_column_names[property_class], properties)
+        self._session.commit()
+        self.record_chunk(len(rows), len(properties or []), time.time()-start)
+
+    def write_property_chunk(self, property_class, category_id, parent_ids, values, start=None):
+        """Set a single property of the given nodes or edges, replacing any existing values, and commit.
+
+        :param property_class: NodeProperty or EdgeProperty
+        :param category_id: the category ID of the property
+        :param parent_ids: a list of the IDs of the nodes or edges
+        :param values: a list of values, one per ID; the property is removed where the value is None or NaN
+        """
+        if start is None:
+            start = time.time()
+        connection = self._session.connection()
+        table = property_class.__table__
+        parent_id_column = table.c[property_column_names[property_class][0]]
+        for batch_start in range(0, len(parent_ids), config.in_clause_batch_size):
+            batch = parent_ids[batch_start:batch_start+config.in_clause_batch_size]
+            connection.execute(table.delete().where((table.c.category_id == category_id) &
+                                                    parent_id_column.in_(batch)))
+        rows = [(parent_id, category_id) + flexible_value.flexible_value_tuple(value)
+                for parent_id, value in zip(parent_ids, values) if value is not None and value==value]
+        if rows:
+            executemany(connection, table, property_column_names[property_class], rows)
+        self._session.commit()
+        self.record_chunk(len(parent_ids), len(rows), time.time()-start)
+
+    def record_chunk(self, n_rows, n_property_rows, seconds):
+        """Update the IngestionReport with a chunk that has been committed"""
+        self._graph_connection.clear_result_cache()
+        self.report.rows+=n_rows
+        self.report.property_rows+=n_property_rows
+        self.report.chunks+=1
+        self.report.seconds+=seconds
+        if self._progress is not None:
+            self._progress(self.report)
+
+
+def _parallel_slices(first, second, chunk_size, error_message):
+    """Yield pairs of lists of at most chunk_size consecutive items from two sequences, numpy arrays or iterables,
+    raising ValueError with the given message if they have different lengths"""
+    if hasattr(first, '__len__') and hasattr(second, '__len__') and len(first)!=len(second):
+        raise ValueError(error_message)
+    second_slices = _slices(second, chunk_size)
+    for first_chunk in _slices(first, chunk_size):
+        second_chunk = next(second_slices, [])
+        if len(first_chunk)!=len(second_chunk):
+            raise ValueError(error_message)
+        yield first_chunk, second_chunk
+    if next(second_slices, None) is not None:
+        raise ValueError(error_message)
+
+def _pair_slices(node_from, node_to, chunk_size):
+    """Yield lists of at most chunk_size (from, to) pairs, given the arguments to load_edges"""
+    if node_to is None:
+        return _slices(node_from, chunk_size)
+    else:
+        return (list(zip(a, b)) for a, b in _parallel_slices(node_from, node_to, chunk_size,
+                                                             "node_from and node_to must have the same length"))
+
+def _node_id(node):
+    if isinstance(node, Node):
+        return node.id
+    else:
+        return node
+
+def _property_chunk_length(chunk):
+    if isinstance(chunk, tuple):
+        names, column_values = chunk
+        return len(column_values[0])
+    else:
+        return len(chunk)
+
+def _node_chunks(number, properties, chunk_size, as_dicts=True):
+    """Yield (number of nodes, properties or None) for each chunk of nodes, given the arguments to load_nodes"""
+    if properties is None:
+        if number is None:
+            raise ValueError("Either the number of nodes or their properties must be specified")
+        for start in range(0, number, chunk_size):
+            yield min(chunk_size, number-start), None
+    else:
+        if number is not None and hasattr(properties, '__len__'):
+            lengths = [len(v) for v in properties.values()] if isinstance(properties, dict) else [len(properties)]
+            if any(length!=number for length in lengths):
+                raise ValueError("Incorrect number of property values passed to load_nodes")
+        for props in _property_slices(properties, chunk_size, as_dicts):
+            yield _property_chunk_length(props), props
+
+def _edge_chunks(node_from, node_to, properties, chunk_size, as_dicts=True):
+    """Yield (list of (from, to) pairs, properties or None) for each chunk of edges, given the arguments to load_edges"""
+    if properties is None:
+        property_chunks = None
+    else:
+        property_chunks = _property_slices(properties, chunk_size, as_dicts)
+
+    for pairs in _pair_slices(node_from, node_to, chunk_size):
+        props = None
+        if property_chunks is not None:
+            props = next(property_chunks, [])
+            if _property_chunk_length(props)!=len(pairs):
+                raise ValueError("Incorrect number of property values passed to load_edges")
+        yield pairs, props
+
+    if property_chunks is not None and next(property_chunks, None) is not None:
+        raise ValueError("Incorrect number of property values passed to load_edges")
+
+def load_nodes(graph_connection, category, number=None, properties=None, chunk_size=None, progress=None):
+    """Add nodes of the specified category, writing them in chunks. See Connection.load_nodes."""
+    if chunk_size is None:
+        chunk_size = config.ingest_chunk_size
+
+    loader = BulkLoader(graph_connection, progress)
+    category_id = graph_connection.category_cache.get_existing_or_new_id(category)
+    for n_nodes, props in _node_chunks(number, properties, chunk_size):
+        loader.write_chunk(Node, ['category_id'], [(category_id,)]*n_nodes, props, NodeProperty)
+    return loader.report
+
+def load_edges(graph_connection, category, node_from, node_to=None, properties=None, chunk_size=None,
+               progress=None):
+    """Add edges of the specified category, writing them in chunks. See Connection.load_edges."""
+    if chunk_size is None:
+        chunk_size = config.ingest_chunk_size
+
+    loader = BulkLoader(graph_connection, progress)
+    category_id = graph_connection.category_cache.get_existing_or_new_id(category)
+    for pairs, props in _edge_chunks(node_from, node_to, properties, chunk_size):
+        rows = [(_node_id(a), _node_id(b), category_id) for a, b in pairs]
+        loader.write_chunk(Edge, ['node_from_id', 'node_to_id', 'category_id'], rows, props, EdgeProperty)
+    return loader.report
+
+def _parent_id(parent):
+    if isinstance(parent, (Node, Edge)):
+        return parent.id
+    else:
+        return parent
+
+def store_property(graph_connection, property_class, name, parent_ids, values, chunk_size=None, progress=None):
+    """Set the named property of many nodes or edges, writing them in chunks. See Connection.store_node_property."""
+    if chunk_size is None:
+        chunk_size = config.ingest_chunk_size
+
+    loader = BulkLoader(graph_connection, progress)
+    category_id = graph_connection.category_cache.get_existing_or_new_id(name)
+    for id_chunk, value_chunk in _parallel_slices(parent_ids, values, chunk_size,
+                                                  "The number of values must equal the number of IDs"):
+        start = time.time()
+        loader.write_property_chunk(property_class, category_id, [_parent_id(parent) for parent in id_chunk],
+                                    value_chunk, start)
+    return loader.report
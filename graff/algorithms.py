@@ -0,0 +1,240 @@
+"""Graph algorithms evaluated with vectorised numpy operations on an in-memory Snapshot.
+
+Every function takes a graff.snapshot.Snapshot and returns an array indexed by node ID, covering the IDs up to
+snapshot.n_nodes. Only the nodes marked in snapshot.node_exists take part; edges to or from any other IDs are
+ignored. The results can be written back to the database as node properties using Connection.store_node_property,
+for example:
+
+    snapshot = db.snapshot("likes", node_category="person")
+    rank = algorithms.pagerank(snapshot)
+    db.store_node_property("pagerank", snapshot.node_ids, rank[snapshot.node_ids])
+
+Requires numpy."""
+
+import numpy as np
+from six import string_types
+
+from . import config
+from .snapshot import _directions
+
+def _get_edges(snapshot):
+    """Return the (sources, destinations, edge positions) of the edges between nodes in the snapshot"""
+    sources = snapshot._get_sources()
+    destinations = snapshot.destinations
+    keep = snapshot.node_exists[sources] & snapshot.node_exists[destinations]
+    return sources[keep], destinations[keep], np.flatnonzero(keep)
+
+def _get_undirected_simple_graph(snapshot):
+    """Return (indptr, neighbours) for the graph with each pair of linked nodes joined once in each direction, and
+    without any edges from a node to itself"""
+    sources, destinations, _ = _get_edges(snapshot)
+    n = snapshot.n_nodes
+    distinct = sources!=destinations
+    low = np.minimum(sources[distinct], destinations[distinct])
+    high = np.maximum(sources[distinct], destinations[distinct])
+    pairs = np.sort(low*n+high)
+    pairs = pairs[np.concatenate((pairs[:1]==pairs[:1], pairs[1:]!=pairs[:-1]))]
+    low, high = pairs//n, pairs%n
+    origins = np.concatenate((low, high))
+    order = np.argsort(origins, kind='stable')
+    indptr = np.zeros(n+1, dtype=np.int64)
+    np.cumsum(np.bincount(origins, minlength=n), out=indptr[1:])
+    return indptr, np.concatenate((high, low))[order]
+
+def _get_csr(snapshot, direction):
+    """Return (indptr, neighbours) for following the edges between nodes in the snapshot in the given direction, as
+    for Snapshot._get_csr"""
+    if direction not in _directions:
+        raise ValueError("Unknown direction %r; must be one of %s" % (direction, ", ".join(_directions)))
+    sources, destinations, _ = _get_edges(snapshot)
+    if direction=="out":
+        origins, neighbours = sources, destinations
+    elif direction=="in":
+        origins, neighbours = destinations, sources
+    else:
+        reverse = sources!=destinations
+        origins = np.concatenate((sources, destinations[reverse]))
+        neighbours = np.concatenate((destinations, sources[reverse]))
+    order = np.argsort(origins, kind='stable')
+    indptr = np.zeros(snapshot.n_nodes+1, dtype=np.int64)
+    np.cumsum(np.bincount(origins, minlength=snapshot.n_nodes), out=indptr[1:])
+    return indptr, neighbours[order]
+
+def _get_weights(snapshot, weights, positions):
+    if weights is None:
+        return np.ones(len(positions))
+    if isinstance(weights, string_types):
+        weights = snapshot.edge_properties[weights]
+    weights = np.asarray(weights, dtype=np.float64)[positions]
+    return np.where(np.isnan(weights), 0.0, weights)
+
+
+def pagerank(snapshot, damping=0.85, weights=None, sources=None, tolerance=1e-10, max_iterations=100):
+    """Return the PageRank of every node, following edges in their stored direction.
+
+    The ranks of the nodes in the snapshot sum to one; other IDs have rank zero. Nodes without outgoing edges
+    distribute their rank in the same way as the random jumps.
+
+    :param damping: the probability of following an edge at each step, rather than jumping to a random node
+    :param weights: if not None, the name of an edge property (read into the snapshot) or an array aligned with
+      snapshot.edge_ids, giving the relative probability of following each edge. Missing weights count as zero.
+    :param sources: if not None, the IDs of the nodes to which random jumps are made, giving personalised PageRank
+    :param tolerance: stop when the total change in the ranks in one iteration is smaller than this
+    """
+    n = snapshot.n_nodes
+    edge_sources, edge_destinations, positions = _get_edges(snapshot)
+    edge_weights = _get_weights(snapshot, weights, positions)
+
+    jump = np.zeros(n)
+    if sources is None:
+        jump[snapshot.node_exists] = 1.0
+    else:
+        jump[np.asarray(sources, dtype=np.int64)] = 1.0
+        jump[~snapshot.node_exists] = 0.0
+    if jump.sum()==0:
+        return jump
+    jump/=jump.sum()
+
+    out_weight = np.bincount(edge_sources, weights=edge_weights, minlength=n)
+    dangling = snapshot.node_exists & (out_weight==0)
+    edge_fractions = edge_weights/np.where(out_weight>0, out_weight, 1.0)[edge_sources]
+
+    rank = jump.copy()
+    for iteration in range(max_iterations):
+        new_rank = damping*np.bincount(edge_destinations, weights=rank[edge_sources]*edge_fractions, minlength=n)
+        new_rank+=(damping*rank[dangling].sum() + 1.0-damping)*jump
+        change = np.abs(new_rank-rank).sum()
+        rank = new_rank
+        if change<tolerance:
+            break
+    return rank
+
+
+def connected_components(snapshot):
+    """Return the component of every node, ignoring the direction of edges.
+
+    Each component is labelled by the smallest ID of the nodes in it; IDs that are not nodes in the snapshot are
+    labelled -1. Components are found by repeatedly attaching each component to the lowest-labelled component it links
+    to, then shortening the chains of labels by pointer jumping."""
+    sources, destinations, _ = _get_edges(snapshot)
+    labels = np.arange(snapshot.n_nodes, dtype=np.int64)
+    while True:
+        source_labels, destination_labels = labels[sources], labels[destinations]
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, source_labels, destination_labels)
+        np.minimum.at(new_labels, destination_labels, source_labels)
+        while True:
+            jumped = new_labels[new_labels]
+            if np.array_equal(jumped, new_labels):
+                break
+            new_labels = jumped
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    labels[~snapshot.node_exists] = -1
+    return labels
+
+
+def core_numbers(snapshot):
+    """Return the core number of every node, ignoring the direction of edges, repeated edges and edges from a node to
+    itself; -1 for IDs that are not nodes in the snapshot.
+
+    A node's core number is the largest k for which it belongs to the k-core, the largest subgraph in which every node
+    has at least k neighbours. Nodes are peeled away in batches: all those with at most k remaining neighbours at
+    once."""
+    indptr, neighbours = _get_undirected_simple_graph(snapshot)
+    degree = np.diff(indptr)
+    remaining = snapshot.node_exists.copy()
+    cores = np.empty(snapshot.n_nodes, dtype=np.int64)
+    cores.fill(-1)
+    k = 0
+    while remaining.any():
+        k = max(k, degree[remaining].min())
+        peeled = np.flatnonzero(remaining & (degree<=k))
+        while len(peeled)>0:
+            cores[peeled] = k
+            remaining[peeled] = False
+            # only the neighbours of the nodes just peeled can drop to k remaining neighbours
+            offsets, index = snapshot._get_neighbour_index(indptr, peeled)
+            touched, counts = np.unique(neighbours[index], return_counts=True)
+            degree[touched]-=counts
+            peeled = touched[remaining[touched] & (degree[touched]<=k)]
+    return cores
+
+
+def k_core(snapshot, k):
+    """Return the IDs of the nodes in the k-core; see core_numbers"""
+    return np.flatnonzero(core_numbers(snapshot)>=k)
+
+
+def triangles(snapshot):
+    """Return the number of triangles that each node belongs to, ignoring the direction of edges, repeated edges and
+    edges from a node to itself. The total number of triangles is a third of the sum.
+
+    Each link is directed from the node of lower degree to the one of higher degree, so that every triangle is found
+    exactly once, as a pair of links from its lowest node whose far ends are also linked. The pairs are checked in
+    batches of at most config.snapshot_batch_size."""
+    indptr, neighbours = _get_undirected_simple_graph(snapshot)
+    n = snapshot.n_nodes
+    degree = np.diff(indptr)
+    rank = np.empty(n, dtype=np.int64)
+    rank[np.lexsort((np.arange(n), degree))] = np.arange(n)
+
+    origins = np.repeat(np.arange(n, dtype=np.int64), degree)
+    forward = rank[origins]<rank[neighbours]
+    low, high = origins[forward], neighbours[forward] # ordered by low, since origins is sorted
+    low_indptr = np.zeros(n+1, dtype=np.int64)
+    np.cumsum(np.bincount(low, minlength=n), out=low_indptr[1:])
+    links = np.sort(low*n+high)
+
+    counts = np.zeros(n, dtype=np.int64)
+    # the total number of pairs up to each link, there being one for every link from the same low end
+    pairs_before = np.concatenate(([0], np.cumsum(np.diff(low_indptr)[low])))
+    start = 0
+    while start<len(low):
+        end = np.searchsorted(pairs_before, pairs_before[start]+config.snapshot_batch_size, side='right')-1
+        end = min(len(low), max(start+1, end))
+        # pair each link (u, v) with every link (u, w), and look for a link (v, w)
+        offsets, index = snapshot._get_neighbour_index(low_indptr, low[start:end])
+        v = np.repeat(high[start:end], np.diff(offsets))
+        w = high[index]
+        keys = v*n+w
+        found = links[np.minimum(np.searchsorted(links, keys), len(links)-1)]==keys
+        for corner in (np.repeat(low[start:end], np.diff(offsets))[found], v[found], w[found]):
+            counts+=np.bincount(corner, minlength=n)
+        start = end
+    return counts
+
+
+def random_walks(snapshot, starts, length, restart_probability=0.0, direction="out", seed=None):
+    """Return random walks along the edges, one starting from each of the given nodes.
+
+    Walks that reach a node without any edges to follow, or that restart (with the given probability at each step),
+    jump back to their starting node. With restart_probability>0, the frequency with which the walks visit each node
+    approximates the personalised PageRank of the starting nodes.
+
+    :param starts: the IDs of the nodes from which to start, which must be nodes in the snapshot; repeat an ID to
+      start several walks from it
+    :param length: the number of steps in each walk
+    :param direction: as for Snapshot.follow
+    :param seed: a seed for the random number generator, for reproducible walks
+    :return: an array of shape (len(starts), length+1), giving the node at each step of each walk
+    """
+    random = np.random.RandomState(seed)
+    indptr, neighbours = _get_csr(snapshot, direction)
+    starts = np.asarray(starts, dtype=np.int64).reshape(-1)
+    if not ((starts>=0) & (starts<snapshot.n_nodes)).all() or not snapshot.node_exists[starts].all():
+        raise ValueError("Random walks can only start from nodes in the snapshot")
+    walks = np.empty((len(starts), length+1), dtype=np.int64)
+    walks[:, 0] = starts
+    current = starts
+    for step in range(1, length+1):
+        degree = indptr[current+1]-indptr[current]
+        choice = indptr[current] + (random.random_sample(len(current))*degree).astype(np.int64)
+        # walks at a dead end have no valid choice, and are sent back to their start whatever the choice is
+        choice = np.minimum(choice, len(neighbours)-1)
+        current = np.where(degree>0, neighbours[choice] if len(neighbours)>0 else starts, starts)
+        if restart_probability>0:
+            current = np.where(random.random_sample(len(current))<restart_probability, starts, current)
+        walks[:, step] = current
+    return walks
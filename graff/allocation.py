@@ -0,0 +1,53 @@
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from .orm import IdAllocation
+
+class IdAllocator(object):
+    """Reserves ranges of IDs for new nodes and edges.
+
+    Rows are then inserted with explicit IDs from the reserved range, so that properties can be attached to them
+    correctly even while other processes are inserting into the same database."""
+
+    max_attempts = 10
+
+    def __init__(self, sqlalchemy_session):
+        self._session = sqlalchemy_session
+        self._engine = sqlalchemy_session.get_bind()
+
+    def reserve(self, class_, number):
+        """Reserve number consecutive IDs for new rows of class_ (e.g. Node or Edge), returning the first of them"""
+        if self._engine.dialect.name == 'sqlite':
+            # sqlite allows only one writer at a time, so the reservation can safely be made in the current
+            # transaction; and a separate connection would either deadlock against it or (for an in-memory database)
+            # see a different database altogether
+            return self._reserve_using_connection(self._session.connection(), class_, number)
+
+        # Other backends allow concurrent writers. Make the reservation in its own short transaction, so that the
+        # lock on the allocation row is not held while the rows themselves are written.
+        for attempt in range(self.max_attempts):
+            try:
+                with self._engine.begin() as connection:
+                    return self._reserve_using_connection(connection, class_, number)
+            except IntegrityError:
+                # another process created the allocation row for this table at the same time; try again to update it
+                pass
+        raise RuntimeError("Unable to reserve IDs for table %r" % class_.__tablename__)
+
+    @staticmethod
+    def _reserve_using_connection(connection, class_, number):
+        allocations = IdAllocation.__table__
+        table_name = class_.__tablename__
+        this_table = allocations.c.table_name == table_name
+
+        updated = connection.execute(allocations.update().where(this_table).
+                                     values(next_id=allocations.c.next_id + number))
+        if updated.rowcount>0:
+            next_id = connection.execute(select([allocations.c.next_id]).where(this_table)).scalar()
+            return next_id - number
+
+        # No allocation has yet been made for this table, so start after any rows already present
+        max_id = connection.execute(select([func.max(class_.__table__.c.id)])).scalar()
+        first_id = (max_id or 0) + 1
+        connection.execute(allocations.insert().values(table_name=table_name, next_id=first_id + number))
+        return first_id
@@ -0,0 +1,133 @@
+"""Support for awaiting graff queries and additions from asyncio code.
+
+SQLAlchemy (before version 1.4) has no asyncio engine, so the blocking database work is instead run in a pool of
+worker threads, and the caller awaits an asyncio future for its result. Each operation runs on the worker thread's own
+session, which is released (returning its database connection to the pool) as soon as the operation completes. The
+connection must therefore have been opened with thread_safe=True. Many operations can be in progress at once, up to
+config.async_max_workers.
+
+The nodes and edges returned are therefore detached from any session. Their categories are named through the
+connection's CategoryCache, but their properties must be loaded with the query (all_async(load_properties=True)) to be
+available through dict().
+
+Use through BaseQuery.all_async, count_async, first_async, exists_async and stream_async, and Connection.add_nodes_async
+and add_edges_async. Requires asyncio and concurrent.futures (python 3)."""
+
+import collections
+import functools
+import itertools
+
+from . import config
+
+def get_executor(graph_connection):
+    """Return the pool of threads that runs asynchronous operations for the connection, creating it if necessary"""
+    with graph_connection._async_executor_lock:
+        if graph_connection._async_executor is None:
+            if not graph_connection.thread_safe:
+                raise ValueError("Asynchronous operations require a connection opened with thread_safe=True")
+            from concurrent.futures import ThreadPoolExecutor
+            graph_connection._async_executor = ThreadPoolExecutor(config.async_max_workers)
+        return graph_connection._async_executor
+
+def _call_and_release(graph_connection, function):
+    try:
+        return function()
+    finally:
+        graph_connection.release_session()
+
+def run(graph_connection, function, *args, **kwargs):
+    """Call function(*args, **kwargs) in a worker thread, returning an asyncio future for its result"""
+    import asyncio
+    executor = get_executor(graph_connection)
+    call = functools.partial(_call_and_release, graph_connection, functools.partial(function, *args, **kwargs))
+    return asyncio.get_event_loop().run_in_executor(executor, call)
+
+
+class AsyncResultIterator(object):
+    """Iterates asynchronously over the results of a query, for use with async for.
+
+    The query is run by BaseQuery.stream() in a thread dedicated to this iterator, since its temp tables and cursor
+    belong to the session of that thread. Results are retrieved a batch at a time. If the iteration is abandoned before
+    the end, call aclose() to end the query and release its thread."""
+
+    def __init__(self, query, batch_size=None):
+        if batch_size is None:
+            batch_size = config.stream_batch_size
+        self._query = query
+        self._batch_size = batch_size
+        self._graph_connection = query._graph_connection
+        self._executor = None
+        self._generator = None
+        self._buffer = collections.deque()
+        self._finished = False
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        import asyncio
+        loop = asyncio.get_event_loop()
+        result = loop.create_future()
+        if len(self._buffer)>0:
+            result.set_result(self._buffer.popleft())
+        elif self._finished:
+            result.set_exception(StopAsyncIteration())
+        else:
+            fetch = loop.run_in_executor(self._get_executor(), self._fetch_batch)
+            fetch.add_done_callback(functools.partial(self._batch_fetched, result))
+        return result
+
+    def aclose(self):
+        """Stop the query, returning an asyncio future that completes once its resources have been released"""
+        import asyncio
+        self._buffer.clear()
+        if self._executor is None:
+            self._finished = True
+            future = asyncio.get_event_loop().create_future()
+            future.set_result(None)
+            return future
+        return asyncio.get_event_loop().run_in_executor(self._executor, self._close)
+
+    def _get_executor(self):
+        if self._executor is None:
+            get_executor(self._graph_connection) # check that the connection supports asynchronous operations
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(1)
+        return self._executor
+
+    def _fetch_batch(self):
+        # runs in this iterator's thread
+        if self._generator is None:
+            self._generator = self._query.stream(self._batch_size)
+        try:
+            batch = list(itertools.islice(self._generator, self._batch_size))
+        except:
+            self._close()
+            raise
+        if len(batch)==0:
+            self._close()
+        return batch
+
+    def _close(self):
+        # runs in this iterator's thread
+        self._finished = True
+        try:
+            if self._generator is not None:
+                self._generator.close()
+                self._generator = None
+        finally:
+            self._graph_connection.release_session()
+            self._executor.shutdown(wait=False)
+
+    def _batch_fetched(self, result, fetch):
+        if result.cancelled():
+            return
+        if fetch.cancelled():
+            result.cancel()
+        elif fetch.exception() is not None:
+            result.set_exception(fetch.exception())
+        elif len(fetch.result())==0:
+            result.set_exception(StopAsyncIteration())
+        else:
+            self._buffer.extend(fetch.result())
+            result.set_result(self._buffer.popleft())
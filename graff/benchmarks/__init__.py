@@ -0,0 +1,5 @@
+"""Performance benchmarks for graff.
+
+These are not run as part of the test suite. The main suite, which times ingestion and queries on synthetic graphs
+of increasing size, is run with python -m graff.benchmarks; see --help for options. Other modules can also be run from
+the command line."""
@@ -0,0 +1,41 @@
+"""Run the benchmark suite from the command line.
+
+For example, to time graphs of 10^3 to 10^6 edges on sqlite only, and compare with a previous run:
+
+    python -m graff.benchmarks --sizes 3 4 5 6 --backends sqlite_file sqlite_memory --output new.json \\
+                               --compare old.json
+
+The database given by the GRAFF_TEST_DATABASE_URI environment variable, if any, is wiped before use."""
+
+import argparse
+import sys
+
+from . import suite
+from .graphs import graph_generators
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m graff.benchmarks",
+                                     description="Time graff ingestion and queries on synthetic graphs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[3, 4, 5],
+                        help="log10 of the number of edges in each graph (default: 3 4 5)")
+    parser.add_argument("--graphs", nargs="+", default=sorted(graph_generators.keys()),
+                        choices=sorted(graph_generators.keys()), help="types of graph to generate")
+    parser.add_argument("--backends", nargs="+", default=None, choices=sorted(suite.backend_uris().keys()),
+                        help="database backends to use (default: all available)")
+    parser.add_argument("--repeats", type=int, default=3, help="number of times to repeat each query")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="compare the results with a JSON file from an earlier run")
+    args = parser.parse_args(argv)
+
+    results = suite.run(args.sizes, args.graphs, args.backends, args.repeats, log=sys.stderr)
+    suite.print_results(results)
+
+    if args.output is not None:
+        suite.write_results(results, args.output)
+
+    if args.compare is not None:
+        sys.stdout.write("\n")
+        suite.print_comparison(suite.compare(suite.read_results(args.compare), results))
+
+if __name__=="__main__":
+    main()
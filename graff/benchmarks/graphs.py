@@ -0,0 +1,35 @@
+"""Generators for synthetic graphs of arbitrary size, for use in benchmarks.
+
+Each generator yields (from, to) pairs of zero-based node indices, so that very large graphs can be added to a
+database in chunks without ever holding the full list of edges in memory."""
+
+from six.moves import range
+
+from ..compatibility import Random
+from ..add import chunks
+
+def random_graph(n_nodes, n_edges, seed=1):
+    """Yield the edges of a random graph, in which both ends of each edge are chosen uniformly from all nodes"""
+    rng = Random(seed)
+    for i in range(n_edges):
+        yield rng.randrange(n_nodes), rng.randrange(n_nodes)
+
+def power_law_graph(n_nodes, n_edges, exponent=0.7, seed=1):
+    """Yield the edges of a graph in which the number of incoming edges follows a power law.
+
+    The source of each edge is chosen uniformly, but the target is drawn from a distribution in which the probability
+    of choosing the node with index i is proportional to (i+1)**-exponent. A few low-index nodes are therefore hubs
+    with very many incoming edges, as in social or citation networks. The default exponent corresponds to a degree
+    distribution P(k) ~ k**-2.4.
+    """
+    if exponent==1.0:
+        raise ValueError("The exponent must not be 1")
+    rng = Random(seed)
+    # inverse transform sampling of a continuous power law on [1, n_nodes+1)
+    power = 1.0-exponent
+    upper = float(n_nodes+1)**power
+    for i in range(n_edges):
+        target = int((1.0 + rng.random()*(upper-1.0))**(1.0/power)) - 1
+        yield rng.randrange(n_nodes), min(target, n_nodes-1)
+
+graph_generators = {"random": random_graph, "power_law": power_law_graph}
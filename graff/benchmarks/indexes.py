@@ -0,0 +1,94 @@
+"""Compare query timings on a database with the indexes created by graff 1.0, and after Connection.ensure_indexes()
+
+Run as: python -m graff.benchmarks.indexes [n_people] [n_connections] [db_uri]
+
+If db_uri is not given, a temporary sqlite file is used."""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from .. import testing, orm
+from .. import condition as c
+
+legacy_indexes = [("edges_node_from_index", "edges", "node_from_id"),
+                  ("edges_node_to_index", "edges", "node_to_id"),
+                  ("nodeproperties_node_index", "nodeproperties", "node_id"),
+                  ("edgeproperties_edge_index", "edgeproperties", "edge_id")]
+
+legacy_retained_indexes = ["node_index", "edge_index"]
+
+benchmark_queries = [
+    ("count people", lambda db: db.query_node("person").count()),
+    ("names and ages", lambda db: db.query_node("person").return_property("name", "age").all()),
+    ("friends of friends", lambda db: db.query_node("person").follow("likes").follow("likes").count()),
+    ("incoming friends", lambda db: db.query_node("person").follow_in("likes").count()),
+    ("filtered follow", lambda db: db.query_node("person").filter(c.Property("age") > 30).follow("likes").
+                                    return_property("name").all()),
+    ("edge properties", lambda db: db.query_node("person").edge("likes").return_property("num_messages").all())
+]
+
+def build_database(n_people, n_connections, db_uri):
+    """Build a friends network, plus an unrelated category of nodes so that category restrictions are selective"""
+    db = testing.init_friends_network(n_people, n_connections, db_uri)
+    db.add_nodes("thing", n_people*4, [{'price': float(i)} for i in range(n_people*4)])
+    return db
+
+def use_legacy_indexes(db):
+    """Replace the indexes in the database with those created by graff 1.0"""
+    session = db.get_sqlalchemy_session()
+    connection = session.connection()
+    for table in orm.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name not in legacy_retained_indexes:
+                index.drop(bind=connection)
+    for name, table, column in legacy_indexes:
+        connection.execute("CREATE INDEX %s ON %s (%s)"%(name, table, column))
+    session.commit()
+
+def time_queries(db, repeats):
+    """Return the best time out of the specified number of repeats for each of the benchmark queries"""
+    timings = []
+    for label, query in benchmark_queries:
+        best = None
+        for i in range(repeats):
+            start = time.time()
+            query(db)
+            elapsed = time.time()-start
+            if best is None or elapsed<best:
+                best = elapsed
+        timings.append(best)
+    return timings
+
+def run(n_people=10000, n_connections=100000, db_uri=None, repeats=3):
+    """Run the benchmark, returning a list of (label, seconds with legacy indexes, seconds with current indexes)"""
+    temp_dir = None
+    if db_uri is None:
+        temp_dir = tempfile.mkdtemp()
+        db_uri = os.path.join(temp_dir, "benchmark.db")
+
+    try:
+        db = build_database(n_people, n_connections, db_uri)
+        use_legacy_indexes(db)
+        before = time_queries(db, repeats)
+        db.ensure_indexes()
+        after = time_queries(db, repeats)
+        db.close()
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+    return [(label, b, a) for (label, query), b, a in zip(benchmark_queries, before, after)]
+
+def main(argv):
+    args = [int(argv[1]) if len(argv)>1 else 10000,
+            int(argv[2]) if len(argv)>2 else 100000,
+            argv[3] if len(argv)>3 else None]
+    print("%-20s %12s %12s %8s"%("query", "legacy (s)", "current (s)", "speedup"))
+    for label, before, after in run(*args):
+        print("%-20s %12.4f %12.4f %8.1f"%(label, before, after, before/after))
+
+if __name__=="__main__":
+    main(sys.argv)
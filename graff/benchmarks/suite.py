@@ -0,0 +1,152 @@
+"""Time ingestion and queries on synthetic graphs of increasing size, on one or more database backends.
+
+The results are a list of dictionaries, one per timed stage, which can be written to and compared between JSON files.
+See __main__.py for the command line interface."""
+
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+
+from .. import testing, orm
+from .. import condition as c
+from .graphs import graph_generators, chunks
+from ..compatibility import Random
+
+node_category = "node"
+edge_category = "link"
+mean_degree = 10 # number of edges per node in the generated graphs
+
+query_stages = [
+    ("count", lambda db: db.query_node(node_category).count()),
+    ("follow", lambda db: db.query_node(node_category).follow(edge_category).count()),
+    ("follow_chain", lambda db: db.query_node(node_category).follow(edge_category).follow(edge_category).count()),
+    ("return_property", lambda db: len(db.query_node(node_category).return_property("weight").all())),
+    ("filter", lambda db: db.query_node(node_category).filter(c.Property("weight") > 0.9).count())
+]
+
+def backend_uris():
+    """Return a dictionary mapping the name of each available backend to a database URI.
+
+    The sqlite file URI is a placeholder, replaced by a file in a temporary directory when the benchmark is run."""
+    uris = {"sqlite_file": None, "sqlite_memory": ""}
+    if os.environ.get('GRAFF_TEST_DATABASE_URI'):
+        uris["test_database"] = os.environ['GRAFF_TEST_DATABASE_URI']
+    return uris
+
+def _timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time()-start, result
+
+def build_graph(db, graph_type, n_edges, chunk_size=100000, seed=1):
+    """Add a synthetic graph to the database, returning a list of (stage, seconds) for the ingestion stages"""
+    n_nodes = max(n_edges//mean_degree, 10)
+    rng = Random(seed)
+    properties = [{'weight': rng.random()} for i in range(n_nodes)]
+
+    add_nodes_time, _ = _timed(db.add_nodes, node_category, n_nodes, properties)
+    first_node_id = db.get_sqlalchemy_session().query(sqlalchemy.func.min(orm.Node.id)).scalar()
+
+    add_edges_time = 0.0
+    for chunk in chunks(graph_generators[graph_type](n_nodes, n_edges, seed=seed), chunk_size):
+        chunk_time, _ = _timed(db.add_edges, edge_category,
+                               [(first_node_id+a, first_node_id+b) for a, b in chunk])
+        add_edges_time+=chunk_time
+
+    return n_nodes, [("add_nodes", add_nodes_time), ("add_edges", add_edges_time)]
+
+def time_query_stages(db, repeats):
+    """Return a list of (stage, best time in seconds, number of rows) for each of the query stages"""
+    timings = []
+    for stage, query in query_stages:
+        best = None
+        for i in range(repeats):
+            elapsed, rows = _timed(query, db)
+            if best is None or elapsed<best:
+                best = elapsed
+        timings.append((stage, best, rows))
+    return timings
+
+def run_one(backend, db_uri, graph_type, n_edges, repeats=3):
+    """Build one synthetic graph on one backend and time each stage, returning a list of result dictionaries"""
+    temp_dir = None
+    if db_uri is None:
+        temp_dir = tempfile.mkdtemp()
+        db_uri = os.path.join(temp_dir, "benchmark.db")
+
+    try:
+        db = testing.get_test_connection(db_uri)
+        n_nodes, timings = build_graph(db, graph_type, n_edges)
+        timings = [(stage, seconds, None) for stage, seconds in timings] + time_query_stages(db, repeats)
+        db.close()
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+    return [{'backend': backend, 'graph': graph_type, 'n_nodes': n_nodes, 'n_edges': n_edges,
+             'stage': stage, 'seconds': seconds, 'rows': rows} for stage, seconds, rows in timings]
+
+def run(sizes=(3, 4, 5), graph_types=("random", "power_law"), backends=None, repeats=3, log=None):
+    """Run the benchmarks and return a dictionary describing the environment and the results.
+
+    :param sizes: the graphs generated have 10**size edges, for each size listed
+    :param graph_types: the names of the graph generators to use (see graphs.graph_generators)
+    :param backends: the names of the backends to use (see backend_uris); if None, all available backends are used
+    :param repeats: the number of times to repeat each query, the best time being recorded
+    :param log: if not None, a file-like object to which progress is written
+    """
+    uris = backend_uris()
+    if backends is None:
+        backends = sorted(uris.keys())
+
+    results = []
+    for backend in backends:
+        for graph_type in graph_types:
+            for size in sizes:
+                if log is not None:
+                    log.write("%s, %s graph, 10^%d edges\n"%(backend, graph_type, size))
+                    log.flush()
+                results+=run_one(backend, uris[backend], graph_type, 10**size, repeats)
+
+    return {'time': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'platform': platform.platform(),
+            'results': results}
+
+def _result_key(result):
+    return result['backend'], result['graph'], result['n_edges'], result['stage']
+
+def compare(old_run, new_run):
+    """Return a list of (backend, graph, n_edges, stage, old seconds, new seconds) for stages timed in both runs"""
+    old_timings = dict((_result_key(r), r['seconds']) for r in old_run['results'])
+    return [_result_key(r) + (old_timings[_result_key(r)], r['seconds'])
+            for r in new_run['results'] if _result_key(r) in old_timings]
+
+def write_results(run_results, filename):
+    with open(filename, 'w') as f:
+        json.dump(run_results, f, indent=1)
+
+def read_results(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+def print_results(run_results, stream=sys.stdout):
+    stream.write("%-14s %-10s %10s %-16s %12s %12s\n"%("backend", "graph", "edges", "stage", "seconds", "rows"))
+    for r in run_results['results']:
+        stream.write("%-14s %-10s %10d %-16s %12.4f %12s\n"%(r['backend'], r['graph'], r['n_edges'], r['stage'],
+                                                            r['seconds'], "" if r['rows'] is None else r['rows']))
+
+def print_comparison(comparison, stream=sys.stdout):
+    stream.write("%-14s %-10s %10s %-16s %12s %12s %8s\n"%("backend", "graph", "edges", "stage", "old (s)", "new (s)",
+                                                          "speedup"))
+    for backend, graph_type, n_edges, stage, old, new in comparison:
+        stream.write("%-14s %-10s %10d %-16s %12.4f %12.4f %8.2f\n"%(backend, graph_type, n_edges, stage, old, new,
+                                                                    old/new if new>0 else float('inf')))
@@ -1,3 +1,8 @@
+import threading
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
 from .orm import Category
 
 class RaiseException:
@@ -5,30 +10,124 @@ class RaiseException:
 
 
 class CategoryCache(object):
+    """Maps category names to their IDs and back, caching the contents of the categories table.
+
+    Names or IDs that are not in the cache are looked up in the database before giving up, so that categories created
+    by other connections or processes are found without restarting. New categories are created in a way that is safe
+    even if another process creates the same category at the same time."""
+
     def __init__(self, sqlalchemy_session):
         self._name_ids = None
+        self._id_names = None
         self._session = sqlalchemy_session
+        self._engine = sqlalchemy_session.get_bind()
+        self._lock = threading.Lock()
 
-    def get_id(self, name, default=RaiseException):
+    def refresh(self):
+        """Reload the entire contents of the categories table"""
+        id_and_name = self._session.query(Category.id, Category.name).all()
+        with self._lock:
+            self._name_ids = {t:i for i,t in id_and_name}
+            self._id_names = {i:t for i,t in id_and_name}
+
+    def _store(self, id_and_name):
+        with self._lock:
+            for i, t in id_and_name:
+                self._name_ids[t] = i
+                self._id_names[i] = t
 
+    def _ensure_loaded(self):
         if self._name_ids is None:
-            id_and_name = self._session.query(Category.id, Category.name).all()
-            self._name_ids = {t:i for i,t in id_and_name}
+            self.refresh()
+
+    def get_id(self, name, default=RaiseException):
+        """Return the ID of the named category.
 
-        if default is not RaiseException:
-            return self._name_ids.get(name, default)
+        If there is no such category, default is returned if given; otherwise KeyError is raised."""
+        return self.get_ids([name], default)[0]
+
+    def get_ids(self, names, default=RaiseException):
+        """Return a list of the IDs of the named categories, looking up any not yet cached in a single query.
+
+        For any category that does not exist, default is returned in its place if given; otherwise KeyError is raised."""
+        self._ensure_loaded()
+        names = list(names)
+        missing = set(name for name in names if name not in self._name_ids)
+        if len(missing)>0:
+            # the categories may have been created since the cache was loaded
+            categories = Category.__table__
+            self._store(self._session.execute(select([categories.c.id, categories.c.name]).
+                                              where(categories.c.name.in_(missing))).fetchall())
+        return [self._get_cached(self._name_ids, name, default) for name in names]
+
+    def get_name(self, id_, default=RaiseException):
+        """Return the name of the category with the specified ID.
+
+        If there is no such category, default is returned if given; otherwise KeyError is raised."""
+        return self.get_names([id_], default)[0]
+
+    def get_names(self, ids, default=RaiseException):
+        """Return a list of the names of the categories with the specified IDs, looking up any not yet cached at once"""
+        self._ensure_loaded()
+        ids = list(ids)
+        missing = set(id_ for id_ in ids if id_ not in self._id_names)
+        if len(missing)>0:
+            categories = Category.__table__
+            self._store(self._session.execute(select([categories.c.id, categories.c.name]).
+                                              where(categories.c.id.in_(missing))).fetchall())
+        return [self._get_cached(self._id_names, id_, default) for id_ in ids]
+
+    @staticmethod
+    def _get_cached(mapping, key, default):
+        if default is RaiseException:
+            return mapping[key]
         else:
-            return self._name_ids[name]
+            return mapping.get(key, default)
 
     def get_existing_or_new_id(self, name):
+        """Return the ID of the named category, creating the category if it does not exist"""
+        return self.get_existing_or_new_ids([name])[0]
+
+    def get_existing_or_new_ids(self, names):
+        """Return a list of the IDs of the named categories, creating any that do not exist"""
+        names = list(names)
+        ids = self.get_ids(names, None)
+        missing = set(name for name, id_ in zip(names, ids) if id_ is None)
+        if len(missing)==0:
+            return ids
 
-        id_ = self.get_id(name, None)
+        if self._engine.dialect.name == 'sqlite':
+            # as for IdAllocator, sqlite has only one writer at a time, so the categories are created in the current
+            # transaction
+            self._store(self._create_using_connection(self._session.connection(), missing))
+        else:
+            # create the categories in their own transaction, so that they are immediately visible to other processes
+            with self._engine.begin() as connection:
+                self._store(self._create_using_connection(connection, missing))
 
-        if id_ is None:
-            new_category = Category()
-            new_category.name = name
-            self._session.add(new_category)
-            self._session.flush()
-            id_ = self._name_ids[name] = new_category.id
+        return [self._name_ids[name] for name in names]
+
+    @staticmethod
+    def _create_using_connection(connection, names):
+        """Insert categories with the specified names, ignoring any that already exist, then return (id, name) for all
+        of them."""
+        categories = Category.__table__
+        rows = [{'name': name} for name in names]
+        dialect = connection.dialect.name
+        if dialect == 'sqlite':
+            connection.execute(categories.insert().prefix_with("OR IGNORE"), rows)
+        elif dialect == 'mysql':
+            connection.execute(categories.insert().prefix_with("IGNORE"), rows)
+        elif dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            connection.execute(insert(categories).on_conflict_do_nothing(index_elements=['name']), rows)
+        else:
+            for row in rows:
+                try:
+                    with connection.begin_nested():
+                        connection.execute(categories.insert(), row)
+                except IntegrityError:
+                    pass # created by another process in the meantime
 
-        return id_
\ No newline at end of file
+        return connection.execute(select([categories.c.id, categories.c.name]).
+                                  where(categories.c.name.in_(names))).fetchall()
@@ -15,8 +15,19 @@ class Condition(object):
         """Assigns the sql column names to the query, using a dictionary mapping property name to sql column name"""
         pass
 
-    def to_sql(self):
-        """Converts this Condition to a sqlalchemy ClauseElement"""
+    def to_sql(self, bind_names=None):
+        """Converts this Condition to a sqlalchemy ClauseElement
+
+        :param bind_names: if not None, an iterator giving names for the parameters to which literal values are bound;
+          otherwise literal values are bound anonymously
+        """
+        raise ValueError("Not a complete condition")
+
+    def get_plan_key(self, bind_names, parameters):
+        """Return a hashable description of the structure of this condition, for the query plan cache.
+
+        Literal values are not part of the description; instead each is appended to parameters as (name, value), with
+        names taken from bind_names in the same order as to_sql(bind_names) uses them."""
         raise ValueError("Not a complete condition")
 
     def __eq__(self, other):
@@ -83,9 +94,12 @@ class Property(Condition):
     def assign_sql_columns(self, assignment_dictionary):
         self._sql_column = assignment_dictionary[self._name]
 
-    def to_sql(self):
+    def to_sql(self, bind_names=None):
         return self._sql_column
 
+    def get_plan_key(self, bind_names, parameters):
+        return Property, self._name
+
 class BoundProperty(Condition):
     """Represents a property tied to a specific column in a temporary table"""
     def __init__(self, name, sql_id_column):
@@ -102,15 +116,25 @@ class BoundProperty(Condition):
     def assign_sql_columns(self, assignment_dictionary):
         self._sql_column = assignment_dictionary[self._sql_id_column]
 
-    def to_sql(self):
+    def to_sql(self, bind_names=None):
         return self._sql_column
 
+    def get_plan_key(self, bind_names, parameters):
+        return BoundProperty, self._name, self._sql_id_column.name
+
 class Value(Condition):
     def __init__(self, value):
         self._value = value
 
-    def to_sql(self):
-        return sql.literal(self._value)
+    def to_sql(self, bind_names=None):
+        if bind_names is None:
+            return sql.literal(self._value)
+        else:
+            return sql.bindparam(next(bind_names), self._value)
+
+    def get_plan_key(self, bind_names, parameters):
+        parameters.append((next(bind_names), self._value))
+        return Value, type(self._value)
 
 def _to_condition(obj):
     if not isinstance(obj, Condition):
@@ -138,9 +162,13 @@ class BinaryOperator(Condition):
         self._first.assign_sql_columns(assignment_dictionary)
         self._second.assign_sql_columns(assignment_dictionary)
 
-    def to_sql(self):
-        first_sql = self._first.to_sql()
-        second_sql = self._second.to_sql()
+    def get_plan_key(self, bind_names, parameters):
+        return (BinaryOperator, self._comparison_operator, self._first.get_plan_key(bind_names, parameters),
+                self._second.get_plan_key(bind_names, parameters))
+
+    def to_sql(self, bind_names=None):
+        first_sql = self._first.to_sql(bind_names)
+        second_sql = self._second.to_sql(bind_names)
         if isinstance(second_sql.comparator, FlexibleStatementComparator):
             # always give our own comparator precedence
             #
@@ -164,5 +192,8 @@ class UnaryOperator(Condition):
     def assign_sql_columns(self, assignment_dictionary):
         self._underlying.assign_sql_columns(assignment_dictionary)
 
-    def to_sql(self):
-        return self._operator(self._underlying.to_sql())
\ No newline at end of file
+    def get_plan_key(self, bind_names, parameters):
+        return UnaryOperator, self._operator, self._underlying.get_plan_key(bind_names, parameters)
+
+    def to_sql(self, bind_names=None):
+        return self._operator(self._underlying.to_sql(bind_names))
\ No newline at end of file
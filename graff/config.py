@@ -1 +1,15 @@
-category_max_length = 256
\ No newline at end of file
+category_max_length = 256
+
+stream_batch_size = 1000 # default number of rows retrieved at once by BaseQuery.stream()
+
+ingest_chunk_size = 100000 # default number of nodes or edges written per transaction by Connection.load_nodes/load_edges
+
+async_max_workers = 8 # number of threads running asynchronous operations for each Connection; see graff.asynchronous
+
+plan_cache_size = 256 # maximum number of compiled query plans cached by each Connection; 0 disables the cache
+
+result_cache_size = 1000 # default maximum number of results held by Connection.enable_result_cache
+
+in_clause_batch_size = 500 # maximum number of IDs listed in one IN (...) clause, e.g. by Connection.get_properties
+
+snapshot_batch_size = 100000 # number of rows fetched at a time when reading a Connection.snapshot
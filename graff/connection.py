@@ -1,30 +1,261 @@
+import contextlib
+import threading
+import weakref
+
 from .orm import Base, Node, NodeProperty, Edge, EdgeProperty
 from . import query
-from . import category, flexible_value
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from . import category, allocation, flexible_value, orm, add, fast_load, asynchronous, config, plan_cache, traversal, \
+    result_cache
+from sqlalchemy import create_engine, inspect, Index
+from sqlalchemy.orm import sessionmaker, scoped_session
 from six import iteritems
 from six.moves import range
 
+orm_table_names = [orm.Category.__tablename__, Node.__tablename__, Edge.__tablename__,
+                   NodeProperty.__tablename__, EdgeProperty.__tablename__, orm.IdAllocation.__tablename__]
+
 class Connection(object):
-    def __init__(self, db_uri="", sqlalchemy_engine_kwargs={}):
+    def __init__(self, db_uri="", sqlalchemy_engine_kwargs={}, use_cte=None, thread_safe=False):
+        """Connect to a graph database, creating the required tables if they do not already exist.
+
+        :param db_uri: the SQLAlchemy URI for the database, or a filename for an sqlite database. If empty, an
+          in-memory sqlite database is used.
+
+        :param sqlalchemy_engine_kwargs: any additional arguments to pass to sqlalchemy.create_engine
+
+        :param use_cte: if True, queries are compiled into a single WITH ... SELECT statement; if False, each step
+          of a query is materialised into a temporary table. If None (default), common table expressions are used
+          whenever the database backend supports them.
+
+        :param thread_safe: if True, the connection may be shared between threads (e.g. the request threads of a web
+          server). Each thread then has its own SQLAlchemy session, checked out from the engine's connection pool (which
+          can be configured through sqlalchemy_engine_kwargs, e.g. pool_size), and the temp tables for a query are
+          created on the database connection of the thread that runs it. Threads should call release_session() when
+          they have finished with the database, so that their connection is returned to the pool. Individual query
+          objects must still not be shared between threads. Not available for in-memory sqlite databases, since
+          every thread would see a different database.
+        """
         if '//' not in db_uri:
             db_uri = 'sqlite:///' + db_uri
 
         _engine = create_engine(db_uri, **sqlalchemy_engine_kwargs)
-
-        self._SessionClass = sessionmaker(bind=_engine)
-        self._internal_session = self._SessionClass()
-        self.category_cache = category.CategoryCache(self.get_sqlalchemy_session())
+        self._engine = _engine
+        self._engine_kwargs = dict(sqlalchemy_engine_kwargs) # for the engines of parallel_load's worker processes
+
+        # the connection is recorded in each session so that ORM objects can look up category names in its cache
+        self._SessionClass = sessionmaker(bind=_engine, info={'graff_connection': self})
+        self._sessions = weakref.WeakSet() # every session created, so that close() can close them
+        self._sessions_lock = threading.Lock()
+        self.thread_safe = thread_safe
+        if thread_safe:
+            if _engine.dialect.name == 'sqlite' and _engine.url.database in (None, '', ':memory:'):
+                raise ValueError("A thread-safe connection cannot be made to an in-memory sqlite database")
+            # the scoped_session registry proxies each call to the session belonging to the calling thread
+            self._internal_session = scoped_session(self._create_session)
+        else:
+            self._internal_session = self._create_session()
+        self.category_cache = category.CategoryCache(self._internal_session)
+        self.id_allocator = allocation.IdAllocator(self._internal_session)
         Base.metadata.create_all(_engine)
 
+        if use_cte is None:
+            use_cte = self._backend_supports_cte(_engine)
+        self.use_cte = use_cte
+        self.in_bulk_load_mode = False
+        self._async_executor = None # thread pool for asynchronous operations, created when first needed
+        self._async_executor_lock = threading.Lock()
+        self.plan_cache = plan_cache.PlanCache(config.plan_cache_size)
+        self.result_cache = None # see enable_result_cache
+
+    @property
+    def plan_cache_hits(self):
+        """The number of queries that reused a cached query plan; see graff.plan_cache"""
+        return self.plan_cache.hits
+
+    @property
+    def plan_cache_misses(self):
+        """The number of cacheable queries for which a query plan had to be built"""
+        return self.plan_cache.misses
+
+    def enable_result_cache(self, max_size=None, ttl=None):
+        """Cache the results of queries made through this connection, so that repeated queries do not touch the database.
+
+        Results of all(), first(), count() and exists() are cached, keyed on the structure of the query and its
+        literal values. Adding nodes, edges or properties through this connection discards the cached results that
+        depend on the categories involved. Writes made through other connections are not seen until the results
+        expire, or clear_result_cache() is called. Cached results are shared between callers, so should not be
+        modified.
+
+        :param max_size: the maximum number of results held, discarding the least recently used first (default
+          config.result_cache_size)
+        :param ttl: if not None, the number of seconds after which a cached result expires
+        """
+        if max_size is None:
+            max_size = config.result_cache_size
+        self.result_cache = result_cache.ResultCache(max_size, ttl)
+
+    def disable_result_cache(self):
+        """Stop caching the results of queries, discarding any already cached"""
+        self.result_cache = None
+
+    def clear_result_cache(self):
+        """Discard all cached results, e.g. after the database has been written to by another connection"""
+        if self.result_cache is not None:
+            self.result_cache.clear()
+
+    def _invalidate_cached_results(self, category_id, properties=None):
+        """Discard cached results that depend on the given node or edge category, or the categories of the properties
+
+        :param properties: a list of property dictionaries, or None
+        """
+        if self.result_cache is None:
+            return
+        touched = {category_id}
+        if properties is not None:
+            touched.update(self._get_property_category_ids(properties).values())
+        self.result_cache.invalidate(touched)
+
+    @staticmethod
+    def _backend_supports_cte(engine):
+        """Return True if the database backend behind the engine can evaluate common table expressions.
+
+        Window functions are also required, since they are used to number the rows in each expression."""
+        dialect = engine.dialect
+        version = dialect.server_version_info or ()
+        if dialect.name == 'sqlite':
+            return version >= (3, 25)
+        elif dialect.name == 'mysql':
+            if getattr(dialect, '_is_mariadb', False):
+                return version >= (10, 2)
+            else:
+                return version >= (8, 0)
+        elif dialect.name == 'postgresql':
+            return True
+        else:
+            return False
+
+    def ensure_indexes(self, drop_superseded=True):
+        """Create any indexes that are missing from the database, e.g. because it was created by an earlier version.
+
+        Creating indexes on a large existing database can take a long time, so this is never done automatically.
+
+        :param drop_superseded: if True, also drop indexes created by earlier versions that are now redundant
+        :return: a list of the names of the indexes created
+        """
+        session = self.get_sqlalchemy_session()
+        connection = session.connection()
+        inspector = inspect(connection)
+        created = []
+        for table in Base.metadata.sorted_tables:
+            if table.name not in orm_table_names:
+                continue
+            existing = set(index['name'] for index in inspector.get_indexes(table.name))
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(bind=connection)
+                    created.append(index.name)
+            if drop_superseded:
+                for name in orm.superseded_indexes.get(table.name, []):
+                    if name in existing:
+                        self._drop_index(table, name)
+        session.commit()
+        return created
+
+    def _drop_schema_indexes(self, tables):
+        """Drop those indexes in the graff schema for the specified tables that exist in the database.
+
+        The indexes can be recreated with ensure_indexes()."""
+        session = self.get_sqlalchemy_session()
+        connection = session.connection()
+        inspector = inspect(connection)
+        for table in tables:
+            existing = set(index['name'] for index in inspector.get_indexes(table.name))
+            for index in table.indexes:
+                if index.name in existing:
+                    index.drop(bind=connection)
+        session.commit()
+
+    @contextlib.contextmanager
+    def bulk_load_mode(self):
+        """Return a context manager within which large amounts of data can be loaded quickly.
+
+        On entry, the secondary indexes are dropped from the nodes, edges and property tables, so that inserts do not
+        have to maintain them; and backend-specific settings that trade durability for speed are applied (sqlite
+        synchronous=OFF and journal_mode=MEMORY; MySQL unique_checks=0 and foreign_key_checks=0; PostgreSQL
+        synchronous_commit=off). On exit, the settings are restored and the indexes rebuilt.
+
+        Queries made within the context will run slowly without the indexes, and a crash during loading may leave an
+        sqlite database corrupted, so this is intended for the initial population of a new database.
+
+        Example::
+
+            with connection.bulk_load_mode():
+                connection.load_nodes("person", properties=...)
+                connection.load_edges("likes", ...)
+        """
+        if self.in_bulk_load_mode:
+            yield
+            return
+
+        session = self.get_sqlalchemy_session()
+        session.commit() # so that subsequent work happens on newly checked-out connections, with the settings applied
+        settings = fast_load.FastLoadSettings(self._engine)
+        settings.install()
+        self.in_bulk_load_mode = True
+        try:
+            self._drop_schema_indexes([Node.__table__, Edge.__table__, NodeProperty.__table__,
+                                       EdgeProperty.__table__])
+            try:
+                yield
+            except:
+                session.rollback()
+                raise
+            else:
+                session.commit()
+            finally:
+                self.ensure_indexes(drop_superseded=False)
+        finally:
+            self.in_bulk_load_mode = False
+            settings.uninstall()
+
+    def _drop_index(self, table, name):
+        """Drop the named index on the specified table, whether or not it is part of the current schema"""
+        index = Index(name)
+        index.table = table # needed by some dialects to render DROP INDEX, but does not add the index to the schema
+        index.drop(bind=self.get_sqlalchemy_session().connection())
+
     def get_sqlalchemy_session(self):
-        """Returns the SQLAlchemy Session object that queries will be based upon"""
-        return self._internal_session
+        """Returns the SQLAlchemy Session object that queries will be based upon.
+
+        For a thread-safe connection, this is the session belonging to the calling thread."""
+        if self.thread_safe:
+            return self._internal_session()
+        else:
+            return self._internal_session
+
+    def release_session(self):
+        """Close the calling thread's session, returning its database connection to the pool.
+
+        Only needed for a thread-safe connection, typically at the end of each request; a new session is created the
+        next time the thread uses the connection. Any uncommitted changes are discarded."""
+        if self.thread_safe:
+            self._internal_session.remove()
+
+    def _create_session(self):
+        session = self._SessionClass()
+        with self._sessions_lock:
+            self._sessions.add(session)
+        return session
 
     def close(self):
-        """Close the connection"""
-        self._internal_session.close_all()
+        """Close the connection, including the sessions of all threads"""
+        if self._async_executor is not None:
+            self._async_executor.shutdown()
+            self._async_executor = None
+        with self._sessions_lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            session.close()
 
     def query_node(self, *args):
         """Returns a query for nodes, optionally of a given category"""
@@ -34,6 +265,113 @@ class Connection(object):
         """Returns a query for edges, optionally of a given category"""
         return query.edge.EdgeQuery(self, *args)
 
+    def bfs(self, sources, max_depth, category=None, direction="out"):
+        """Search breadth-first from the source nodes, returning the distance to every node within max_depth edges.
+
+        Each level of the search is a single SQL statement; see graff.traversal.
+
+        :param sources: a sequence of nodes or node IDs, which are at distance zero
+        :param category: follow only edges of the named category; or if None, follow all edges
+        :param direction: "out" to follow edges forwards, "in" to follow them backwards, or "any" for both
+        :return: a dictionary mapping the ID of each node reached to its distance from the nearest source
+        """
+        return traversal.bfs(self.get_sqlalchemy_session(), [self._get_node_id(node) for node in sources], max_depth,
+                             self._get_edge_category_id(category), direction)
+
+    def shortest_path(self, source, target, category=None, max_hops=6, direction="out"):
+        """Return a shortest path between two nodes, searching from both ends until the searches meet.
+
+        :param source, target: the nodes (or node IDs) at either end of the path
+        :param category, direction: as for bfs()
+        :param max_hops: the maximum number of edges in the path
+        :return: a list of the IDs of the nodes on the path, starting with source and ending with target; or None if
+          there is no path of at most max_hops edges
+        """
+        return traversal.shortest_path(self.get_sqlalchemy_session(), self._get_node_id(source),
+                                       self._get_node_id(target), self._get_edge_category_id(category), max_hops,
+                                       direction)
+
+    def snapshot(self, edge_category=None, node_properties=(), edge_properties=(), node_category=None):
+        """Read the edges of the graph into memory, for fast repeated traversal with numpy.
+
+        The edges are held in compressed sparse row form; neighbours, degrees and searches are then computed without
+        further queries. Call refresh() on the snapshot to read edges added since it was taken. Requires numpy.
+
+        :param edge_category: read only edges of the named category; or if None, read all edges
+        :param node_properties, edge_properties: names of properties to read into arrays as well
+        :param node_category: if not None, only nodes of the named category are counted as part of the snapshot (e.g.
+          by the algorithms in graff.algorithms)
+        :rtype: graff.snapshot.Snapshot
+        """
+        from .snapshot import Snapshot
+        return Snapshot(self, edge_category, node_properties, edge_properties, node_category)
+
+    def load_snapshot(self, directory):
+        """Open a snapshot saved with Snapshot.save as read-only memory maps, without reading the database.
+
+        Call is_stale() on the snapshot to check cheaply whether nodes, edges or properties have been added since it
+        was taken, and refresh() to read them.
+
+        :rtype: graff.snapshot.Snapshot
+        """
+        from .snapshot import Snapshot
+        return Snapshot.load(directory, self)
+
+    @staticmethod
+    def _get_node_id(node):
+        return node.id if isinstance(node, Node) else int(node)
+
+    def _get_edge_category_id(self, category):
+        return None if category is None else self.category_cache.get_id(category)
+
+    def get_properties(self, node_ids):
+        """Return the properties of many nodes at once, without constructing ORM objects.
+
+        The properties are retrieved in a single query for each config.in_clause_batch_size IDs, rather than one query
+        per node as when calling dict() on each node in turn.
+
+        :param node_ids: a sequence of node IDs
+        :return: a dictionary mapping each node ID to a dictionary of its property names and values
+        """
+        return self._get_properties(NodeProperty, NodeProperty.node_id, node_ids)
+
+    def get_edge_properties(self, edge_ids):
+        """Return the properties of many edges at once; see get_properties"""
+        return self._get_properties(EdgeProperty, EdgeProperty.edge_id, edge_ids)
+
+    def _get_properties(self, class_, id_column, ids):
+        session = self.get_sqlalchemy_session()
+        ids = [int(id_) for id_ in ids]
+        results = {id_: {} for id_ in ids}
+        for start in range(0, len(ids), config.in_clause_batch_size):
+            rows = session.query(id_column, class_.category_id, class_.value_int, class_.value_float, class_.value_str).\
+                filter(id_column.in_(ids[start:start+config.in_clause_batch_size])).all()
+            category_ids = list(set(row[1] for row in rows))
+            names = dict(zip(category_ids, self.category_cache.get_names(category_ids)))
+            for id_, category_id, value_int, value_float, value_str in rows:
+                results[id_][names[category_id]] = flexible_value.FlexibleValue(value_int, value_float, value_str).value
+        return results
+
+    def store_node_property(self, name, node_ids, values, chunk_size=None, progress=None):
+        """Set the named property of many existing nodes, replacing any values they already have.
+
+        Existing values are deleted and the new values inserted with a single DBAPI executemany per chunk, so this is
+        suitable for writing back the results of whole-graph computations, e.g. from graff.algorithms.
+
+        :param name: the name of the property
+        :param node_ids: a sequence, iterable or numpy array of node IDs (or Node objects)
+        :param values: a sequence, iterable or numpy array of values, one per node; where a value is None or NaN, the
+          node's property is removed instead
+        :param chunk_size: the number of nodes to write per transaction (default config.ingest_chunk_size)
+        :param progress: if not None, a function called with an IngestionReport after each chunk is committed
+        :return: an IngestionReport
+        """
+        return add.store_property(self, NodeProperty, name, node_ids, values, chunk_size, progress)
+
+    def store_edge_property(self, name, edge_ids, values, chunk_size=None, progress=None):
+        """Set the named property of many existing edges; see store_node_property"""
+        return add.store_property(self, EdgeProperty, name, edge_ids, values, chunk_size, progress)
+
     def add_node(self, category, properties=None):
         """Add a node of the specified category
 
@@ -46,8 +384,9 @@ class Connection(object):
         :return: the new node
         :rtype: Node
         """
-        new_node = Node()
-        new_node.category_id = self.category_cache.get_existing_or_new_id(category)
+        category_id = self.category_cache.get_existing_or_new_id(category)
+        new_node = Node(id=self.id_allocator.reserve(Node, 1))
+        new_node.category_id = category_id
         session = self.get_sqlalchemy_session()
         session.add(new_node)
         session.flush()
@@ -56,6 +395,7 @@ class Connection(object):
             self._bulk_insert_properties(new_node.id, [properties], NodeProperty)
 
         session.commit()
+        self._invalidate_cached_results(category_id, [properties] if properties else None)
         return new_node
 
     def add_nodes(self, category, number, properties=None):
@@ -73,10 +413,10 @@ class Connection(object):
         session = self.get_sqlalchemy_session()
 
         category_id = self.category_cache.get_existing_or_new_id(category)
-        first_node_id = self._get_next_id(Node)
+        first_node_id = self.id_allocator.reserve(Node, number)
         session.bulk_insert_mappings(
             Node,
-            [{'category_id': category_id}]*number
+            [{'id': first_node_id+i, 'category_id': category_id} for i in range(number)]
         )
 
         if properties is not None:
@@ -84,15 +424,22 @@ class Connection(object):
                 raise ValueError("Incorrect number of property dictionaries passed to add_nodes")
             self._bulk_insert_properties(first_node_id, properties, NodeProperty)
         session.commit()
+        self._invalidate_cached_results(category_id, properties)
 
-    def _get_next_id(self, class_):
-        session = self.get_sqlalchemy_session()
-        first_id = session.query(class_.id).order_by(class_.id.desc()).first()
-        if first_id is None:
-            first_id = 1
-        else:
-            first_id = first_id[0] + 1
-        return first_id
+    def add_nodes_async(self, category, number, properties=None):
+        """Add multiple nodes in a worker thread, returning an asyncio future that completes once they are committed.
+
+        The connection must have been opened with thread_safe=True; see graff.asynchronous. Arguments are as for
+        add_nodes."""
+        return asynchronous.run(self, self.add_nodes, category, number, properties)
+
+    def _get_property_category_ids(self, properties):
+        """Return a dictionary mapping the name of every property in a list of property dictionaries to its category
+        ID, creating any categories that do not yet exist"""
+        names = set()
+        for props in properties:
+            names.update(props.keys())
+        return dict(zip(names, self.category_cache.get_existing_or_new_ids(names)))
 
     def _bulk_insert_properties(self, first_parent_id, properties, class_):
         """Add properties for a sequential series of Nodes or Edges.
@@ -110,10 +457,11 @@ class Connection(object):
             raise ValueError("Unknown storage class passed to _bulk_insert_properties")
 
         session = self.get_sqlalchemy_session()
+        category_ids = self._get_property_category_ids(properties)
         property_object_mappings = []
         for i, props in enumerate(properties):
             for category, value in iteritems(props):
-                category_id = self.category_cache.get_existing_or_new_id(category)
+                category_id = category_ids[category]
                 dict_this_property = {id_name: first_parent_id + i, 'category_id': category_id}
                 flexible_value.flexible_set_value(dict_this_property, value, attr=False, null_others=False)
                 property_object_mappings.append(dict_this_property)
@@ -126,12 +474,14 @@ class Connection(object):
             node_from = node_from.id
         if isinstance(node_to, Node):
             node_to = node_to.id
-        edge = Edge(category_id = category_id, node_from_id=node_from, node_to_id=node_to)
+        edge = Edge(id=self.id_allocator.reserve(Edge, 1), category_id = category_id, node_from_id=node_from,
+                    node_to_id=node_to)
         session.add(edge)
         session.flush()
         if properties is not None:
             self._bulk_insert_properties(edge.id, [properties], EdgeProperty)
         session.commit()
+        self._invalidate_cached_results(category_id, [properties] if properties else None)
         return edge
 
     def add_edges(self, category, mapping_pairs, properties=None):
@@ -150,7 +500,6 @@ class Connection(object):
 
         category_id = self.category_cache.get_existing_or_new_id(category)
         edges = []
-        first_edge_id = self._get_next_id(Edge)
         for a,b in mapping_pairs:
             if isinstance(a, Node):
                 a = a.id
@@ -158,6 +507,10 @@ class Connection(object):
                 b = b.id
             edges.append({'category_id': category_id, 'node_from_id': a, 'node_to_id': b})
 
+        first_edge_id = self.id_allocator.reserve(Edge, len(edges))
+        for i, edge in enumerate(edges):
+            edge['id'] = first_edge_id + i
+
         session.bulk_insert_mappings(Edge, edges)
         if properties is not None:
             if len(properties) != len(mapping_pairs):
@@ -165,4 +518,61 @@ class Connection(object):
             self._bulk_insert_properties(first_edge_id, properties, EdgeProperty)
 
         session.commit()
+        self._invalidate_cached_results(category_id, properties)
+
+    def add_edges_async(self, category, mapping_pairs, properties=None):
+        """Add multiple edges in a worker thread, returning an asyncio future that completes once they are committed.
+
+        The connection must have been opened with thread_safe=True; see graff.asynchronous. Arguments are as for
+        add_edges."""
+        return asynchronous.run(self, self.add_edges, category, mapping_pairs, properties)
+
+    def load_nodes(self, category, number=None, properties=None, chunk_size=None, progress=None):
+        """Add a potentially very large number of nodes of the specified category, committing in chunks.
+
+        Unlike add_nodes, the properties can be supplied by a generator or as numpy arrays, and are converted and
+        written one chunk at a time. Each chunk is committed separately, so if an error occurs part way through, the
+        nodes already written remain in the database.
+
+        :param category: the category for the new nodes
+        :type category: basestring
+
+        :param number: the number of nodes to create; may be omitted if properties are given
+
+        :param properties: either an iterable of property dictionaries, one per node; or a dictionary mapping property
+          names to sequences or numpy arrays of values, one per node (with None for a missing value)
+
+        :param chunk_size: the number of nodes to write per transaction (default config.ingest_chunk_size)
+
+        :param progress: if not None, a function called with an IngestionReport after each chunk is committed
+
+        :return: an IngestionReport giving the number of rows written and the throughput
+        """
+        return add.load_nodes(self, category, number, properties, chunk_size, progress)
+
+    def load_edges(self, category, node_from, node_to=None, properties=None, chunk_size=None, progress=None):
+        """Add a potentially very large number of edges of the specified category, committing in chunks.
+
+        Unlike add_edges, the edges and their properties can be supplied by generators or as numpy arrays, and are
+        converted and written one chunk at a time. Each chunk is committed separately, so if an error occurs part way
+        through, the edges already written remain in the database.
+
+        :param category: the category for the new edges
+        :type category: basestring
+
+        :param node_from: if node_to is None, an iterable of (from, to) pairs or an array of shape (N, 2); otherwise, an
+          iterable or array of the IDs of the nodes each edge starts from. Nodes may be given as IDs or Node objects.
+
+        :param node_to: an iterable or array of the IDs of the nodes each edge leads to
+
+        :param properties: either an iterable of property dictionaries, one per edge; or a dictionary mapping property
+          names to sequences or numpy arrays of values, one per edge (with None for a missing value)
+
+        :param chunk_size: the number of edges to write per transaction (default config.ingest_chunk_size)
+
+        :param progress: if not None, a function called with an IngestionReport after each chunk is committed
+
+        :return: an IngestionReport giving the number of rows written and the throughput
+        """
+        return add.load_edges(self, category, node_from, node_to, properties, chunk_size, progress)
 
@@ -0,0 +1,65 @@
+"""Backend-specific settings that speed up bulk loading at the expense of durability. See Connection.bulk_load_mode."""
+
+from sqlalchemy import event
+
+# For each dialect, a list of (statement to query the current value, statement to set a value, value for fast loading)
+fast_load_settings = {
+    'sqlite': [("PRAGMA synchronous", "PRAGMA synchronous=%s", "OFF"),
+               ("PRAGMA journal_mode", "PRAGMA journal_mode=%s", "MEMORY")],
+    'mysql': [("SELECT @@SESSION.unique_checks", "SET SESSION unique_checks=%s", "0"),
+              ("SELECT @@SESSION.foreign_key_checks", "SET SESSION foreign_key_checks=%s", "0")],
+    'postgresql': [("SHOW synchronous_commit", "SET synchronous_commit TO %s", "off")]
+}
+
+# Current values that must not be changed, because changing away from them is persistent rather than per-connection
+_preserved_values = {"wal"}
+
+def _execute(dbapi_connection, statement):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(statement)
+        if cursor.description is not None:
+            return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+class FastLoadSettings(object):
+    """Applies the fast-load settings to each connection checked out from an engine's pool, and restores the
+    original values when it is checked back in."""
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._settings = fast_load_settings.get(engine.dialect.name, [])
+        self._original_values = {} # maps id of each DBAPI connection to the list of (set statement, original value)
+        self._installed = False
+
+    def install(self):
+        if self._installed:
+            return
+        event.listen(self._engine, "checkout", self._on_checkout)
+        event.listen(self._engine, "checkin", self._on_checkin)
+        self._installed = True
+
+    def uninstall(self):
+        if not self._installed:
+            return
+        event.remove(self._engine, "checkout", self._on_checkout)
+        event.remove(self._engine, "checkin", self._on_checkin)
+        self._installed = False
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        original_values = []
+        for query_statement, set_statement, fast_value in self._settings:
+            value = _execute(dbapi_connection, query_statement)
+            if str(value).lower() in _preserved_values:
+                continue
+            _execute(dbapi_connection, set_statement % fast_value)
+            original_values.append((set_statement, value))
+        self._original_values[id(dbapi_connection)] = original_values
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        if dbapi_connection is None:
+            return # the connection has been invalidated
+        for set_statement, value in reversed(self._original_values.pop(id(dbapi_connection), [])):
+            _execute(dbapi_connection, set_statement % value)
@@ -1,6 +1,7 @@
 from .compatibility import partialmethod
 from sqlalchemy.orm.properties import CompositeProperty
-from sqlalchemy import func
+from sqlalchemy import func, literal, or_, case, false, Integer, Numeric, String, Boolean
+from sqlalchemy.sql.expression import ClauseElement, BindParameter
 
 def flexible_set_value(object, value, attr=True, null_others=True):
     """Given an object, set either value_int, value_str, or value_float as appropriate.
@@ -9,15 +10,7 @@ def flexible_set_value(object, value, attr=True, null_others=True):
     :param null_others: if True, the remaining values are set to None. If False, they are ignored.
     """
     all_names = ['value_float', 'value_int', 'value_str']
-
-    if isinstance(value, float):
-        assigned_name = 'value_float'
-    elif isinstance(value, int):
-        assigned_name = 'value_int'
-    elif isinstance(value, str):
-        assigned_name = 'value_str'
-    else:
-        raise TypeError("Unable to assign this value to any of "+str(all_names))
+    assigned_name = flexible_value_column_name(value)
 
     if attr:
         set_function = object.__setattr__
@@ -31,10 +24,69 @@ def flexible_set_value(object, value, attr=True, null_others=True):
             if other_name!=assigned_name:
                 set_function(other_name, None)
 
+def flexible_value_column_name(value):
+    """Return the name of the column, out of value_int, value_float and value_str, in which to store the value"""
+    if isinstance(value, float):
+        return 'value_float'
+    elif isinstance(value, int):
+        return 'value_int'
+    elif isinstance(value, str):
+        return 'value_str'
+    else:
+        raise TypeError("Unable to assign this value to any of ['value_float', 'value_int', 'value_str']")
+
+def flexible_value_tuple(value):
+    """Return a tuple (value_int, value_float, value_str), with the value in the appropriate position"""
+    name = flexible_value_column_name(value)
+    if name=='value_int':
+        return value, None, None
+    elif name=='value_float':
+        return None, value, None
+    else:
+        return None, None, value
+
+def flexible_values_to_array(values_int, values_float, values_str):
+    """Given sequences of value_int, value_float and value_str, return a numpy array of the values they represent.
+
+    The array has dtype int64 if only integers are present; float64 if only numbers are present, with missing values
+    (i.e. where all three inputs are None) set to NaN; and object otherwise, with missing values set to None.
+    """
+    import numpy as np
+    values_int = np.asarray(values_int, dtype=object).reshape(-1)
+    values_float = np.asarray(values_float, dtype=object).reshape(-1)
+    values_str = np.asarray(values_str, dtype=object).reshape(-1)
+
+    have_int = np.not_equal(values_int, None)
+    have_float = np.not_equal(values_float, None)
+    have_str = np.not_equal(values_str, None)
+
+    if have_int.all():
+        return values_int.astype(np.int64)
+    elif not have_str.any():
+        result = np.empty(len(values_int), dtype=np.float64)
+        result.fill(np.nan)
+        result[have_float] = values_float[have_float]
+        result[have_int] = values_int[have_int]
+        return result
+    else:
+        result = np.empty(len(values_int), dtype=object)
+        result[have_str] = values_str[have_str]
+        result[have_float] = values_float[have_float]
+        result[have_int] = values_int[have_int]
+        return result
+
 class FlexibleOperators(object):
     def _get_composite_values_or_elements(self):
         return []
 
+    def _get_elements_comparable_to(self, other):
+        """Return the subset of the composite values or elements that it makes sense to combine with other"""
+        return self._get_composite_values_or_elements()
+
+    def _get_mismatched_type_results(self, other, op):
+        """Return any further results to coalesce with those of op(element, other) for the comparable elements"""
+        return []
+
     @classmethod
     def _coalesce(self, *args):
         return False
@@ -58,12 +110,16 @@ class FlexibleOperators(object):
             return self._coalesce(*[self._op_or_None(a, b, op) for a, b in
                                     zip(self._get_composite_values_or_elements(), other.__composite_values__())])
         else:
-            return self._coalesce(*[self._op_or_None(a, other, op) for a in self._get_composite_values_or_elements()])
+            return self._coalesce(*([self._op_or_None(a, other, op) for a in self._get_elements_comparable_to(other)] +
+                                    self._get_mismatched_type_results(other, op)))
 
     def _reverse_intelligent_operator(self, other, op="__gt__"):
-        return self._coalesce(*[self._op_or_None(other, a, op) for a in self._get_composite_values_or_elements()])
+        return self._coalesce(*([self._op_or_None(other, a, op) for a in self._get_elements_comparable_to(other)] +
+                                self._get_mismatched_type_results(other, op)))
 
 
+_comparison_operators = {"__gt__", "__lt__", "__ge__", "__le__", "__eq__", "__ne__"}
+
 for op in "gt", "lt", "ge", "le", "eq", "ne", "div", "mul", "truediv", \
           "rtruediv", "rdiv", "rmul", "add", "sub", "radd", "rsub":
     opname = "__" + op + "__"
@@ -71,12 +127,70 @@ for op in "gt", "lt", "ge", "le", "eq", "ne", "div", "mul", "truediv", \
                                                       op=opname))
 
 
+def _literal_sql_types(other):
+    """Return the SQL types of column that can hold a value comparable to the literal other, or None if unknown.
+
+    Expressions other than literals (e.g. other columns) return None, since their type is not reliably known."""
+    if isinstance(other, BindParameter):
+        sql_type = other.type
+    elif isinstance(other, ClauseElement):
+        return None
+    else:
+        sql_type = literal(other).type
+
+    if isinstance(sql_type, Boolean):
+        return None
+    elif isinstance(sql_type, (Integer, Numeric)):
+        return Integer, Numeric
+    elif isinstance(sql_type, String):
+        return String,
+    else:
+        return None
+
+
 class FlexibleStatementComparator(FlexibleOperators, CompositeProperty.Comparator):
-    _coalesce = func.coalesce
+    @classmethod
+    def _coalesce(cls, *args):
+        if len(args)==1:
+            return args[0]
+        else:
+            return func.coalesce(*args)
 
     def _get_composite_values_or_elements(self):
         return self.__clause_element__().clauses
 
+    def _get_elements_comparable_to(self, other):
+        # When comparing with a literal of known type, only the matching value_int/value_float or value_str columns
+        # can give a meaningful answer. Restricting to those keeps cross-type comparisons (which differ between
+        # database backends) out of the generated SQL, and gives simpler expressions to the query planner.
+        elements = self._get_composite_values_or_elements()
+        sql_types = _literal_sql_types(other)
+        if sql_types is None:
+            return elements
+        matching_elements = [e for e in elements if isinstance(e.type, sql_types)]
+        return matching_elements or elements
+
+    def _get_mismatched_type_results(self, other, op):
+        # A comparison with a value stored in a column of another type is false, not NULL: filter() keeps rows for
+        # which the condition is NULL, which must only happen when the property is missing altogether.
+        if op not in _comparison_operators:
+            return []
+        comparable_elements = self._get_elements_comparable_to(other)
+        other_elements = [e for e in self._get_composite_values_or_elements()
+                          if not any(e is comparable for comparable in comparable_elements)]
+        if len(other_elements)==0:
+            return []
+        return [case([(or_(*[e.isnot(None) for e in other_elements]), false())])]
+
+    def any_satisfies(self, other, op):
+        """Return a SQL condition that is true where the stored value satisfies op(value, other).
+
+        Unlike the standard operators, which coalesce over the value columns, this returns a disjunction of
+        type-specific comparisons (e.g. value_int > 30 OR value_float > 30). Where the value does not satisfy the
+        comparison, the result may therefore be NULL rather than false, so it is suitable only for selecting matching
+        rows -- but in that role it can be evaluated using indexes on the individual value columns."""
+        return or_(*[op(a, other) for a in self._get_elements_comparable_to(other)])
+
 
 class FlexibleValue(FlexibleOperators):
     @classmethod
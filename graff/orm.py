@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, Float, String, ForeignKey, Index, Text
+from sqlalchemy import Column, Integer, Float, String, ForeignKey, Index, Text, event
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, composite
+from sqlalchemy.orm import relationship, composite, object_session
 
 from . import config
 from .flexible_value import FlexibleValue, FlexibleStatementComparator
@@ -18,10 +18,52 @@ class Category(Base):
         return "<Category %r>" % self.name
 
 
+class IdAllocation(Base):
+    """Records the next free ID for each table, so that ranges of IDs can be reserved by concurrent writers"""
+    __tablename__ = "idallocations"
+
+    table_name = Column(String(config.category_max_length), primary_key=True)
+    next_id = Column(Integer, nullable=False)
+
+
+def _record_graff_connection(instance, context):
+    # objects can outlive the session that loaded them, e.g. the results of asynchronous queries, whose worker thread
+    # releases its session once the query completes. There is no query context for objects copied by merge(load=False),
+    # such as cached results (see result_cache._attached_copy)
+    if context is not None:
+        instance._graff_connection = context.session.info.get('graff_connection')
+
+def _get_category_names(instance, category_ids):
+    """Return the names of the categories with the given IDs, for an object loaded from the database.
+
+    The names are taken from the CategoryCache of the graff Connection that owns the object's session (or that loaded
+    it, if it has since been detached), avoiding a query per object. Returns None if there is no such connection."""
+    session = object_session(instance)
+    if session is not None and 'graff_connection' in session.info:
+        graph_connection = session.info['graff_connection']
+    else:
+        graph_connection = getattr(instance, '_graff_connection', None)
+    if graph_connection is None:
+        return None
+    return graph_connection.category_cache.get_names(category_ids)
+
+
 class SupportsCastToDict(object):
     def __iter__(self):
-        for property_item in self.properties:
-            yield property_item.category.name, property_item.value
+        properties = self.properties
+        names = _get_category_names(self, [property_item.category_id for property_item in properties])
+        if names is None:
+            names = [property_item.category.name for property_item in properties]
+        for name, property_item in zip(names, properties):
+            yield name, property_item.value
+
+    def _get_category_name(self):
+        if self.category_id is None:
+            return None
+        names = _get_category_names(self, [self.category_id])
+        if names is None:
+            return self.category.name
+        return names[0]
 
 
 class Node(Base, SupportsCastToDict):
@@ -32,10 +74,10 @@ class Node(Base, SupportsCastToDict):
     category = relationship(Category)
 
     def __repr__(self):
-        if self.category is not None:
-            return "<Node id=%d category=%r>" % (self.id, self.category.name)
+        if self.category_id is not None:
+            return "<Node id=%d category=%r>" % (self.id, self._get_category_name())
         else:
-            return "<Node id=%d category=???>"
+            return "<Node id=%d category=???>" % self.id
 
 
 class Edge(Base, SupportsCastToDict):
@@ -51,7 +93,7 @@ class Edge(Base, SupportsCastToDict):
     category = relationship(Category)
 
     def __repr__(self):
-        return "<Edge (%d -> %d) category=%r>" % (self.node_from_id, self.node_to_id, self.category.name)
+        return "<Edge (%d -> %d) category=%r>" % (self.node_from_id, self.node_to_id, self._get_category_name())
 
 
 
@@ -87,9 +129,29 @@ class EdgeProperty(Base):
     value = composite(FlexibleValue, value_int, value_float, value_str, comparator_factory=FlexibleStatementComparator)
 
 
-Index("edges_node_from_index", Edge.__table__.c.node_from_id)
-Index("edges_node_to_index", Edge.__table__.c.node_to_id)
+Index("edges_node_from_category_index", Edge.__table__.c.node_from_id, Edge.__table__.c.category_id)
+Index("edges_node_to_category_index", Edge.__table__.c.node_to_id, Edge.__table__.c.category_id)
 Index("node_index", Node.__table__.c.id)
 Index("edge_index", Edge.__table__.c.id)
-Index("nodeproperties_node_index", NodeProperty.__table__.c.node_id)
-Index("edgeproperties_edge_index", EdgeProperty.__table__.c.edge_id)
+Index("nodes_category_index", Node.__table__.c.category_id)
+Index("nodeproperties_node_category_index", NodeProperty.__table__.c.node_id, NodeProperty.__table__.c.category_id)
+Index("edgeproperties_edge_category_index", EdgeProperty.__table__.c.edge_id, EdgeProperty.__table__.c.category_id)
+
+# Value indexes, allowing nodes to be looked up by property value (see NodeQuery.where_property). MySQL can only index
+# a prefix of a TEXT column.
+Index("nodeproperties_category_value_int_index",
+      NodeProperty.__table__.c.category_id, NodeProperty.__table__.c.value_int)
+Index("nodeproperties_category_value_float_index",
+      NodeProperty.__table__.c.category_id, NodeProperty.__table__.c.value_float)
+Index("nodeproperties_category_value_str_index",
+      NodeProperty.__table__.c.category_id, NodeProperty.__table__.c.value_str,
+      mysql_length={'value_str': config.category_max_length})
+
+# Indexes created by earlier versions, which are now redundant because they form the prefix of a composite index above
+superseded_indexes = {"edges": ["edges_node_from_index", "edges_node_to_index"],
+                      "nodeproperties": ["nodeproperties_node_index"],
+                      "edgeproperties": ["edgeproperties_edge_index"]}
+
+
+for _class in Node, Edge:
+    event.listen(_class, 'load', _record_graff_connection)
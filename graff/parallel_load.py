@@ -0,0 +1,165 @@
+"""Load large numbers of nodes or edges using a pool of worker processes.
+
+The input is split into chunks in the calling process. Each chunk is assigned a range of IDs and the IDs of the
+categories it needs, then handed to a worker, which converts it into rows. On database servers (e.g. MySQL or
+PostgreSQL) each worker then writes its rows through its own engine, created with the same sqlalchemy_engine_kwargs as
+the connection's, so that loading scales with the number of cores.
+SQLite allows only one writer at a time, so there the rows are instead passed back and written by the calling process.
+
+The interface mirrors Connection.load_nodes and Connection.load_edges. Requires concurrent.futures, which is part of
+the standard library in python 3 (install the 'futures' package for python 2)."""
+
+import collections
+import multiprocessing
+import pickle
+import time
+
+from sqlalchemy import create_engine
+from six.moves import range
+
+from . import add, config
+from .orm import Node, Edge, NodeProperty, EdgeProperty
+
+_tables = {'node': (Node, NodeProperty, ['id', 'category_id']),
+           'edge': (Edge, EdgeProperty, ['id', 'node_from_id', 'node_to_id', 'category_id'])}
+
+_worker_engines = {} # engines created in a worker process, keyed by database URI and engine arguments
+
+def _get_worker_engine(db_uri, engine_kwargs):
+    key = (db_uri, repr(sorted(engine_kwargs.items())))
+    if key not in _worker_engines:
+        _worker_engines[key] = create_engine(db_uri, **engine_kwargs)
+    return _worker_engines[key]
+
+def _process_chunk(db_uri, engine_kwargs, kind, first_id, category_id, rows, properties, property_category_ids):
+    """Convert a chunk of input into rows, and write them if db_uri is given. Runs in a worker process.
+
+    :param rows: for nodes, the number of nodes; for edges, a list of (from, to) pairs
+    :param properties: a chunk of properties as yielded by add._property_slices(..., as_dicts=False), or None
+    :return: if db_uri is None, the rows and property rows to be written; otherwise, the number of each written
+    """
+    class_, property_class, column_names = _tables[kind]
+    if kind=='node':
+        rows = [(first_id + i, category_id) for i in range(rows)]
+    else:
+        rows = [(first_id + i, add._node_id(a), add._node_id(b), category_id) for i, (a, b) in enumerate(rows)]
+
+    if properties is not None:
+        if isinstance(properties, tuple):
+            properties = add._property_dicts(*properties)
+        properties = add.property_rows(first_id, properties, property_category_ids.__getitem__)
+
+    if db_uri is None:
+        return rows, properties
+
+    with _get_worker_engine(db_uri, engine_kwargs).begin() as connection:
+        add.executemany(connection, class_.__table__, column_names, rows)
+        if properties:
+            add.executemany(connection, property_class.__table__, add.property_column_names[property_class],
+                            properties)
+    return len(rows), len(properties or [])
+
+def _property_names(properties):
+    if isinstance(properties, tuple):
+        return properties[0]
+    names = set()
+    for props in properties:
+        names.update(props.keys())
+    return names
+
+def _load(graph_connection, kind, category, chunks, n_workers, defer_indexes, progress):
+    from concurrent.futures import ProcessPoolExecutor
+
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    class_, property_class, column_names = _tables[kind]
+    session = graph_connection.get_sqlalchemy_session()
+    engine = session.get_bind()
+    engine_kwargs = {}
+    if engine.dialect.name=='sqlite':
+        worker_db_uri = None # workers return the rows, which are written by this process
+    else:
+        worker_db_uri = str(engine.url)
+        engine_kwargs = graph_connection._engine_kwargs
+        try:
+            pickle.dumps(engine_kwargs)
+        except Exception:
+            raise ValueError("The sqlalchemy_engine_kwargs of the connection cannot be passed to worker processes, so "
+                             "parallel loading is not possible; use Connection.load_nodes or load_edges instead")
+
+    loader = add.BulkLoader(graph_connection, progress)
+    category_cache = graph_connection.category_cache
+    category_id = category_cache.get_existing_or_new_id(category)
+    session.commit()
+
+    if graph_connection.in_bulk_load_mode:
+        defer_indexes = False # indexes have already been dropped, and will be rebuilt when bulk load mode exits
+    if defer_indexes:
+        graph_connection._drop_schema_indexes([class_.__table__, property_class.__table__])
+
+    start = time.time()
+
+    def collect(future, submitted):
+        result = future.result()
+        if worker_db_uri is None:
+            rows, properties = result
+            loader.write_prepared_chunk(class_, column_names, rows, property_class, properties, submitted)
+        else:
+            loader.record_chunk(result[0], result[1], time.time()-submitted)
+
+    try:
+        with ProcessPoolExecutor(n_workers) as executor:
+            pending = collections.deque()
+            for rows, properties in chunks:
+                n_rows = rows if kind=='node' else len(rows)
+                property_category_ids = {}
+                if properties is not None:
+                    # categories are created here, so that workers only ever need to look them up
+                    names = list(_property_names(properties))
+                    property_category_ids = dict(zip(names, category_cache.get_existing_or_new_ids(names)))
+                first_id = graph_connection.id_allocator.reserve(class_, n_rows)
+                session.commit()
+
+                future = executor.submit(_process_chunk, worker_db_uri, engine_kwargs, kind, first_id, category_id,
+                                         rows, properties, property_category_ids)
+                pending.append((future, time.time()))
+                # bound the amount of input held in memory at any one time
+                while len(pending)>=2*n_workers:
+                    collect(*pending.popleft())
+
+            while len(pending)>0:
+                collect(*pending.popleft())
+    finally:
+        if defer_indexes:
+            graph_connection.ensure_indexes(drop_superseded=False)
+
+    loader.report.seconds = time.time()-start
+    return loader.report
+
+def load_nodes(graph_connection, category, number=None, properties=None, chunk_size=None, n_workers=None,
+               defer_indexes=True, progress=None):
+    """Add nodes of the specified category, converting and (except on sqlite) writing them in worker processes.
+
+    :param n_workers: the number of worker processes (default: the number of CPUs)
+    :param defer_indexes: if True, the indexes on the nodes and node properties tables are dropped while loading and
+      then rebuilt, which is much faster for large loads but slows down any queries running at the same time
+
+    See Connection.load_nodes for the remaining parameters."""
+    if chunk_size is None:
+        chunk_size = config.ingest_chunk_size
+    chunks = add._node_chunks(number, properties, chunk_size, as_dicts=False)
+    return _load(graph_connection, 'node', category, chunks, n_workers, defer_indexes, progress)
+
+def load_edges(graph_connection, category, node_from, node_to=None, properties=None, chunk_size=None,
+               n_workers=None, defer_indexes=True, progress=None):
+    """Add edges of the specified category, converting and (except on sqlite) writing them in worker processes.
+
+    :param n_workers: the number of worker processes (default: the number of CPUs)
+    :param defer_indexes: if True, the indexes on the edges and edge properties tables are dropped while loading and
+      then rebuilt, which is much faster for large loads but slows down any queries running at the same time
+
+    See Connection.load_edges for the remaining parameters."""
+    if chunk_size is None:
+        chunk_size = config.ingest_chunk_size
+    chunks = add._edge_chunks(node_from, node_to, properties, chunk_size, as_dicts=False)
+    return _load(graph_connection, 'edge', category, chunks, n_workers, defer_indexes, progress)
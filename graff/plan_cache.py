@@ -0,0 +1,50 @@
+"""Caching of the compiled SQL for queries, so that queries of the same shape are not rebuilt for every call."""
+
+import threading
+
+from sqlalchemy.ext import baked
+
+class PlanCache(object):
+    """Caches the compiled query plans for a Connection, keyed on the shape of the query chain.
+
+    The key describes the type of each step in the chain, the categories and property names it refers to, the
+    structure of any filter conditions (including the types, but not the values, of their literals) and the final
+    operation, e.g. all() or count(). Literal values are bound as parameters, so that queries differing only in those
+    values share a plan. On a cache hit, neither the temp table schemas nor the SQL for the chain are constructed again.
+
+    Only queries that are evaluated as a single statement, i.e. on a connection using common table expressions, are
+    cached. The plans are held in an LRU cache of SQLAlchemy baked queries."""
+
+    def __init__(self, size):
+        """
+        :param size: the maximum number of plans to hold; if 0, no plans are cached
+        """
+        self.size = size
+        self._bakery = baked.bakery(size) if size>0 else None
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self._bakery is not None
+
+    @property
+    def hits(self):
+        return self._lookups - self.misses
+
+    def get_result(self, key, parameters, build_query, sqlalchemy_session):
+        """Return a result (sqlalchemy.ext.baked.Result) for the plan with the given key, ready to be retrieved.
+
+        :param parameters: a dictionary of values for the bound parameters of the plan
+        :param build_query: a function returning the sqlalchemy Query for the plan. It is only called (when results are
+          retrieved) if the plan is not already cached.
+        """
+        def build_plan(session):
+            with self._lock:
+                self.misses+=1
+            return build_query()
+
+        with self._lock:
+            self._lookups+=1
+        return self._bakery(build_plan, key)(sqlalchemy_session).params(**parameters)
@@ -1,10 +1,11 @@
 import copy
-import sqlalchemy
-from sqlalchemy import Integer, ForeignKey, sql
-from sqlalchemy.orm import aliased, joinedload
+import contextlib
+import itertools
+from sqlalchemy import Integer, Float, ForeignKey, sql, inspect
+from sqlalchemy.orm import aliased, joinedload, selectinload
 
-from ..temptable import TempTableState
-from .. import orm
+from ..temptable import TempTableState, label_statement_columns
+from .. import orm, config, flexible_value, asynchronous
 
 
 class QueryStructureError(RuntimeError):
@@ -31,6 +32,10 @@ class BaseQuery(object):
 
     Once the query context exits, the temp table is destroyed. In other words, any manipulation of the temp table within
     SQL must be performed within the context.
+
+    If the connection's use_cte attribute is True, no temp tables are actually created in the database. Instead each
+    step in the query chain is compiled into a common table expression, so that the final query is a single
+    WITH ... SELECT statement executed in one round trip.
     """
 
     _node_or_edge = None  # child class to set this to 'node' or 'edge'
@@ -41,10 +46,12 @@ class BaseQuery(object):
     # if True, a call to all() returns this node or edge (plus any other columns asked for)
     # if False, a call to all() does not return this node or edge, only the other columns
 
+    _row_limit = None # if set, at most this many rows are written into the temp table
+
+    _plan_depth = 0 # the number of steps preceding this one in the query chain
+
     def __init__(self, graph_connection):
         self._graph_connection = graph_connection
-        self._session = graph_connection.get_sqlalchemy_session()
-        self._connection = self._session.connection()
         self._category = None
         self._temp_table_state = TempTableState()
         self._copy_columns_target = []
@@ -60,6 +67,24 @@ class BaseQuery(object):
                                                                      keep_at_end =True)
 
 
+    @property
+    def _session(self):
+        # Looked up when the query runs rather than when it is constructed, so that for a thread-safe connection the
+        # query (and its temp tables) use the session of the thread running it
+        return self._graph_connection.get_sqlalchemy_session()
+
+    @property
+    def _connection(self):
+        return self._session.connection()
+
+    def _get_populate_query(self):
+        """Get the columns to populate in the temporary table for this query, and the query to populate them with.
+
+        Returns a tuple (columns, query). The query may be a sqlalchemy Query or select statement; its result columns
+        are inserted, in order, into the listed temp table columns. The first column must always be the column for
+        the current node or edge."""
+        raise NotImplementedError("_get_populate_query needs to be implemented by a subclass")
+
     def _get_populate_temp_table_statement(self):
         """Get the SQL statement to insert rows into the temporary table for this query.
 
@@ -68,18 +93,69 @@ class BaseQuery(object):
         The SQL returned by this statement is called immediately. The reason that it returns the query rather than
         executing it itself is so that child classes can modify the generated statement (rather than have to
         re-implement it in its entirety)."""
-        raise NotImplementedError("_populate_temp_table needs to be implemented by a subclass")
+        columns, query = self._get_filtered_populate_query()
+        return self.get_temp_table().insert().from_select(columns, query)
+
+    def _filter_populate_query(self, query):
+        """Apply any filters for this query directly to the query returned by _get_populate_query.
+
+        The filters become part of the statement that generates the rows (whether it populates a temporary table or a
+        common table expression), so that rows failing the filter are never written."""
+        return query
 
-    def _filter_temp_table(self):
-        """Apply any filters to the temporary table for this query.
+    def _get_underlying_query(self):
+        """Return the query that this query's temp table is populated from, if any"""
+        return None
 
-        Called when entering the query context, just after creating and populating the temporary table."""
-        pass
+    def _get_underlying_temp_table_state(self):
+        underlying = self._get_underlying_query()
+        if underlying is None:
+            return None
+        else:
+            return underlying._temp_table_state
+
+    @contextlib.contextmanager
+    def _underlying_query_context(self):
+        """Enter the context of the underlying query (if any), without creating a temp table for this query"""
+        underlying = self._get_underlying_query()
+        if underlying is None:
+            yield
+        else:
+            with underlying:
+                yield
+
+    def _get_unmaterialized_statement(self):
+        """Return a select statement generating the rows of this query, with any filters applied.
+
+        The columns are labelled with the names they would have in the temp table. This must be called within
+        _underlying_query_context(), and allows results to be derived without creating a temp table for this query."""
+        columns, query = self._get_populate_query()
+        query = self._filter_populate_query(query)
+        statement = getattr(query, 'statement', query)
+        underlying = self._get_underlying_temp_table_state()
+        if underlying is not None:
+            statement = underlying.adapt_to_cte(statement)
+        return label_statement_columns(statement, [c.name for c in columns])
 
     def _get_temp_table_query(self):
         """Get the correct SQL query against the temp table to return appropriate results from this graph query."""
         return self._temp_table_state.get_query()
 
+    def _get_results_query(self, load_properties=False):
+        """Get the query against the temp table that returns results, optionally loading the properties of the nodes
+        and edges returned.
+
+        The properties are loaded by one further query for each batch of results, instead of one query per node or edge
+        when they are first accessed."""
+        query = self._get_temp_table_query()
+        if load_properties:
+            for description in query.column_descriptions:
+                entity = description['entity']
+                if entity is not None and description['expr'] is entity and \
+                        inspect(entity).mapper.class_ in (orm.Node, orm.Edge):
+                    query = query.options(selectinload(entity.properties))
+        return query
+
     @classmethod
     def _reformat_results_row(cls, results):
         if results is None:
@@ -91,28 +167,308 @@ class BaseQuery(object):
         else:
             raise ValueError("SQL query returned row with too few columns (%d)"%len(results))
 
-    def all(self):
-        """Construct and retrieve all results from this graph query"""
-        with self:
-            results = self._get_temp_table_query().all()
-
+    def _postprocess_and_reformat(self, results):
         results = self._temp_table_state.postprocess_results(results)
+        return list(map(self._reformat_results_row, results))
+
+    def _bind_names(self):
+        """Return an iterator over names for the parameters to which this step binds literal values.
+
+        The names depend only on the position of the step in the chain, so that they are the same for every query with
+        the same plan."""
+        return ("param_%d_%d" % (self._plan_depth, i) for i in itertools.count())
+
+    def _get_step_plan_key(self, parameters):
+        """Return a hashable description of this step of the query chain, for the plan cache.
 
-        results = list(map(self._reformat_results_row, results))
-        return results
+        The description must include everything that affects the SQL generated for the step, except for values bound
+        as parameters; each of these is instead appended to parameters as (name, value). Subclasses that add state
+        must extend the description, or return None if the step cannot be cached."""
+        return type(self), self._category, self._row_limit
+
+    def _get_plan_key(self, parameters):
+        """Return a hashable description of the whole query chain ending at this step, or None if it cannot be cached"""
+        step_key = self._get_step_plan_key(parameters)
+        if step_key is None:
+            return None
+        underlying = self._get_underlying_query()
+        if underlying is None:
+            return (step_key,)
+        underlying_key = underlying._get_plan_key(parameters)
+        if underlying_key is None:
+            return None
+        return underlying_key + (step_key,)
+
+    def _get_cached_plan(self, operation, build_query):
+        """Return a result from the connection's plan cache for this query, or None if it cannot be cached.
+
+        :param operation: a tuple describing the final operation, e.g. ('count', distinct)
+        :param build_query: a function returning the sqlalchemy Query to be executed, called only if the plan is not
+          already cached. It must enter any context the query requires.
+        """
+        plan_cache = self._graph_connection.plan_cache
+        if not (plan_cache.enabled and self._graph_connection.use_cte):
+            return None
+        parameters = []
+        key = self._get_plan_key(parameters)
+        if key is None:
+            return None
+        return plan_cache.get_result(operation + key, dict(parameters), build_query, self._session)
+
+    def _get_step_category_dependencies(self):
+        """Return the set of IDs of the categories that the rows generated by this step depend on, or None if they
+        depend on all categories. Used to invalidate cached results when categories are written to."""
+        return set()
+
+    def _get_category_dependencies(self):
+        """Return the set of IDs of the categories that the results of the query chain depend on, or None for all"""
+        dependencies = self._get_step_category_dependencies()
+        underlying = self._get_underlying_query()
+        if dependencies is None or underlying is None:
+            return dependencies
+        underlying_dependencies = underlying._get_category_dependencies()
+        if underlying_dependencies is None:
+            return None
+        return dependencies | underlying_dependencies
 
-    def count(self):
-        """Constructs the query and counts the number of rows in the result"""
+    def _get_category_or_all_dependency(self):
+        # for steps that read the nodes or edges of this query's category, or of any category if none is given
+        if self._category is None:
+            return None
+        else:
+            return {self._category}
+
+    def _get_cached_result(self, operation, compute):
+        """Return the result of compute(), using the connection's result cache if it is enabled.
+
+        :param operation: a tuple describing the final operation, e.g. ('count', distinct)
+        """
+        result_cache = self._graph_connection.result_cache
+        if result_cache is None:
+            return compute()
+        parameters = []
+        key = self._get_plan_key(parameters)
+        if key is None:
+            return compute()
+        key = operation + key + tuple(value for name, value in parameters)
+        return result_cache.get_or_compute(key, self._get_category_dependencies(), compute, self._session)
+
+    def _build_results_query(self, load_properties):
         with self:
-            return self._session.query(self.get_temp_table()).count()
+            return self._get_results_query(load_properties)
+
+    def all(self, load_properties=False):
+        """Construct and retrieve all results from this graph query
+
+        :param load_properties: if True, the properties of all nodes and edges returned are loaded in bulk, so that
+          converting them to dictionaries does not require a query for each one
+        """
+        return list(self._get_cached_result(('all', load_properties), lambda: self._all(load_properties)))
+
+    def _all(self, load_properties):
+        plan = self._get_cached_plan(('all', load_properties), lambda: self._build_results_query(load_properties))
+        if plan is None:
+            with self:
+                results = self._get_results_query(load_properties).all()
+        else:
+            results = plan.all()
+
+        return self._postprocess_and_reformat(results)
+
+    def stream(self, batch_size=None, load_properties=False):
+        """Construct the query and iterate over its results, retrieving them from the database in batches.
+
+        The query context remains open until the iteration is complete, so that only batch_size rows need to be held
+        in memory at any one time. Where the database driver supports it, a server-side cursor is used.
+
+        :param batch_size: the number of rows to retrieve at once; defaults to config.stream_batch_size
+        :param load_properties: if True, the properties of the nodes and edges in each batch are loaded in bulk
+        """
+        if batch_size is None:
+            batch_size = config.stream_batch_size
 
-    def first(self):
-        """Constructs the query and returns the first row in the result"""
         with self:
-            result = self._get_temp_table_query().first()
-        result = self._temp_table_state.postprocess_results([result])[0]
-        return self._reformat_results_row(result)
+            batch = []
+            for row in self._get_results_query(load_properties).yield_per(batch_size):
+                batch.append(row)
+                if len(batch)==batch_size:
+                    for result in self._postprocess_and_reformat(batch):
+                        yield result
+                    batch = []
+
+            for result in self._postprocess_and_reformat(batch):
+                yield result
+
+    def __iter__(self):
+        """Construct the query and iterate over its results; equivalent to stream() with the default batch size"""
+        return self.stream()
+
+    def to_arrays(self):
+        """Construct the query and return its results as numpy arrays, one for each returned column.
+
+        Nodes and edges are represented by their IDs (dtype int64) and properties by their values; see
+        flexible_value.flexible_values_to_array for how the dtype of a property array is chosen. No ORM objects are
+        constructed. As for all(), a single array is returned if there is only one column, otherwise a tuple of arrays.
+
+        Requires numpy."""
+        import numpy as np
+        with self:
+            try:
+                query, column_widths = self._temp_table_state.get_raw_query()
+            except ValueError:
+                raise QueryStructureError("This query returns results that cannot be represented as arrays")
+            rows = self._connection.execute(query.statement).fetchall()
+
+        if len(rows)>0:
+            sql_columns = list(zip(*rows))
+        else:
+            sql_columns = [()]*sum(column_widths)
+
+        arrays = []
+        offset = 0
+        for width in column_widths:
+            if width==1:
+                values = np.array(sql_columns[offset], dtype=object)
+                if np.not_equal(values, None).all():
+                    values = values.astype(np.int64)
+            else:
+                values = flexible_value.flexible_values_to_array(*sql_columns[offset:offset+width])
+            arrays.append(values)
+            offset+=width
+
+        return self._reformat_results_row(tuple(arrays))
+
+    def count(self, distinct=False):
+        """Constructs the query and counts the number of rows in the result.
+
+        The count is evaluated directly, without writing the final step of the query into a temp table.
+
+        :param distinct: if True, count the number of distinct nodes (or edges, for an edge query) reached at the end of
+          the query, rather than the number of rows
+        """
+        return self._get_cached_result(('count', distinct), lambda: self._count(distinct))
+
+    def _count(self, distinct):
+        if self._can_evaluate_without_temp_table():
+            plan = self._get_cached_plan(('count', distinct), lambda: self._build_count_query(distinct))
+            if plan is not None:
+                return plan.scalar()
+            with self._underlying_query_context():
+                return self._count_rows(self._get_unmaterialized_statement().alias(), distinct)
+        else:
+            with self:
+                return self._count_rows(self._temp_table_state.get_selectable(), distinct)
+
+    def _count_expression(self, selectable, distinct):
+        if distinct:
+            return sql.func.count(sql.distinct(selectable.c[self._tt_current_location_id.name]))
+        else:
+            return sql.func.count()
+
+    def _count_rows(self, selectable, distinct):
+        count = self._count_expression(selectable, distinct)
+        return self._connection.execute(sql.select([count]).select_from(selectable)).scalar()
+
+    def _build_count_query(self, distinct):
+        with self._underlying_query_context():
+            selectable = self._get_unmaterialized_statement().alias()
+            return self._session.query(self._count_expression(selectable, distinct)).select_from(selectable)
+
+    def exists(self):
+        """Constructs the query and returns True if there is at least one row in the result"""
+        return self._get_cached_result(('exists',), self._exists)
+
+    def _exists(self):
+        if self._can_evaluate_without_temp_table():
+            plan = self._get_cached_plan(('exists',), self._build_exists_query)
+            if plan is not None:
+                return bool(plan.scalar())
+            with self._underlying_query_context():
+                return self._any_rows(self._get_unmaterialized_statement())
+        else:
+            with self:
+                return self._any_rows(sql.select([self._temp_table_state.get_selectable()]))
+
+    def _any_rows(self, statement):
+        return bool(self._connection.execute(sql.select([sql.exists(statement)])).scalar())
+
+    def _build_exists_query(self):
+        with self._underlying_query_context():
+            return self._session.query(sql.exists(self._get_unmaterialized_statement()))
+
+    def first(self, load_properties=False):
+        """Constructs the query and returns the first row in the result.
+
+        Only a single row is written into the temp table for the final step of the query.
+
+        :param load_properties: as for all()
+        """
+        return self._get_cached_result(('first', load_properties), lambda: self._first(load_properties))
+
+    def _first(self, load_properties):
+        self._row_limit = 1
+        try:
+            plan = self._get_cached_plan(('first', load_properties), lambda: self._build_results_query(load_properties))
+            if plan is None:
+                with self:
+                    result = self._get_results_query(load_properties).first()
+            else:
+                result = plan.first()
+        finally:
+            self._row_limit = None
+        return self._postprocess_and_reformat([result])[0]
+
+
+    def group_by_origin(self):
+        """Return an object whose count() and aggregate() methods give results for each group of rows sharing the same
+        values carried forward from earlier in the query, e.g. by return_this() or return_property().
+
+        For example, q.return_this().follow("likes").group_by_origin().count() returns a list of (node, number of nodes
+        it likes). The grouping and aggregation are performed by the database, so only one row per group is
+        retrieved."""
+        if len(self._get_temp_table_columns_to_carry_forward())==0:
+            raise QueryStructureError("group_by_origin() requires values carried forward from earlier in the query, "
+                                      "e.g. by return_this()")
+        return GroupedQuery(self)
+
+    def aggregate(self, **functions):
+        """Aggregate numeric properties of the nodes or edges over all rows of this query, in the database.
+
+        For example, q.aggregate(sum="num_messages", mean="num_messages") returns {'sum': ..., 'mean': ...}.
+
+        :param functions: maps each aggregate function (count, sum, mean, min or max) to the name of a property. The
+          count is the number of rows that have the property.
+        """
+        return PropertyAggregateQuery(self, functions, grouped=False).first()
+
+    def all_async(self, load_properties=False):
+        """Run all() in a worker thread, returning an asyncio future for the results.
+
+        The connection must have been opened with thread_safe=True; see graff.asynchronous."""
+        return asynchronous.run(self._graph_connection, self.all, load_properties)
+
+    def count_async(self, distinct=False):
+        """Run count() in a worker thread, returning an asyncio future for the result"""
+        return asynchronous.run(self._graph_connection, self.count, distinct)
+
+    def exists_async(self):
+        """Run exists() in a worker thread, returning an asyncio future for the result"""
+        return asynchronous.run(self._graph_connection, self.exists)
 
+    def first_async(self, load_properties=False):
+        """Run first() in a worker thread, returning an asyncio future for the result"""
+        return asynchronous.run(self._graph_connection, self.first, load_properties)
+
+    def stream_async(self, batch_size=None):
+        """Return an asynchronous iterator over the results of this query, for use with async for.
+
+        As for stream(), the results are retrieved from the database in batches; see
+        graff.asynchronous.AsyncResultIterator."""
+        return asynchronous.AsyncResultIterator(self, batch_size)
+
+    def __aiter__(self):
+        """Return an asynchronous iterator over the results; equivalent to stream_async() with the default batch size"""
+        return self.stream_async()
 
     def get_temp_table(self):
         """Return the SQLAlchemy Table for the temp table associated with this query.
@@ -135,9 +491,29 @@ class BaseQuery(object):
         raise QueryStructureError("This query does not have any named properties to reference")
 
     def __enter__(self):
-        self._temp_table_state.create(self._session)
+        use_cte = self._graph_connection.use_cte
+        self._temp_table_state.create(self._session, as_cte=use_cte)
+        if use_cte:
+            columns, query = self._get_filtered_populate_query()
+            self._temp_table_state.populate_cte(columns, query, self._get_underlying_temp_table_state())
+        else:
+            self._populate_temp_table()
+
+    def _get_filtered_populate_query(self):
+        """Return the columns and query from _get_populate_query, with any filters and row limit applied"""
+        columns, query = self._get_populate_query()
+        query = self._filter_populate_query(query)
+        if self._row_limit is not None:
+            query = query.limit(self._row_limit)
+        return columns, query
+
+    def _populate_temp_table(self):
+        """Fill the temp table, which has just been created in the database, with the rows for this query."""
         self._connection.execute(self._get_populate_temp_table_statement())
-        self._filter_temp_table()
+
+    def _can_evaluate_without_temp_table(self):
+        """Return True if count() and exists() can be evaluated using _get_unmaterialized_statement()"""
+        return True
 
     def __exit__(self, *args):
         return self._temp_table_state.destroy()
@@ -159,10 +535,12 @@ class QueryFromCategory(BaseQuery):
         super(QueryFromCategory, self).__init__(graph_connection)
         self._set_category(category_)
 
-    def _get_populate_temp_table_statement(self):
+    def _get_populate_query(self):
         orm_query = self._session.query(self._node_or_edge_orm.id).filter_by(category_id=self._category)
-        insert_statement = self.get_temp_table().insert().from_select([self._tt_current_location_id], orm_query)
-        return insert_statement
+        return [self._tt_current_location_id], orm_query
+
+    def _get_step_category_dependencies(self):
+        return self._get_category_or_all_dependency()
 
 class QueryFromUnderlyingQuery(BaseQuery):
     """Represents a query that returns nodes based on a previous set of nodes in an underlying 'base' query"""
@@ -171,20 +549,22 @@ class QueryFromUnderlyingQuery(BaseQuery):
         super(QueryFromUnderlyingQuery, self).__init__(base._graph_connection)
         self._carry_forward_temp_table_columns(base)
         self._base = base
+        self._plan_depth = base._plan_depth + 1
 
     def __enter__(self):
         with self._base:
             super(QueryFromUnderlyingQuery, self).__enter__()
 
-    def _get_populate_temp_table_statement(self):
+    def _get_populate_query(self):
         orm_query = self._session.query(self._base._tt_current_location_id, *self._copy_columns_source)
 
         if self._category:
             orm_query = orm_query.filter_by(category_id=self._category)
-        insert_statement = self.get_temp_table().insert().from_select(
-            [self._tt_current_location_id] + self._copy_columns_target, orm_query)
 
-        return insert_statement
+        return [self._tt_current_location_id] + self._copy_columns_target, orm_query
+
+    def _get_underlying_query(self):
+        return self._base
 
     def _carry_forward_temp_table_columns(self, base):
         self._base = base
@@ -229,7 +609,11 @@ class AllPropertiesQuery(PersistentQuery):
     @classmethod
     def _persistent_query_callback(cls, column):
         alias = aliased(cls._node_or_edge_orm)
-        return alias, alias, (alias.id == column), joinedload(alias.properties).joinedload(cls._property_orm.category)
+        # selectinload rather than joinedload, so that the properties can also be loaded batch-by-batch in stream()
+        return alias, alias, (alias.id == column), selectinload(alias.properties).joinedload(cls._property_orm.category)
+
+    def _get_step_category_dependencies(self):
+        return None # the properties returned may be of any category
 
     @classmethod
     def _persistent_postprocess_callback(cls, results, column_id):
@@ -261,12 +645,19 @@ class QueryWithValuesForInternalUse(QueryFromUnderlyingQuery):
     def _get_temp_table_column_mapping(self):
         return self._tt_column_mapping
 
-    def _get_populate_temp_table_statement(self):
+    def _get_step_plan_key(self, parameters):
+        return super(QueryWithValuesForInternalUse, self)._get_step_plan_key(parameters) + (tuple(self._categories),)
+
+    def _get_step_category_dependencies(self):
+        return set(self._categories)
+
+    def _get_populate_query(self):
         prev_table = self._base.get_temp_table()
         underlying_tt_current_location_id = self._base._tt_current_location_id
         aliases = []
         for this_category_id in self._categories:
             aliases+=[aliased(self._property_orm)]
+        self._property_aliases = aliases
 
         query = self._session.query(underlying_tt_current_location_id, *(self._copy_columns_source + [a.id for a in aliases])) \
             .select_from(prev_table)
@@ -278,9 +669,7 @@ class QueryWithValuesForInternalUse(QueryFromUnderlyingQuery):
                         this_property_alias.category_id==this_category_id))
 
         insert_cols = [self._tt_current_location_id] + self._copy_columns_target + self._tt_columns
-        insert_statement = self.get_temp_table().insert().from_select(insert_cols, query)
-
-        return insert_statement
+        return insert_cols, query
 
 
 class NamedPropertiesQuery(QueryWithValuesForInternalUse):
@@ -317,48 +706,189 @@ class FilterNamedPropertiesQuery(QueryWithValuesForInternalUse):
         categories = cond.get_unresolved_property_names()
         super(FilterNamedPropertiesQuery, self).__init__(base, *categories)
 
-    def _filter_temp_table(self):
-        # in principle it would be neater to use a joined delete here, but sqlite doesn't support it
-        # so we construct a subquery to figure out what to delete instead
+    def _get_condition_keeping_rows(self, value_map):
+        """Return the SQL for the condition that determines which rows are kept.
 
-        tt = self.get_temp_table()
+        Rows for which the condition cannot be evaluated (e.g. because a property is missing) are kept."""
+        self._condition.assign_sql_columns(value_map)
+        return ~sql.func.coalesce(~(self._condition.to_sql(self._bind_names())), sql.false())
 
-        subq = self._session.query(tt.c.id)
+    def _get_step_plan_key(self, parameters):
+        return super(FilterNamedPropertiesQuery, self)._get_step_plan_key(parameters) + \
+               (self._condition.get_plan_key(self._bind_names(), parameters),)
 
+    def _filter_populate_query(self, query):
         value_map = {}
 
-        for col, category_name in zip(self._tt_columns, self._category_names):
-            alias = aliased(self._property_orm)
-            subq = subq.outerjoin(alias, alias.id == col)
-            value_map[category_name] = alias.value # this joined property should be used as the value in the condition we're evaluating
+        for alias, category_name in zip(self._property_aliases, self._category_names):
+            value_map[category_name] = alias.value
 
         for id_column in self._condition.get_resolved_property_id_columns():
             alias = aliased(self._property_orm)
-            subq = subq.outerjoin(alias, alias.id == id_column)
-            value_map[id_column] = alias.value  # this joined property should be used as the value in the condition we're evaluating
+            query = query.outerjoin(alias, alias.id == id_column)
+            value_map[id_column] = alias.value
+
+        return query.filter(self._get_condition_keeping_rows(value_map))
 
-        self._condition.assign_sql_columns(value_map)
 
-        delete_condition = ~(self._condition.to_sql()) # delete what we don't want to keep
+class GroupedQuery(object):
+    """The rows of a query grouped by the values carried forward from earlier in the query; see
+    BaseQuery.group_by_origin"""
 
-        subq = subq.filter(delete_condition).subquery() # This subquery now identifies the IDs we don't want to keep
+    def __init__(self, base):
+        self._base = base
 
-        # Original - works on Sqlite but not MySql which doesn't permit multiple references to temp table in one query:
-        # delete_query = tt.delete().where(tt.c.id.in_(subq))
-        # self._connection.execute(delete_query)
+    def count(self, distinct=False):
+        """Return a list of (values carried forward..., number of rows) for each group
+
+        :param distinct: if True, count the distinct nodes (or edges) in each group rather than the rows
+        """
+        return CountAggregateQuery(self._base, distinct).all()
+
+    def aggregate(self, **functions):
+        """Return a list of (values carried forward..., dictionary of aggregates) for each group; see
+        BaseQuery.aggregate"""
+        return PropertyAggregateQuery(self._base, functions, grouped=True).all()
 
-        tt_for_ids = TempTableState()
-        tt_for_ids.add_column('delete_row_id', Integer)
-        tt_for_ids.create(self._session)
-        try:
-            self._connection.execute(tt_for_ids.get_table().insert().from_select(['delete_row_id'], subq))
-            subq2 = sqlalchemy.select([tt_for_ids.get_table().c.delete_row_id])
-            delete_query = tt.delete().where(tt.c.id.in_(subq2))
-            self._connection.execute(delete_query)
-        finally:
-            tt_for_ids.destroy()
 
+class AggregateQuery(QueryFromUnderlyingQuery):
+    """Represents aggregates of the rows of the underlying query, computed by the database using GROUP BY.
 
+    If grouped, there is one row for each combination of the values carried forward from the underlying query, which
+    are returned before the aggregates; otherwise all rows are aggregated into one. Subclasses define the aggregates,
+    in _add_column_for_aggregates and _get_aggregates."""
+
+    _user_query_returns_self = False
+
+    _group_by_current = False
+    # if True, the rows are also grouped by the underlying node or edge, which is returned before the aggregates
+
+    def __init__(self, base, grouped=True):
+        self._grouped = grouped
+        super(AggregateQuery, self).__init__(base)
+        if self._group_by_current:
+            self._group_column = self._temp_table_state.add_column_with_unique_name(
+                base._node_or_edge+"_id_group", Integer, query_callback=base._user_query_callback)
+        self._aggregate_columns = []
+        self._add_columns_for_aggregates()
+
+    def _carry_forward_temp_table_columns(self, base):
+        if self._grouped:
+            super(AggregateQuery, self)._carry_forward_temp_table_columns(base)
+        else:
+            self._base = base
+            self._copy_columns_source = []
+            self._copy_columns_target = []
+
+    def _add_aggregate_column(self, type_):
+        self._aggregate_columns.append(self._temp_table_state.add_column_with_unique_name("aggregate", type_))
+
+    def _add_columns_for_aggregates(self):
+        """Add a column to the temp table for each aggregate, by calling _add_aggregate_column"""
+        raise NotImplementedError("_add_columns_for_aggregates needs to be implemented by a subclass")
+
+    def _get_aggregates(self, from_clause, current_id):
+        """Return a from clause joining any further tables to from_clause, and the aggregate expressions to evaluate
+        over it, one for each aggregate column.
+
+        :param current_id: the column of the underlying temp table giving the node or edge ID
+        """
+        raise NotImplementedError("_get_aggregates needs to be implemented by a subclass")
+
+    def _get_step_plan_key(self, parameters):
+        return super(AggregateQuery, self)._get_step_plan_key(parameters) + (self._grouped,)
+
+    def _get_populate_query(self):
+        current_id = self._base._tt_current_location_id
+        group_columns = list(self._copy_columns_source)
+        columns = [self._tt_current_location_id] + self._copy_columns_target
+        if self._group_by_current:
+            group_columns.append(current_id)
+            columns.append(self._group_column)
+            first_column = current_id.label("current_id")
+        else:
+            first_column = sql.null().label("current_id")
+        from_clause, aggregates = self._get_aggregates(self._base.get_temp_table(), current_id)
+
+        statement = sql.select([first_column] + group_columns + aggregates).select_from(from_clause)
+        if len(group_columns)>0:
+            statement = statement.group_by(*group_columns)
+        return columns + self._aggregate_columns, statement
 
 
+class CountAggregateQuery(AggregateQuery):
+    """Represents the number of rows, or of distinct nodes or edges, in the underlying query"""
 
+    def __init__(self, base, distinct, grouped=True):
+        self._distinct = distinct
+        super(CountAggregateQuery, self).__init__(base, grouped)
+
+    def _add_columns_for_aggregates(self):
+        self._add_aggregate_column(Integer)
+
+    def _get_aggregates(self, from_clause, current_id):
+        if self._distinct:
+            return from_clause, [sql.func.count(sql.distinct(current_id))]
+        else:
+            return from_clause, [sql.func.count()]
+
+    def _get_step_plan_key(self, parameters):
+        return super(CountAggregateQuery, self)._get_step_plan_key(parameters) + (self._distinct,)
+
+
+class PropertyAggregateQuery(AggregateQuery):
+    """Represents aggregates of numeric properties of the nodes or edges in the underlying query.
+
+    Results are returned as a dictionary mapping each aggregate function to its value, after any group keys. Counts are
+    ints and all other aggregates floats (or None if there are no values), whatever the types of the values stored and
+    whether or not the query is evaluated with common table expressions."""
+
+    _functions = {'count': sql.func.count, 'sum': sql.func.sum, 'mean': sql.func.avg, 'min': sql.func.min,
+                  'max': sql.func.max}
+
+    def __init__(self, base, functions, grouped=True):
+        for function in functions:
+            if function not in self._functions:
+                raise ValueError("Unknown aggregate function %r" % function)
+        # sorted, so that the order of the columns does not depend on the order of the keyword arguments
+        self._function_names = sorted(functions)
+        self._property_names = [functions[f] for f in self._function_names]
+        self._property_categories = [base._graph_connection.category_cache.get_id(name)
+                                     for name in self._property_names]
+        super(PropertyAggregateQuery, self).__init__(base, grouped)
+        self._property_orm = base._property_orm
+        self._node_or_edge_id = base._node_or_edge+"_id"
+
+    def _add_columns_for_aggregates(self):
+        for function in self._function_names:
+            self._add_aggregate_column(Integer if function=='count' else Float)
+
+    def _get_aggregates(self, from_clause, current_id):
+        properties = self._property_orm.__table__
+        values = {}
+        for category_id in set(self._property_categories):
+            alias = properties.alias()
+            from_clause = from_clause.outerjoin(alias, (alias.c[self._node_or_edge_id]==current_id) &
+                                                       (alias.c.category_id==category_id))
+            values[category_id] = sql.func.coalesce(alias.c.value_int, alias.c.value_float)
+        return from_clause, [self._functions[function](values[category_id])
+                             for function, category_id in zip(self._function_names, self._property_categories)]
+
+    def _get_step_plan_key(self, parameters):
+        return super(PropertyAggregateQuery, self)._get_step_plan_key(parameters) + \
+               (tuple(self._function_names), tuple(self._property_categories))
+
+    def _get_step_category_dependencies(self):
+        return set(self._property_categories)
+
+    def _postprocess_and_reformat(self, results):
+        n_aggregates = len(self._function_names)
+        reformatted = []
+        for row in self._temp_table_state.postprocess_results(results):
+            if row is None:
+                reformatted.append(None)
+                continue
+            aggregates = dict((function, None if value is None else int(value) if function=='count' else float(value))
+                              for function, value in zip(self._function_names, row[len(row)-n_aggregates:]))
+            reformatted.append(self._reformat_results_row(row[:len(row)-n_aggregates] + (aggregates,)))
+        return reformatted
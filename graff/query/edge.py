@@ -41,32 +41,41 @@ class GenericEdgeQuery(BaseQuery):
         """Return a query that follows an edge to the target node."""
         return TargetNodeQuery(self)
 
+    def source_node(self):
+        """Return a query that follows an edge back to its source node."""
+        return SourceNodeQuery(self)
+
 class EdgeQuery(QueryFromCategory, GenericEdgeQuery):
     pass
 
 class TargetNodeQuery(NodeQueryFromUnderlyingQuery):
+    _edge_end = orm.Edge.__table__.c.node_to_id # the end of the edge giving the node to return
+
     def __init__(self, base):
         super(TargetNodeQuery, self).__init__(base)
         assert isinstance(base, GenericEdgeQuery)
         self._base = base
 
-    def _get_populate_temp_table_statement(self):
-        orm_query = self._session.query(orm.Edge.node_to_id, *self._copy_columns_source).\
+    def _get_populate_query(self):
+        orm_query = self._session.query(self._edge_end, *self._copy_columns_source).\
             select_from(self._base.get_temp_table()).\
             join(orm.Edge, self._base._tt_current_location_id==orm.Edge.id)
 
-        insert_statement = self.get_temp_table().insert().from_select([self._tt_current_location_id] + self._copy_columns_target, orm_query)
+        return [self._tt_current_location_id] + self._copy_columns_target, orm_query
 
-        return insert_statement
+class SourceNodeQuery(TargetNodeQuery):
+    _edge_end = orm.Edge.__table__.c.node_from_id
 
 class EdgeQueryFromNodeQuery(GenericEdgeQuery, QueryFromUnderlyingQuery):
+    _edge_origin = orm.Edge.__table__.c.node_from_id # the end of the edge that is joined to the previous nodes
+
     def __init__(self, base, category_=None):
         assert isinstance(base, GenericNodeQuery)
         super(EdgeQueryFromNodeQuery, self).__init__(base)
         self._set_category(category_)
 
-    def _get_populate_temp_table_statement(self):
-        join_cond = self._base._tt_current_location_id == orm.Edge.node_from_id
+    def _get_populate_query(self):
+        join_cond = self._base._tt_current_location_id == self._edge_origin
         if self._category is not None:
             join_cond&= orm.Edge.category_id==self._category
 
@@ -74,10 +83,13 @@ class EdgeQueryFromNodeQuery(GenericEdgeQuery, QueryFromUnderlyingQuery):
             select_from(self._base.get_temp_table()). \
             join(orm.Edge, join_cond)
 
-        insert_statement = self.get_temp_table().insert().from_select(
-            [self._tt_current_location_id] + self._copy_columns_target, orm_query)
+        return [self._tt_current_location_id] + self._copy_columns_target, orm_query
+
+    def _get_step_category_dependencies(self):
+        return self._get_category_or_all_dependency()
 
-        return insert_statement
+class IncomingEdgeQueryFromNodeQuery(EdgeQueryFromNodeQuery):
+    _edge_origin = orm.Edge.__table__.c.node_to_id
 
 class EdgeQueryFromEdgeQuery(GenericEdgeQuery, QueryFromUnderlyingQuery):
     """Represents a query that returns edges based on a previous set of edges in an underlying 'base' query"""
@@ -1,4 +1,6 @@
+import operator
 from .base import *
+from ..temptable import TempTableState, label_statement_columns
 
 class GenericNodeQuery(BaseQuery):
     """Represents a query that returns nodes of a specific category or all categories"""
@@ -39,13 +41,38 @@ class GenericNodeQuery(BaseQuery):
         """Return a new graph query that represents the old one filtered by a stated condition"""
         return NodeFilterNamedPropertiesQuery(self, condition)
 
-    def follow(self, category=None):
+    def follow(self, category=None, min_hops=1, max_hops=1, distinct=None):
         """Return a query that follows an edge to the next node.
 
         The edge may fall into a named category; or if None, all possible edges are followed.
 
-        Note that the q.follow(category) is equivalent to, but more efficient than, q.edge(category).node()"""
-        return FollowQuery(self, category)
+        Note that the q.follow(category) is equivalent to, but more efficient than, q.edge(category).node()
+
+        :param min_hops, max_hops: follow chains of between min_hops and max_hops edges, returning the nodes reached.
+          For example, q.follow(category, max_hops=2) returns the neighbours of each node and their neighbours.
+
+        :param distinct: if True, return each node reached only once (for any particular combination of values carried
+          forward from earlier in the query, e.g. by return_this()). If False, return one row per path. If None
+          (default), results are distinct only when more than one hop is allowed.
+        """
+        if distinct is None:
+            distinct = max_hops>1
+        if min_hops==1 and max_hops==1 and not distinct:
+            return FollowQuery(self, category)
+        else:
+            return MultiHopFollowQuery(self, category, min_hops, max_hops, distinct)
+
+    def follow_in(self, category=None):
+        """Return a query that follows an edge backwards, from its target node to its source node.
+
+        The edge may fall into a named category; or if None, all possible edges are followed."""
+        return ReverseFollowQuery(self, category)
+
+    def follow_any(self, category=None):
+        """Return a query that follows edges in either direction, i.e. treating the edges as undirected.
+
+        The edge may fall into a named category; or if None, all possible edges are followed."""
+        return UndirectedFollowQuery(self, category)
 
     def edge(self, category=None):
         """Return a query that returns all edges from this node.
@@ -54,9 +81,84 @@ class GenericNodeQuery(BaseQuery):
         from . import edge
         return edge.EdgeQueryFromNodeQuery(self, category)
 
+    def degree(self, category=None, direction="out"):
+        """Return the number of edges attached to each node, counted by the database.
+
+        The result is a list of (values carried forward..., node, degree), with one row for each distinct node (and
+        combination of values carried forward). Nodes without any edges are included, with degree zero.
+
+        :param category: count only edges of the named category; or if None, count all edges
+        :param direction: "out" to count edges leaving each node, "in" to count edges arriving, or "any" for both (an
+          edge from a node to itself being counted once)
+        """
+        return DegreeQuery(self, category, direction).all()
+
+    def edge_in(self, category=None):
+        """Return a query that returns all edges leading to this node.
+
+        The edges may fall into a named category; or if None, all possible edges are returned."""
+        from . import edge
+        return edge.IncomingEdgeQueryFromNodeQuery(self, category)
+
 
 class NodeQuery(QueryFromCategory, GenericNodeQuery):
-    pass
+    def where_property(self, name, op, value):
+        """Return a query for the nodes with a named property satisfying a comparison with a fixed value.
+
+        For example, q.where_property("age", ">", 30) returns nodes with an age property greater than 30. Unlike
+        q.filter(Property("age") > 30), which tests every node of the category in turn, the matching nodes are looked
+        up using the index on property values, so this is much faster when only a small fraction of nodes match.
+        Nodes without the property are not returned. Calls may be chained to require several properties.
+
+        :param op: one of "==", "!=", "<", "<=", ">" or ">="
+        """
+        return NodeQueryWhereProperty(self, name, op, value)
+
+
+class NodeQueryWhereProperty(NodeQuery):
+    """Represents a query that returns nodes whose properties satisfy comparisons, starting from the property index"""
+
+    _operators = {"==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le,
+                  ">": operator.gt, ">=": operator.ge}
+
+    def __init__(self, base, name, op, value):
+        super(NodeQueryWhereProperty, self).__init__(base._graph_connection)
+        if op not in self._operators:
+            raise ValueError("Unknown comparison operator %r" % op)
+        self._category = base._category
+        self._property_comparisons = getattr(base, "_property_comparisons", []) + \
+                                     [(self._graph_connection.category_cache.get_id(name), self._operators[op], value)]
+
+    def _get_step_plan_key(self, parameters):
+        comparisons = []
+        for (category_id, op, value), bind_name in zip(self._property_comparisons, self._bind_names()):
+            parameters.append((bind_name, value))
+            comparisons.append((category_id, op, type(value)))
+        return super(NodeQueryWhereProperty, self)._get_step_plan_key(parameters) + (tuple(comparisons),)
+
+    def _get_step_category_dependencies(self):
+        dependencies = set(category_id for category_id, op, value in self._property_comparisons)
+        if self._category is not None:
+            dependencies.add(self._category)
+        return dependencies
+
+    def _get_populate_query(self):
+        orm_query = None
+        for (category_id, op, value), bind_name in zip(self._property_comparisons, self._bind_names()):
+            alias = aliased(self._property_orm)
+            value = sql.bindparam(bind_name, value)
+            condition = (alias.category_id == category_id) & alias.value.comparator.any_satisfies(value, op)
+            if orm_query is None:
+                first_alias = alias
+                orm_query = self._session.query(alias.node_id).filter(condition)
+            else:
+                orm_query = orm_query.join(alias, (alias.node_id == first_alias.node_id) & condition)
+
+        if self._category is not None:
+            orm_query = orm_query.join(self._node_or_edge_orm, self._node_or_edge_orm.id == first_alias.node_id).\
+                filter(self._node_or_edge_orm.category_id == self._category)
+
+        return [self._tt_current_location_id], orm_query
 
 
 class NodeQueryFromUnderlyingQuery(GenericNodeQuery, QueryFromUnderlyingQuery):
@@ -82,26 +184,199 @@ class FollowQuery(NodeQueryFromNodeQuery):
 
     The edges may fall into a particular category, or if no category is specified all edges are followed."""
 
+    _edge_origin = orm.Edge.__table__.c.node_from_id # the end of the edge that is joined to the previous nodes
+    _edge_destination = orm.Edge.__table__.c.node_to_id # the end of the edge that gives the next nodes
+
     def __init__(self, base, category):
         super(FollowQuery, self).__init__(base)
         self._set_category(category)
 
-    def _get_populate_temp_table_statement(self):
+    def _get_populate_query(self):
         prev_table = self._base.get_temp_table()
-        query = self._session.query(orm.Edge.node_to_id, *self._copy_columns_source)\
+        query = self._session.query(self._edge_destination, *self._copy_columns_source)\
             .select_from(prev_table)\
-            .outerjoin(orm.Edge, orm.Edge.node_from_id == self._base._tt_current_location_id)
-        # outer join to capture multiple edges; but will later filter to remove NULL entries
+            .join(orm.Edge, self._edge_origin == self._base._tt_current_location_id)
 
         if self._category:
             query = query.filter(orm.Edge.category_id == self._category)
-        insert_statement = self.get_temp_table().insert().from_select([self._tt_current_location_id] + self._copy_columns_target, query)
-        return insert_statement
+        return [self._tt_current_location_id] + self._copy_columns_target, query
+
+    def _get_step_category_dependencies(self):
+        return self._get_category_or_all_dependency()
+
+
+class ReverseFollowQuery(FollowQuery):
+    """Represents a query that returns nodes linked by edges leading to the previous nodes."""
+
+    _edge_origin = orm.Edge.__table__.c.node_to_id
+    _edge_destination = orm.Edge.__table__.c.node_from_id
+
+
+class UndirectedFollowQuery(FollowQuery):
+    """Represents a query that returns nodes linked by edges in either direction to the previous nodes.
+
+    An edge from a node to itself is only followed once."""
+
+    _directions = ((FollowQuery._edge_origin, FollowQuery._edge_destination, False),
+                   (ReverseFollowQuery._edge_origin, ReverseFollowQuery._edge_destination, True))
+    # (origin, destination, exclude_self_loops) for each direction to follow
+
+    def _get_directed_query(self, edge_origin, edge_destination, exclude_self_loops):
+        join_cond = edge_origin == self._base._tt_current_location_id
+        if self._category:
+            join_cond&= orm.Edge.category_id == self._category
+        if exclude_self_loops:
+            join_cond&= orm.Edge.node_from_id != orm.Edge.node_to_id
+
+        return sql.select([edge_destination] + self._copy_columns_source).\
+            select_from(self._base.get_temp_table().join(orm.Edge.__table__, join_cond))
+
+    def _get_populate_query(self):
+        columns = [self._tt_current_location_id] + self._copy_columns_target
+        names = [c.name for c in columns]
+        directed_queries = [label_statement_columns(self._get_directed_query(*direction), names)
+                            for direction in self._directions]
+        both = sql.union_all(*directed_queries).alias()
+        return columns, sql.select([both.c[name] for name in names])
+
+    def _populate_temp_table(self):
+        # MySQL does not allow a temp table to be referenced twice in one statement, so insert each direction in turn
+        columns = [self._tt_current_location_id] + self._copy_columns_target
+        for direction in self._directions:
+            self._connection.execute(self.get_temp_table().insert().from_select(
+                columns, self._get_directed_query(*direction)))
+
+    def _can_evaluate_without_temp_table(self):
+        return self._graph_connection.use_cte
+
+
+class MultiHopFollowQuery(NodeQueryFromNodeQuery):
+    """Represents a query that returns nodes reached from the previous nodes by following a chain of edges.
+
+    Chains of between min_hops and max_hops edges are followed. If distinct is True, the nodes reached at each hop are
+    deduplicated before the next hop is taken, so that the number of rows does not grow with the number of paths.
+
+    When the connection uses common table expressions, the traversal is evaluated as a single recursive CTE.
+    Otherwise the frontier of nodes reached at each hop is stored in a temp table in turn."""
+
+    _node_column_name = 'traversal_node_id'
+    _hops_column_name = 'traversal_hops'
+
+    def __init__(self, base, category, min_hops, max_hops, distinct):
+        if min_hops<0 or max_hops<min_hops:
+            raise ValueError("Hop counts must satisfy 0 <= min_hops <= max_hops")
+        super(MultiHopFollowQuery, self).__init__(base)
+        self._set_category(category)
+        self._min_hops = min_hops
+        self._max_hops = max_hops
+        self._distinct = distinct
+
+    def _get_step_plan_key(self, parameters):
+        return super(MultiHopFollowQuery, self)._get_step_plan_key(parameters) + \
+               (self._min_hops, self._max_hops, self._distinct)
+
+    def _get_step_category_dependencies(self):
+        return self._get_category_or_all_dependency()
+
+    def _get_edge_join_condition(self, node_from_id):
+        join_cond = orm.Edge.node_from_id == node_from_id
+        if self._category is not None:
+            join_cond&= orm.Edge.category_id == self._category
+        return join_cond
+
+    def _get_populate_query(self):
+        copy_names = [c.name for c in self._copy_columns_target]
+
+        anchor = sql.select([self._base._tt_current_location_id.label(self._node_column_name)] +
+                            [source.label(name) for source, name in zip(self._copy_columns_source, copy_names)] +
+                            [sql.literal(0).label(self._hops_column_name)])
+        traversal = anchor.cte(self._base.get_temp_table().name+"_traversal", recursive=True)
+        node_id = traversal.c[self._node_column_name]
+        hops = traversal.c[self._hops_column_name]
+
+        step = sql.select([orm.Edge.node_to_id] + [traversal.c[name] for name in copy_names] + [hops + 1]).\
+            select_from(traversal.join(orm.Edge.__table__, self._get_edge_join_condition(node_id))).\
+            where(hops < self._max_hops)
+
+        if self._distinct:
+            traversal = traversal.union(step) # UNION removes duplicate rows from the frontier at each hop
+        else:
+            traversal = traversal.union_all(step)
+
+        result_columns = [traversal.c[self._node_column_name]] + [traversal.c[name] for name in copy_names]
+        query = sql.select(result_columns).where(traversal.c[self._hops_column_name] >= self._min_hops)
+
+        if self._distinct:
+            # GROUP BY rather than DISTINCT, so that rows remain distinct when numbered within a CTE
+            query = query.group_by(*result_columns)
+
+        return [self._tt_current_location_id] + self._copy_columns_target, query
+
+    def _can_evaluate_without_temp_table(self):
+        # the temp table fallback is used for backends that may not support recursive CTEs
+        return self._graph_connection.use_cte
+
+    def _create_frontier_table(self):
+        frontier = TempTableState()
+        frontier.add_column(self._node_column_name, Integer)
+        for col in self._copy_columns_target:
+            frontier.add_column(col.name, Integer)
+        frontier.create(self._session)
+        return frontier
+
+    def _populate_temp_table(self):
+        node_columns = [self._tt_current_location_id] + self._copy_columns_target
+
+        if self._distinct:
+            results = self._create_frontier_table()
+        else:
+            results = None
+        frontier = self._create_frontier_table()
+
+        try:
+            base_query = sql.select([self._base._tt_current_location_id] + self._copy_columns_source)
+            if self._distinct:
+                base_query = base_query.distinct()
+            self._connection.execute(frontier.get_table().insert().from_select(
+                frontier.get_column_names()[1:], base_query))
+
+            for hop in range(self._max_hops+1):
+                frontier_table = frontier.get_table()
+                frontier_columns = frontier.get_columns()[1:]
+                if hop>=self._min_hops:
+                    if results is None:
+                        target_table, target_columns = self.get_temp_table(), node_columns
+                    else:
+                        target_table, target_columns = results.get_table(), results.get_columns()[1:]
+                    self._connection.execute(target_table.insert().from_select(
+                        target_columns, sql.select(frontier_columns)))
+
+                if hop==self._max_hops:
+                    break
+
+                next_query = sql.select([orm.Edge.node_to_id] + frontier_columns[1:]).\
+                    select_from(frontier_table.join(orm.Edge.__table__,
+                                                    self._get_edge_join_condition(frontier_columns[0])))
+                if self._distinct:
+                    next_query = next_query.distinct()
+
+                next_frontier = self._create_frontier_table()
+                self._connection.execute(next_frontier.get_table().insert().from_select(
+                    next_frontier.get_column_names()[1:], next_query))
+                frontier.destroy()
+                frontier = next_frontier
+
+                if not self._connection.execute(sql.select([sql.exists(sql.select([frontier.get_table()]))])).scalar():
+                    break
+
+            if results is not None:
+                self._connection.execute(self.get_temp_table().insert().from_select(
+                    node_columns, sql.select(results.get_columns()[1:]).distinct()))
+        finally:
+            frontier.destroy()
+            if results is not None:
+                results.destroy()
 
-    def _filter_temp_table(self):
-        # Remove NULL entries generated by outer join above
-        tt = self.get_temp_table()
-        self._connection.execute(tt.delete().where(self._tt_current_location_id == None))
 
 class NodeAllPropertiesQuery(AllPropertiesQuery, NodeQueryFromNodeQuery):
     pass
@@ -122,4 +397,47 @@ class NodeFilterNamedPropertiesQuery(FilterNamedPropertiesQuery, NodeQueryWithVa
     """Represents a query that returns the underlying nodes, filtered by a condition that relies on named properties.
 
     Note that the properties are not returned to the user."""
-    pass
\ No newline at end of file
+    pass
+
+
+class DegreeQuery(AggregateQuery):
+    """Represents the number of edges attached to each node in the underlying query; see GenericNodeQuery.degree"""
+
+    _group_by_current = True
+    _directions = ("out", "in", "any")
+
+    def __init__(self, base, category, direction):
+        if direction not in self._directions:
+            raise ValueError("Unknown direction %r; must be one of %s" % (direction, ", ".join(self._directions)))
+        self._direction = direction
+        super(DegreeQuery, self).__init__(base)
+        self._set_category(category)
+
+    def _add_columns_for_aggregates(self):
+        self._add_aggregate_column(Integer)
+
+    def _count_edges(self, *conditions):
+        edges = orm.Edge.__table__
+        if self._category:
+            conditions+=(edges.c.category_id == self._category,)
+        return sql.select([sql.func.count()]).where(sql.and_(*conditions)).as_scalar()
+
+    def _get_aggregates(self, from_clause, current_id):
+        # each count is a correlated subquery, evaluated once per node using the indexes on the edges table
+        edges = orm.Edge.__table__
+        out_degree = self._count_edges(edges.c.node_from_id == current_id)
+        in_degree = self._count_edges(edges.c.node_to_id == current_id)
+        if self._direction == "out":
+            degree = out_degree
+        elif self._direction == "in":
+            degree = in_degree
+        else:
+            degree = out_degree + in_degree - self._count_edges(edges.c.node_from_id == current_id,
+                                                                edges.c.node_to_id == current_id)
+        return from_clause, [degree]
+
+    def _get_step_plan_key(self, parameters):
+        return super(DegreeQuery, self)._get_step_plan_key(parameters) + (self._direction,)
+
+    def _get_step_category_dependencies(self):
+        return self._get_category_or_all_dependency()
@@ -0,0 +1,124 @@
+"""Caching of query results, invalidated when the categories a result depends on are written to."""
+
+import collections
+import threading
+import time
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from . import orm
+
+def _map_instances(result, function):
+    """Return a copy of a query result (e.g. a list of nodes, or of tuples of nodes and values) with each ORM object
+    replaced by function(object)"""
+    if isinstance(result, orm.Base):
+        return function(result)
+    elif isinstance(result, list):
+        return [_map_instances(item, function) for item in result]
+    elif isinstance(result, tuple):
+        return tuple(_map_instances(item, function) for item in result)
+    elif isinstance(result, dict):
+        return dict((key, _map_instances(value, function)) for key, value in result.items())
+    else:
+        return result
+
+def _detached_copy(result):
+    """Return a copy of the result whose ORM objects are detached copies of those in the result, belonging to no
+    session, so that they are unaffected by changes to the originals"""
+    scratch_session = Session()
+    try:
+        return _map_instances(result, lambda instance: scratch_session.merge(instance, load=False))
+    finally:
+        scratch_session.expunge_all()
+
+def _attached_copy(result, session):
+    """Return a copy of a cached result whose ORM objects belong to the given session (that of the calling thread)"""
+    def attach(instance):
+        existing = session.identity_map.get(inspect(instance).key)
+        if existing is not None:
+            return existing # as a query would, leaving any changes made to it in place
+        instance = session.merge(instance, load=False)
+        # as for objects loaded by a query; see orm._record_graff_connection
+        instance._graff_connection = session.info.get('graff_connection')
+        return instance
+    return _map_instances(result, attach)
+
+class ResultCache(object):
+    """An LRU cache of query results, with optional expiry after a fixed time.
+
+    Each result is stored with the set of category IDs it depends on (node or edge categories, and property names), or
+    None if it depends on every category. Writing to a category through the Connection invalidates the results that
+    depend on it. Writes made by other connections or processes are not seen, except by expiry of the results.
+
+    Nodes and edges are cached as detached copies, and merged into the session of the caller on every hit. Results can
+    therefore be shared between the threads (and sessions) of a thread-safe connection, and modifying the objects
+    returned does not affect the cache.
+
+    Use through Connection.enable_result_cache."""
+
+    def __init__(self, max_size, ttl=None):
+        """
+        :param max_size: the maximum number of results to hold; the least recently used are discarded first
+        :param ttl: if not None, the number of seconds after which a result expires
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict() # maps key to (result, dependencies, expiry time or None)
+        self._lock = threading.Lock()
+        self._generation = 0 # incremented by every invalidation
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_compute(self, key, dependencies, compute, session):
+        """Return the cached result for key if there is one; otherwise call compute() and cache its result.
+
+        :param dependencies: the set of category IDs on which the result depends, or None if it depends on all of them
+        :param session: the SQLAlchemy session to which ORM objects in a cached result are attached
+        """
+        try:
+            hash(key)
+        except TypeError:
+            return compute() # e.g. a filter compares against an unhashable value
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                result, _, expires = entry
+                if expires is None or time.time()<expires:
+                    self._entries[key] = entry # now the most recently used
+                    self.hits+=1
+                    return _attached_copy(result, session)
+            self.misses+=1
+            generation = self._generation
+
+        result = compute()
+        cached = _detached_copy(result) # the caller may go on to modify the objects in result
+
+        with self._lock:
+            # if there has been a write in the meantime, the result may already be out of date
+            if generation==self._generation:
+                expires = None if self.ttl is None else time.time()+self.ttl
+                self._entries[key] = (cached, dependencies, expires)
+                while len(self._entries)>self.max_size:
+                    self._entries.popitem(last=False)
+        return result
+
+    def invalidate(self, categories):
+        """Discard the results that depend on any of the given category IDs"""
+        categories = set(categories)
+        with self._lock:
+            self._generation+=1
+            stale = [key for key, (result, dependencies, expires) in self._entries.items()
+                     if dependencies is None or not categories.isdisjoint(dependencies)]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        """Discard all results"""
+        with self._lock:
+            self._generation+=1
+            self._entries.clear()
@@ -0,0 +1,423 @@
+"""In-memory snapshots of the graph, held as numpy arrays in compressed sparse row (CSR) form.
+
+A snapshot is read from the database in bulk, after which neighbourhoods, degrees and breadth-first searches are
+computed by vectorised numpy operations, without any further queries. Use through Connection.snapshot; requires numpy.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from sqlalchemy import sql
+
+from . import orm, config, flexible_value
+
+_directions = ("out", "in", "any")
+
+# the version of the directory layout written by Snapshot.save, incremented whenever it changes incompatibly
+format_version = 1
+_array_names = ("indptr", "destinations", "edge_ids", "edge_category_ids", "node_exists", "node_category_ids")
+
+
+def _int_arrays(*columns):
+    return [np.array(values, dtype=np.int64) for values in columns]
+
+def _read_rows(session, columns, condition, convert=_int_arrays):
+    """Return the values of the given columns in the rows satisfying the condition, as a list of numpy arrays.
+
+    The rows are retrieved config.snapshot_batch_size at a time, and each batch is converted to arrays as it arrives, so
+    that the rows are never all held as python objects at once.
+
+    :param convert: a function taking a sequence of values for each column, and returning a list of arrays; by
+      default, one int64 array per column
+    """
+    result = session.execute(sql.select(columns).where(condition))
+    batches = []
+    while True:
+        rows = result.fetchmany(config.snapshot_batch_size)
+        if len(rows)==0:
+            break
+        batches.append(convert(*zip(*rows)))
+    if len(batches)==0:
+        return convert(*[()]*len(columns))
+    return [np.concatenate(arrays) for arrays in zip(*batches)]
+
+def _property_arrays(ids, parent_ids, category_ids, values_int, values_float, values_str):
+    return _int_arrays(ids, parent_ids, category_ids) + \
+           [flexible_value.flexible_values_to_array(values_int, values_float, values_str)]
+
+
+def _store_values(existing, length, positions, values):
+    """Return the existing array extended to the given length, with the values stored at the given positions.
+
+    The array is float64 (with NaN for missing values) if all the values are numeric, otherwise object (with None)."""
+    numeric = existing.dtype!=object and values.dtype!=object
+    result = np.empty(length, dtype=np.float64 if numeric else object)
+    result.fill(np.nan if numeric else None)
+    if numeric or existing.dtype==object:
+        result[:len(existing)] = existing
+    else:
+        present = ~np.isnan(existing)
+        result[:len(existing)][present] = existing[present]
+    result[positions] = values
+    return result
+
+
+class Snapshot(object):
+    """The edges of the graph (or of one category of edges) and selected properties, held in memory as numpy arrays.
+
+    Nodes are identified by their IDs, which index the arrays directly. Every ID up to the largest node ID is included,
+    so that nodes without any edges have degree zero; node_exists records which IDs belong to nodes (of node_category,
+    if given), node_ids lists them, and node_category_ids gives their category IDs (-1 for IDs that are not nodes in
+    the snapshot). The edges leaving node i are listed in destinations[indptr[i]:indptr[i+1]], and their IDs and
+    category IDs in the same positions of edge_ids and edge_category_ids. Node properties are arrays indexed by node ID, and edge properties are
+    arrays aligned with edge_ids. Numeric properties are float64, with NaN where a node or edge does not have the
+    property; any others are object arrays, with None for missing values.
+
+    Since nodes and edges are never deleted, refresh() brings the snapshot up to date by reading only the edges and
+    properties with IDs greater than the largest already read. Rows committed out of order by concurrent writers can be
+    missed this way, in which case a new snapshot must be taken.
+
+    save() writes the snapshot to a directory of .npy files, which load() opens as read-only memory maps, so that a
+    snapshot of a large graph can be shared by many processes and opened without reading the database."""
+
+    def __init__(self, connection, edge_category=None, node_properties=(), edge_properties=(), node_category=None):
+        """
+        :param connection: the graff Connection to read from
+        :param edge_category: the name of the category of edges to read; or if None, all edges are read
+        :param node_properties, edge_properties: the names of properties to read for the nodes and edges
+        :param node_category: if not None, only nodes of the named category are marked in node_exists
+        """
+        self._connection = connection
+        self.edge_category = edge_category
+        self.node_category = node_category
+        category_cache = connection.category_cache
+        self._category_id = None if edge_category is None else category_cache.get_id(edge_category)
+        self._node_category_id = None if node_category is None else category_cache.get_id(node_category)
+        self._node_property_ids = dict(zip(node_properties, category_cache.get_ids(node_properties)))
+        self._edge_property_ids = dict(zip(edge_properties, category_cache.get_ids(edge_properties)))
+
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.destinations = np.zeros(0, dtype=np.int64)
+        self.edge_ids = np.zeros(0, dtype=np.int64)
+        self.edge_category_ids = np.zeros(0, dtype=np.int64)
+        self.node_exists = np.zeros(0, dtype=bool)
+        self.node_category_ids = np.zeros(0, dtype=np.int64)
+        self.node_properties = {name: np.zeros(0) for name in node_properties}
+        self.edge_properties = {name: np.zeros(0) for name in edge_properties}
+        self.max_edge_id = 0
+        self.max_node_id = 0
+        self._max_node_property_id = 0
+        self._max_edge_property_id = 0
+        self._csr_cache = {}
+        self.refresh()
+
+    @property
+    def n_nodes(self):
+        """The length of arrays indexed by node ID, i.e. one more than the largest node ID"""
+        return len(self.indptr)-1
+
+    @property
+    def n_edges(self):
+        return len(self.destinations)
+
+    @property
+    def node_ids(self):
+        """The IDs of the nodes in the snapshot, in ascending order"""
+        return np.flatnonzero(self.node_exists)
+
+    def refresh(self):
+        """Read the nodes, edges and properties added to the database since the snapshot was taken or last refreshed.
+
+        :return: the number of edges added to the snapshot
+        """
+        session = self._get_session()
+        edges = orm.Edge.__table__
+        new_edge_ids, new_sources, new_destinations, new_edge_category_ids = _read_rows(
+            session, [edges.c.id, edges.c.node_from_id, edges.c.node_to_id, edges.c.category_id],
+            self._get_new_edges_condition())
+        nodes = orm.Node.__table__
+        new_node_ids, new_node_category_ids = _read_rows(session, [nodes.c.id, nodes.c.category_id],
+                                                         self._get_new_nodes_condition())
+        n_nodes = self.n_nodes
+        if len(new_node_ids)>0:
+            self.max_node_id = max(self.max_node_id, int(new_node_ids.max()))
+            n_nodes = max(n_nodes, self.max_node_id+1)
+        if len(new_edge_ids)>0:
+            self.max_edge_id = max(self.max_edge_id, int(new_edge_ids.max()))
+            n_nodes = int(max(n_nodes, new_sources.max()+1, new_destinations.max()+1))
+
+        sources = np.concatenate((self._get_sources(), new_sources))
+        order = np.argsort(sources, kind='stable')
+        self.destinations = np.concatenate((self.destinations, new_destinations))[order]
+        self.edge_ids = np.concatenate((self.edge_ids, new_edge_ids))[order]
+        self.edge_category_ids = np.concatenate((self.edge_category_ids, new_edge_category_ids))[order]
+        for name, values in self.edge_properties.items():
+            self.edge_properties[name] = _store_values(values, len(order), [], values[:0])[order]
+        self.indptr = np.zeros(n_nodes+1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n_nodes), out=self.indptr[1:])
+        self._csr_cache = {}
+        self.node_exists = np.concatenate((self.node_exists, np.zeros(n_nodes-len(self.node_exists), dtype=bool)))
+        self.node_exists[new_node_ids] = True
+        self.node_category_ids = np.concatenate((self.node_category_ids,
+                                                 np.full(n_nodes-len(self.node_category_ids), -1, dtype=np.int64)))
+        self.node_category_ids[new_node_ids] = new_node_category_ids
+
+        for name, values in self.node_properties.items():
+            self.node_properties[name] = _store_values(values, n_nodes, [], values[:0])
+        self._max_node_property_id = self._read_properties(session, orm.NodeProperty, orm.NodeProperty.node_id,
+                                                           self._node_property_ids, self.node_properties,
+                                                           self._max_node_property_id, self._get_node_positions)
+        self._max_edge_property_id = self._read_properties(session, orm.EdgeProperty, orm.EdgeProperty.edge_id,
+                                                           self._edge_property_ids, self.edge_properties,
+                                                           self._max_edge_property_id, self._get_edge_positions)
+        return len(new_edge_ids)
+
+    def _get_session(self):
+        if self._connection is None:
+            raise ValueError("This snapshot was loaded without a connection to the database")
+        return self._connection.get_sqlalchemy_session()
+
+    def _get_new_edges_condition(self):
+        edges = orm.Edge.__table__
+        condition = edges.c.id > self.max_edge_id
+        if self._category_id is not None:
+            condition&= edges.c.category_id == self._category_id
+        return condition
+
+    def _get_new_nodes_condition(self):
+        nodes = orm.Node.__table__
+        condition = nodes.c.id > self.max_node_id
+        if self._node_category_id is not None:
+            condition&= nodes.c.category_id == self._node_category_id
+        return condition
+
+    @staticmethod
+    def _get_new_properties_condition(class_, property_ids, max_property_id):
+        properties = class_.__table__
+        return (properties.c.id > max_property_id) & properties.c.category_id.in_(list(property_ids.values()))
+
+    def is_stale(self):
+        """Return True if nodes, edges or (selected) properties have been added to the database since the snapshot was
+        taken or last refreshed.
+
+        Only the largest IDs read are compared with the database, in one query per table that finds at most one row
+        using the primary key, so this is cheap enough to check before every use of a saved snapshot. New values of the
+        selected properties count even if they belong to nodes or edges outside the snapshot."""
+        session = self._get_session()
+        conditions = [self._get_new_edges_condition(), self._get_new_nodes_condition()]
+        if len(self._node_property_ids)>0:
+            conditions.append(self._get_new_properties_condition(orm.NodeProperty, self._node_property_ids,
+                                                                 self._max_node_property_id))
+        if len(self._edge_property_ids)>0:
+            conditions.append(self._get_new_properties_condition(orm.EdgeProperty, self._edge_property_ids,
+                                                                 self._max_edge_property_id))
+        return any(session.execute(sql.select([sql.exists().where(condition)])).scalar() for condition in conditions)
+
+    def save(self, directory, overwrite=False):
+        """Write the snapshot to a new directory of .npy files, which can be opened by load().
+
+        The files are written to a temporary directory alongside, which is then renamed, so that other processes never
+        see a partly written snapshot. Processes that have loaded a previous snapshot from the same directory can
+        continue to use it after it is overwritten.
+
+        :param overwrite: if True, replace any existing directory; otherwise, raise ValueError if it exists
+        """
+        directory = os.path.abspath(directory)
+        if os.path.exists(directory) and not overwrite:
+            raise ValueError("%s already exists" % directory)
+        temp_directory = tempfile.mkdtemp(prefix="."+os.path.basename(directory)+".", dir=os.path.dirname(directory))
+        try:
+            for name in _array_names:
+                np.save(os.path.join(temp_directory, name+".npy"), getattr(self, name))
+            metadata = {'format_version': format_version,
+                        'edge_category': self.edge_category, 'category_id': self._category_id,
+                        'node_category': self.node_category, 'node_category_id': self._node_category_id,
+                        'max_edge_id': int(self.max_edge_id), 'max_node_id': int(self.max_node_id),
+                        'max_node_property_id': int(self._max_node_property_id),
+                        'max_edge_property_id': int(self._max_edge_property_id)}
+            for kind, arrays, property_ids in (("node", self.node_properties, self._node_property_ids),
+                                               ("edge", self.edge_properties, self._edge_property_ids)):
+                # the files are numbered, since property names need not be valid filenames
+                metadata[kind+'_properties'] = []
+                for i, name in enumerate(sorted(arrays)):
+                    filename = "%s_property_%d.npy" % (kind, i)
+                    np.save(os.path.join(temp_directory, filename), arrays[name], allow_pickle=True)
+                    metadata[kind+'_properties'].append({'name': name, 'category_id': property_ids[name],
+                                                         'filename': filename})
+            with open(os.path.join(temp_directory, "metadata.json"), "w") as f:
+                json.dump(metadata, f, indent=1)
+
+            if os.path.exists(directory):
+                old_directory = temp_directory+".old"
+                os.rename(directory, old_directory)
+                os.rename(temp_directory, directory)
+                shutil.rmtree(old_directory)
+            else:
+                os.rename(temp_directory, directory)
+        except:
+            shutil.rmtree(temp_directory, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, directory, connection=None):
+        """Open a snapshot written by save(), without reading the database.
+
+        The arrays are memory-mapped read-only, so they are read from disk only as they are used, and the operating
+        system's page cache shares them between all the processes that load the same snapshot. Properties that are not
+        numeric are held in object arrays, which cannot be memory-mapped, and so are read into memory in full.
+
+        :param connection: the graff Connection to the database from which the snapshot was taken, needed only by
+          refresh() and is_stale()
+        """
+        with open(os.path.join(directory, "metadata.json")) as f:
+            metadata = json.load(f)
+        if metadata['format_version']!=format_version:
+            raise ValueError("%s is a snapshot in format version %r, but only version %d can be loaded" %
+                             (directory, metadata['format_version'], format_version))
+
+        def load_array(filename):
+            path = os.path.join(directory, filename)
+            try:
+                return np.load(path, mmap_mode='r')
+            except ValueError: # an object array
+                return np.load(path, allow_pickle=True)
+
+        snapshot = cls.__new__(cls)
+        snapshot._connection = connection
+        snapshot.edge_category = metadata['edge_category']
+        snapshot.node_category = metadata['node_category']
+        snapshot._category_id = metadata['category_id']
+        snapshot._node_category_id = metadata['node_category_id']
+        snapshot.max_edge_id = metadata['max_edge_id']
+        snapshot.max_node_id = metadata['max_node_id']
+        snapshot._max_node_property_id = metadata['max_node_property_id']
+        snapshot._max_edge_property_id = metadata['max_edge_property_id']
+        for name in _array_names:
+            setattr(snapshot, name, load_array(name+".npy"))
+        for kind in "node", "edge":
+            properties = metadata[kind+'_properties']
+            setattr(snapshot, kind+'_properties',
+                    dict((p['name'], load_array(p['filename'])) for p in properties))
+            setattr(snapshot, '_%s_property_ids' % kind, dict((p['name'], p['category_id']) for p in properties))
+        snapshot._csr_cache = {}
+        return snapshot
+
+    def _read_properties(self, session, class_, id_column, property_ids, arrays, max_property_id, get_positions):
+        """Store the values of properties with IDs greater than max_property_id in the arrays, returning the new
+        maximum ID"""
+        if len(property_ids)==0:
+            return max_property_id
+        properties = class_.__table__
+        ids, parent_ids, category_ids, values = _read_rows(
+            session, [properties.c.id, properties.c[id_column.name], properties.c.category_id, properties.c.value_int,
+                      properties.c.value_float, properties.c.value_str],
+            self._get_new_properties_condition(class_, property_ids, max_property_id), _property_arrays)
+        if len(ids)==0:
+            return max_property_id
+
+        positions, found = get_positions(parent_ids)
+        for name, category_id in property_ids.items():
+            selected = found & (category_ids==category_id)
+            if selected.any():
+                arrays[name] = _store_values(arrays[name], len(arrays[name]), positions[selected], values[selected])
+        return max(max_property_id, int(ids.max()))
+
+    def _get_node_positions(self, node_ids):
+        return node_ids, node_ids<self.n_nodes
+
+    def _get_edge_positions(self, edge_ids):
+        """Return the positions of the given edges in edge_ids, and whether each is in the snapshot at all"""
+        if self.n_edges==0:
+            return np.zeros(len(edge_ids), dtype=np.int64), np.zeros(len(edge_ids), dtype=bool)
+        order = np.argsort(self.edge_ids)
+        index = np.minimum(np.searchsorted(self.edge_ids[order], edge_ids), self.n_edges-1)
+        return order[index], self.edge_ids[order[index]]==edge_ids
+
+    def _get_sources(self):
+        """Return the ID of the node from which each edge leaves, aligned with destinations"""
+        return np.repeat(np.arange(self.n_nodes, dtype=np.int64), np.diff(self.indptr))
+
+    def _get_csr(self, direction):
+        """Return (indptr, neighbours, edge_positions) for following edges in the given direction.
+
+        The neighbours of node i are neighbours[indptr[i]:indptr[i+1]], reached along the edges at edge_positions in
+        the same slice. For direction "any", an edge from a node to itself is listed only once."""
+        if direction not in _directions:
+            raise ValueError("Unknown direction %r; must be one of %s" % (direction, ", ".join(_directions)))
+        if direction=="out":
+            return self.indptr, self.destinations, np.arange(self.n_edges)
+        if direction not in self._csr_cache:
+            sources = self._get_sources()
+            positions = np.arange(self.n_edges)
+            if direction=="in":
+                origins, neighbours = self.destinations, sources
+            else:
+                reverse = sources!=self.destinations
+                origins = np.concatenate((sources, self.destinations[reverse]))
+                neighbours = np.concatenate((self.destinations, sources[reverse]))
+                positions = np.concatenate((positions, positions[reverse]))
+            order = np.argsort(origins, kind='stable')
+            indptr = np.zeros(self.n_nodes+1, dtype=np.int64)
+            np.cumsum(np.bincount(origins, minlength=self.n_nodes), out=indptr[1:])
+            self._csr_cache[direction] = indptr, neighbours[order], positions[order]
+        return self._csr_cache[direction]
+
+    def degree(self, ids=None, direction="out"):
+        """Return the number of edges attached to each of the given nodes, or to every node (indexed by ID) if ids is
+        None. For direction "any", an edge from a node to itself is counted once."""
+        counts = np.diff(self._get_csr(direction)[0])
+        if ids is None:
+            return counts
+        return counts[np.asarray(ids, dtype=np.int64)]
+
+    def _get_neighbour_index(self, indptr, ids):
+        starts = indptr[ids]
+        counts = indptr[ids+1]-starts
+        offsets = np.zeros(len(ids)+1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return offsets, np.repeat(starts-offsets[:-1], counts)+np.arange(offsets[-1])
+
+    def neighbors(self, ids, direction="out"):
+        """Return the neighbours of each of the given nodes.
+
+        :return: (offsets, neighbours), where the neighbours of ids[i] are neighbours[offsets[i]:offsets[i+1]]
+        """
+        indptr, neighbours, _ = self._get_csr(direction)
+        offsets, index = self._get_neighbour_index(indptr, np.asarray(ids, dtype=np.int64).reshape(-1))
+        return offsets, neighbours[index]
+
+    def follow(self, ids, direction="out", distinct=False, return_edges=False):
+        """Return the nodes reached by following one edge from each of the given nodes, like NodeQuery.follow.
+
+        :param distinct: if True, return the sorted unique IDs of the nodes reached; otherwise one per edge followed
+        :param return_edges: if True (and distinct is False), return the origin of each edge followed and the position
+          of the edge in edge_ids (and in the arrays of edge properties), as well as the destination
+        """
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        indptr, neighbours, edge_positions = self._get_csr(direction)
+        offsets, index = self._get_neighbour_index(indptr, ids)
+        if distinct:
+            return np.unique(neighbours[index])
+        elif return_edges:
+            return np.repeat(ids, np.diff(offsets)), neighbours[index], edge_positions[index]
+        else:
+            return neighbours[index]
+
+    def bfs(self, sources, max_depth=None, direction="out"):
+        """Return the distance of every node from the nearest of the sources, as an array indexed by node ID.
+
+        Nodes that are not reached within max_depth edges (or at all, if max_depth is None) have distance -1."""
+        distances = np.empty(self.n_nodes, dtype=np.int64)
+        distances.fill(-1)
+        frontier = np.unique(np.asarray(sources, dtype=np.int64))
+        distances[frontier] = 0
+        depth = 0
+        while len(frontier)>0 and (max_depth is None or depth<max_depth):
+            reached = self.follow(frontier, direction, distinct=True)
+            frontier = reached[distances[reached]<0]
+            depth+=1
+            distances[frontier] = depth
+        return distances
@@ -1,7 +1,23 @@
 import re
+import threading
 from . import orm
 from sqlalchemy import Table, Column, Integer, Index, ForeignKey, sql
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import AliasedClass
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.elements import Label
+
+def label_statement_columns(statement, names):
+    """Return a copy of the select statement with its columns labelled by the specified names"""
+    labelled_columns = []
+    for name, column in zip(names, statement.inner_columns):
+        if isinstance(column, Label):
+            column = column.element
+        labelled_columns.append(column.label(name))
+    return statement.with_only_columns(labelled_columns)
+
+# Guards the registration of temp tables in orm.Base.metadata, which is shared by all threads
+_metadata_lock = threading.Lock()
 
 class TempTableStateError(RuntimeError):
     """Raised when a manipulation requires the temp table to exist in the database but it does not, or vice versa."""
@@ -10,12 +26,17 @@ class TempTableState(object):
     """Represents a temp table both before and during its existence.
 
     Columns can be added before the creation of the temp table, and they can either be explicitly named or the class
-    can create new unique names if required."""
+    can create new unique names if required.
+
+    The table may alternatively be represented by a common table expression (CTE) rather than created in the
+    database; see create() and populate_cte()."""
     def __init__(self):
         self._columns = [Column('id', Integer, primary_key=True)]
         self._columns_query_callback = [self._default_column_callback]
         self._columns_postprocess_callback = [None]
         self._active = False
+        self._as_cte = False
+        self._cte = None
         self._insert_point = 1
 
     @staticmethod
@@ -106,32 +127,98 @@ class TempTableState(object):
         if not self._active:
             raise TempTableStateError("Cannot perform this operation until the temp table is active in the database")
 
-    def create(self, sqlalchemy_session):
-        """Create the temporary table. The schema becomes immutable until destroy() is called"""
+    def create(self, sqlalchemy_session, as_cte=False):
+        """Create the temporary table. The schema becomes immutable until destroy() is called
+
+        :param as_cte: if True, nothing is created in the database. Instead the rows must be defined by calling
+          populate_cte(), after which the table is represented by a common table expression that can be embedded in
+          any subsequent SQL statement.
+        """
         self._assert_not_active()
         self._connection = sqlalchemy_session.connection()
         self._session = sqlalchemy_session
+        self._as_cte = as_cte
 
-        temp_table = Table(
-            self._generate_unique_name("temptable",orm.Base.metadata.tables.keys()),
-            orm.Base.metadata,
-            *self.get_columns(),
-            prefixes=['TEMPORARY']
-        )
+        with _metadata_lock:
+            temp_table = Table(
+                self._generate_unique_name("temptable",orm.Base.metadata.tables.keys()),
+                orm.Base.metadata,
+                *self.get_columns(),
+                prefixes=['TEMPORARY']
+            )
 
 
         self._temp_table = temp_table
-        self._table_index = Index('temp.index_' + temp_table.name, self.get_columns()[1])
-        self._temp_table.create(checkfirst=True, bind=self._connection)
+        if not as_cte:
+            self._table_index = Index('temp.index_' + temp_table.name, self.get_columns()[1])
+            self._temp_table.create(checkfirst=True, bind=self._connection)
 
 
         self._active = True
 
+    def populate_cte(self, columns, query, underlying=None):
+        """Define the rows of a table created with as_cte=True.
+
+        :param columns: the columns of this table which are populated, in the order they are returned by the query.
+          The id column is numbered sequentially, and any remaining columns are NULL.
+        :param query: the sqlalchemy Query or select statement generating the rows
+        :param underlying: the TempTableState of any table referenced by the query. References to that table are
+          rewritten to refer to its CTE.
+        """
+        self._assert_active()
+        if not self._as_cte:
+            raise TempTableStateError("Cannot populate a CTE for a temp table that exists in the database")
+
+        statement = getattr(query, 'statement', query)
+        if underlying is not None:
+            statement = underlying.adapt_to_cte(statement)
+
+        query_columns = dict(zip([str(c.name) for c in columns], statement.inner_columns))
+
+        # the id column keeps rows distinct; without it, the ORM would merge rows referring to identical objects
+        query_columns.setdefault('id', sql.func.row_number().over())
+
+        names = self.get_column_names()
+        statement = statement.with_only_columns([query_columns.get(name, sql.null()) for name in names])
+        self._cte = label_statement_columns(statement, names).cte(name=self._temp_table.name)
+
+    def adapt_to_cte(self, clause):
+        """Return a copy of the clause with references to the temp table replaced by references to its CTE.
+
+        If this table is not represented by a CTE, the clause is returned unchanged."""
+        self._assert_active()
+        if not self._as_cte:
+            return clause
+
+        table = self._temp_table
+        cte = self._cte
+
+        def replace(element):
+            if isinstance(element, Column) and element.table is table:
+                return cte.c[element.name]
+            elif hasattr(element, '_deannotate') and element._deannotate() is table:
+                return cte
+
+        return visitors.replacement_traverse(clause, {}, replace)
+
     def get_table(self):
-        """Get the temporary table. Will throw an error if the table has not yet been created."""
+        """Get the temporary table. Will throw an error if the table has not yet been created.
+
+        For a table represented by a CTE, this returns a placeholder table that can be used to construct queries;
+        those queries must then be passed through adapt_to_cte() before they are executed."""
         self._assert_active()
         return self._temp_table
 
+    def get_selectable(self):
+        """Get the selectable (either the temporary table or its CTE) that can be queried to retrieve rows."""
+        self._assert_active()
+        if self._as_cte:
+            if self._cte is None:
+                raise TempTableStateError("The CTE has not yet been populated")
+            return self._cte
+        else:
+            return self._temp_table
+
     def get_query(self):
         """Return the sqlalchemy query for recovering user data from this table.
 
@@ -141,8 +228,9 @@ class TempTableState(object):
         join_entities = []
         join_conditions = []
         query_options = []
+        selectable = self.get_selectable()
         for col, callback in zip(self._columns, self._columns_query_callback):
-            results = callback(col)
+            results = callback(selectable.c[col.name])
             if len(results)<3 or len(results)>4:
                 raise ValueError("Internal error: incorrect number of results returned from a query callback")
             query_entity, join_entity, join_condition = results[:3]
@@ -159,7 +247,7 @@ class TempTableState(object):
                 assert join_entity is None
                 assert join_condition is None
 
-        q = self._session.query(*query_entities).select_from(self.get_table())
+        q = self._session.query(*query_entities).select_from(selectable)
 
         for table, condition in zip(join_entities, join_conditions):
             q = q.outerjoin(table, condition)
@@ -169,6 +257,54 @@ class TempTableState(object):
 
         return q
 
+    def get_raw_query(self):
+        """Return a sqlalchemy query for recovering user data from this table as plain values, not ORM objects.
+
+        Nodes and edges are returned as their IDs, and each property as three SQL columns holding its value_int,
+        value_float and value_str. Will throw TempTableStateError if the table has not yet been created.
+
+        :return: the query, and a list giving the number of SQL columns that make up each user-visible column
+        """
+        self._assert_active()
+        query_entities = []
+        column_widths = []
+        join_entities = []
+        join_conditions = []
+        selectable = self.get_selectable()
+        for col, q_callback, p_callback in zip(self._columns, self._columns_query_callback,
+                                               self._columns_postprocess_callback):
+            sql_column = selectable.c[col.name]
+            results = q_callback(sql_column)
+            query_entity, join_entity, join_condition = results[:3]
+            if query_entity is None:
+                continue
+            if len(results)==4 or p_callback is not None:
+                raise ValueError("This column cannot be represented by plain values")
+
+            if isinstance(query_entity, AliasedClass):
+                # a node or edge; its ID is already stored in the temp table, so no join is required
+                query_entities.append(sql_column)
+                column_widths.append(1)
+            elif hasattr(query_entity, '__clause_element__') and hasattr(query_entity.__clause_element__(), 'clauses'):
+                # a composite value; retrieve each of its underlying columns
+                clauses = list(query_entity.__clause_element__().clauses)
+                query_entities+=clauses
+                column_widths.append(len(clauses))
+                join_entities.append(join_entity)
+                join_conditions.append(join_condition)
+            else:
+                query_entities.append(query_entity)
+                column_widths.append(1)
+                if join_entity is not None:
+                    join_entities.append(join_entity)
+                    join_conditions.append(join_condition)
+
+        q = self._session.query(*query_entities).select_from(selectable)
+        for table, condition in zip(join_entities, join_conditions):
+            q = q.outerjoin(table, condition)
+
+        return q, column_widths
+
     def postprocess_results(self, results):
         current_column_offset = 0
         for col, q_callback, p_callback in zip(self._columns, self._columns_query_callback, self._columns_postprocess_callback):
@@ -183,12 +319,19 @@ class TempTableState(object):
     def destroy(self):
         """Destroy the temporary table and return the schema to being mutable."""
         self._assert_active()
-        self._table_index.drop(bind=self._connection)
-        self._temp_table.drop(checkfirst=True, bind=self._connection)
+        if not self._as_cte:
+            self._table_index.drop(bind=self._connection)
+            self._temp_table.drop(checkfirst=True, bind=self._connection)
+
+        with _metadata_lock:
+            orm.Base.metadata.remove(self._temp_table)
 
-        orm.Base.metadata.remove(self._temp_table)
+        # detach the columns from the table, so that a new table can be created if the query is evaluated again
+        for column in self._columns:
+            column.table = None
 
         self._temp_table = None
+        self._cte = None
 
         self._active = False
 
@@ -1,7 +1,8 @@
 from . import connection, orm, compatibility
+import contextlib
 import random
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 
 def _wipe_database(uri):
     if '//' not in uri:
@@ -19,6 +20,41 @@ def get_test_connection(test_uri=None):
     _wipe_database(test_uri)
     return connection.Connection(test_uri)
 
+def for_both_engines(con, test_function):
+    """Call test_function twice, with the connection's queries compiled into common table expressions and then
+    materialised into temp tables"""
+    original_use_cte = con.use_cte
+    for use_cte in True, False:
+        con.use_cte = use_cte
+        try:
+            test_function()
+        finally:
+            con.use_cte = original_use_cte
+
+def ids(objects):
+    """Return the sorted IDs of a list of nodes or edges"""
+    return sorted(o.id for o in objects)
+
+@contextlib.contextmanager
+def recorded_statements(con):
+    """Within the with block, record the SQL of every statement executed by the connection's engine in the list
+    returned"""
+    statements = []
+    def record_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+    engine = con.get_sqlalchemy_session().get_bind()
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+
+def count_statements(con, function):
+    """Return the number of SQL statements executed by calling function()"""
+    with recorded_statements(con) as statements:
+        function()
+    return len(statements)
+
 def init_ownership_graph(db_uri=None):
 
     con = get_test_connection(db_uri)
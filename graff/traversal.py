@@ -0,0 +1,163 @@
+"""Breadth-first searches and shortest paths over the edges table, expanding one frontier at a time.
+
+Each search records the nodes it has visited in a temp table, together with the depth at which each was reached and
+the node from which it was first reached. The newest frontier is kept in a temp table of its own; each step of the
+search joins it to the edges table, discards the nodes already visited and records the rest, in a few INSERT ... SELECT
+and DELETE statements. The memory used is therefore proportional to the number of nodes visited rather than the number
+of paths. No statement refers to the same temp table twice, which MySQL does not allow.
+
+Use through Connection.bfs and Connection.shortest_path."""
+
+from sqlalchemy import Integer, sql
+
+from . import orm
+from .temptable import TempTableState
+
+_reverse_directions = {"out": "in", "in": "out", "any": "any"}
+
+
+class Search(object):
+    """A breadth-first search from a set of source nodes, which are at depth zero"""
+
+    def __init__(self, session, sources, category_id=None, direction="out"):
+        """
+        :param session: the SQLAlchemy session in which to create the temp table of visited nodes
+        :param sources: the IDs of the nodes from which to start
+        :param category_id: if not None, follow only edges of this category
+        :param direction: "out" to follow edges forwards, "in" to follow them backwards, or "any" for both
+        """
+        if direction not in _reverse_directions:
+            raise ValueError("Unknown direction %r; must be one of %s" % (direction, ", ".join(_reverse_directions)))
+        self._connection = session.connection()
+        self._category_id = category_id
+        self._direction = direction
+        self.depth = 0 # the depth of the current frontier
+
+        self._visited = self._create_table(session, "node_id", "depth", "parent_id")
+        self._frontier = self._create_table(session, "node_id")
+        self._reached = self._create_table(session, "node_id", "parent_id") # the nodes reached by the current step
+
+        sources = set(sources)
+        if len(sources)>0:
+            self._connection.execute(self._visited.get_table().insert(),
+                                     [{'node_id': node_id, 'depth': 0} for node_id in sources])
+            self._connection.execute(self._frontier.get_table().insert(),
+                                     [{'node_id': node_id} for node_id in sources])
+        self.frontier_size = len(sources)
+
+    @staticmethod
+    def _create_table(session, *column_names):
+        table = TempTableState()
+        for name in column_names:
+            table.add_column(name, Integer) # the first column added is indexed
+        table.create(session)
+        return table
+
+    def close(self):
+        for table in self._visited, self._frontier, self._reached:
+            table.destroy()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _get_edge_ends(self):
+        """Return (origin, destination) for each direction in which edges are followed"""
+        edges = orm.Edge.__table__
+        ends = []
+        if self._direction in ("out", "any"):
+            ends.append((edges.c.node_from_id, edges.c.node_to_id))
+        if self._direction in ("in", "any"):
+            ends.append((edges.c.node_to_id, edges.c.node_from_id))
+        return ends
+
+    def expand(self):
+        """Visit the nodes linked to the current frontier that have not yet been visited, which become the new frontier.
+
+        :return: the number of nodes in the new frontier
+        """
+        visited = self._visited.get_table()
+        frontier = self._frontier.get_table()
+        reached = self._reached.get_table()
+        edges = orm.Edge.__table__
+
+        self._connection.execute(reached.delete())
+        for origin, destination in self._get_edge_ends():
+            join_cond = origin == frontier.c.node_id
+            if self._category_id is not None:
+                join_cond&= edges.c.category_id == self._category_id
+            self._connection.execute(reached.insert().from_select(
+                ["node_id", "parent_id"], sql.select([destination, origin]).select_from(frontier.join(edges, join_cond))))
+        self._connection.execute(reached.delete().where(reached.c.node_id.in_(sql.select([visited.c.node_id]))))
+
+        new_nodes = sql.select([reached.c.node_id, sql.literal(self.depth+1), sql.func.min(reached.c.parent_id)]).\
+            group_by(reached.c.node_id)
+        result = self._connection.execute(visited.insert().from_select(["node_id", "depth", "parent_id"], new_nodes))
+        self._connection.execute(frontier.delete())
+        self._connection.execute(frontier.insert().from_select(
+            ["node_id"], sql.select([reached.c.node_id]).distinct()))
+        self.depth+=1
+        self.frontier_size = result.rowcount
+        return self.frontier_size
+
+    def get_depths(self):
+        """Return a dictionary mapping the ID of every node visited to the depth at which it was reached"""
+        visited = self._visited.get_table()
+        return dict(self._connection.execute(sql.select([visited.c.node_id, visited.c.depth])).fetchall())
+
+    def find_meeting_node(self, other):
+        """Return the node in the current frontier that the other search reached at the lowest depth, or None if the
+        other search has not visited any of them"""
+        visited = self._visited.get_table()
+        other_visited = other._visited.get_table()
+        statement = sql.select([visited.c.node_id]).\
+            select_from(visited.join(other_visited, visited.c.node_id == other_visited.c.node_id)).\
+            where(visited.c.depth == self.depth).\
+            order_by(other_visited.c.depth).limit(1)
+        return self._connection.execute(statement).scalar()
+
+    def get_path(self, node_id):
+        """Return the IDs of the nodes on the path by which the search reached the given node, starting from a source"""
+        visited = self._visited.get_table()
+        path = [node_id]
+        while True:
+            parent_id = self._connection.execute(sql.select([visited.c.parent_id]).
+                                                 where(visited.c.node_id == path[-1])).scalar()
+            if parent_id is None:
+                return path[::-1]
+            path.append(parent_id)
+
+
+def bfs(session, sources, max_depth, category_id=None, direction="out"):
+    """Return a dictionary mapping each node within max_depth edges of the sources to its distance from them.
+
+    Arguments are as for Search."""
+    with Search(session, sources, category_id, direction) as search:
+        while search.depth<max_depth and search.frontier_size>0:
+            search.expand()
+        return search.get_depths()
+
+
+def shortest_path(session, source, target, category_id=None, max_hops=6, direction="out"):
+    """Return the IDs of the nodes on a shortest path from source to target, or None if there is none within max_hops.
+
+    Searches forwards from the source and backwards from the target, expanding whichever frontier is smaller, until
+    they meet."""
+    if source == target:
+        return [source]
+    with Search(session, [source], category_id, direction) as forward, \
+            Search(session, [target], category_id, _reverse_directions[direction]) as backward:
+        while forward.depth+backward.depth<max_hops:
+            if forward.frontier_size<=backward.frontier_size:
+                search, other = forward, backward
+            else:
+                search, other = backward, forward
+            if search.expand()==0:
+                return None
+            # the frontiers have not met before, so the first meeting gives a shortest path
+            meeting_node = search.find_meeting_node(other)
+            if meeting_node is not None:
+                return forward.get_path(meeting_node) + backward.get_path(meeting_node)[::-1][1:]
+        return None
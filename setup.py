@@ -1,13 +1,19 @@
 from __future__ import absolute_import
 install_requires = [
     'setuptools',
-    'sqlalchemy >= 1.0.10',
+    'sqlalchemy >= 1.2',
     ]
 
 tests_require = [
-    'nose >= 1.3.0'
+    'nose >= 1.3.0',
+    'numpy'
     ]
 
+extras_require = {
+    'arrays': ['numpy'],
+    'parallel': ['futures; python_version < "3"']
+    }
+
 from setuptools import setup, find_packages
 
 
@@ -34,5 +40,6 @@ setup(name='graff',
       python_requires='>=2.7,!=3.0.*,!=3.1.*,!=3.2.*,!=3.3.*,!=3.4.*',
       install_requires=install_requires,
       tests_require=tests_require,
+      extras_require=extras_require,
       test_suite="nose.collector"
       )
@@ -0,0 +1,90 @@
+from nose.tools import assert_raises
+import graff.testing as testing
+from graff.query.base import QueryStructureError
+
+def setup():
+    global test_db
+    test_db = testing.init_ownership_graph()
+    test_db.add_edges("likes", [(1, 2), (2, 1), (2, 2), (1, 3)], [{"num_messages": n} for n in (3, 5, 1, 10)])
+
+def teardown():
+    test_db.close()
+
+def _by_id(rows):
+    return sorted(rows, key=lambda row: row[0].id)
+
+def test_count_by_origin():
+    owners = test_db.query_node("person").return_this().follow("owns")
+    counts = _by_id(owners.group_by_origin().count())
+    assert [(node.id, count) for node, count in counts]==[(1, 10), (2, 50)]
+
+    # the same thing can be reached more than once
+    reached = test_db.query_node("person").return_this().follow("owns").follow_in("owns")
+    assert [count for node, count in _by_id(reached.group_by_origin().count())]==[20, 60]
+    assert [count for node, count in _by_id(reached.group_by_origin().count(distinct=True))]==[2, 2]
+
+def test_group_by_property():
+    counts = test_db.query_node("person").return_property("name").follow("owns").group_by_origin().count()
+    assert sorted(counts)==[("John McGregor", 10), ("Sir Richard Stiltington", 50)]
+
+def test_group_requires_origin():
+    with assert_raises(QueryStructureError):
+        test_db.query_node("person").follow("owns").group_by_origin()
+
+def test_aggregate():
+    things = test_db.query_node("person").follow("owns")
+    result = things.aggregate(sum="price", count="price", max="value")
+    assert result=={'sum': 12700.0, 'count': 60, 'max': 50.0}
+    assert test_db.query_node("thing").aggregate(mean="price")=={'mean': 245.0}
+    assert test_db.query_node("person").aggregate(sum="price")=={'sum': None}
+    with assert_raises(ValueError):
+        test_db.query_node("thing").aggregate(median="price")
+
+def test_aggregate_by_origin():
+    messages = test_db.query_node("person").return_this().edge("likes").group_by_origin().\
+        aggregate(sum="num_messages", mean="num_messages")
+    assert [(node.id, result) for node, result in _by_id(messages)]==[(1, {'sum': 13, 'mean': 6.5}),
+                                                                      (2, {'sum': 6, 'mean': 3.0})]
+
+def test_aggregate_types():
+    # the same for common table expressions and temp tables, and for integer and float properties
+    def check():
+        result = test_db.query_node("person").edge("likes").aggregate(
+            sum="num_messages", min="num_messages", max="num_messages", mean="num_messages", count="num_messages")
+        assert result=={'sum': 19, 'min': 1, 'max': 10, 'mean': 4.75, 'count': 4}
+        assert all(type(result[f]) is float for f in ("sum", "min", "max", "mean")) and type(result['count']) is int
+        grouped = test_db.query_node("person").return_this().edge("likes").group_by_origin().aggregate(
+            sum="num_messages", count="num_messages")
+        assert all(type(r['sum']) is float and type(r['count']) is int for node, r in grouped)
+        result = test_db.query_node("thing").aggregate(sum="price")
+        assert type(result['sum']) is float
+    testing.for_both_engines(test_db, check)
+
+def test_degree():
+    assert [(node.id, degree) for node, degree in _by_id(test_db.query_node("person").degree("owns"))]==[(1, 10),
+                                                                                                         (2, 50)]
+    things = _by_id(test_db.query_node("thing").degree("owns", "in"))
+    assert len(things)==50
+    assert [degree for node, degree in things[:11]]==[2]*10+[1]
+    assert all(degree==0 for node, degree in test_db.query_node("thing").degree("owns"))
+
+    # all categories; the edge from node 2 to itself is counted only once
+    degrees = dict((node.id, degree) for node, degree in test_db.query_node("person").degree(direction="any"))
+    assert degrees=={1: 10+3, 2: 50+3}
+    degrees = dict((node.id, degree) for node, degree in test_db.query_node("person").degree("likes", "in"))
+    assert degrees=={1: 1, 2: 2}
+    with assert_raises(ValueError):
+        test_db.query_node("person").degree("likes", "sideways")
+
+def test_degree_with_origin():
+    rows = test_db.query_node("person").return_property("name").follow("likes").degree("likes")
+    assert sorted((name.value, node.id, degree) for name, node, degree in rows)==\
+           [("John McGregor", 2, 2), ("John McGregor", 3, 0),
+            ("Sir Richard Stiltington", 1, 2), ("Sir Richard Stiltington", 2, 2)]
+
+def test_reuse_query():
+    owners = test_db.query_node("person").return_this().follow("owns")
+    grouped = owners.group_by_origin()
+    assert len(grouped.count())==2
+    assert len(grouped.aggregate(min="price"))==2
+    assert owners.count()==60
@@ -0,0 +1,172 @@
+import numpy as np
+import graff.testing as testing
+import graff.condition as c
+from graff import algorithms
+
+def setup():
+    global test_db
+    test_db = testing.get_test_connection()
+    test_db.add_nodes("person", 8)
+    test_db.add_nodes("place", 1)
+    # a triangle 1, 2, 3 with a tail 3 -> 4 -> 5 (linked both ways, and 4 to itself); a pair 6 -> 7; 8 is isolated;
+    # the edge to 9 is ignored when only people are counted
+    test_db.add_edges("knows", [(1, 2), (2, 3), (3, 1), (3, 4), (4, 5), (5, 4), (4, 4), (6, 7), (1, 9)])
+
+def teardown():
+    test_db.close()
+
+def get_snapshot():
+    return test_db.snapshot("knows", node_category="person")
+
+def test_node_category():
+    snapshot = get_snapshot()
+    assert list(snapshot.node_ids)==list(range(1, 9))
+    assert list(test_db.snapshot("knows").node_ids)==list(range(1, 10))
+
+def test_connected_components():
+    labels = algorithms.connected_components(get_snapshot())
+    assert list(labels)==[-1, 1, 1, 1, 1, 1, 6, 6, 8, -1]
+    assert algorithms.connected_components(test_db.snapshot("knows"))[9]==1
+
+def test_core_numbers():
+    snapshot = get_snapshot()
+    assert list(algorithms.core_numbers(snapshot))==[-1, 2, 2, 2, 1, 1, 1, 1, 0, -1]
+    assert list(algorithms.k_core(snapshot, 2))==[1, 2, 3]
+    assert list(algorithms.k_core(snapshot, 3))==[]
+
+def test_triangles():
+    assert list(algorithms.triangles(get_snapshot()))==[0, 1, 1, 1, 0, 0, 0, 0, 0, 0]
+
+def test_triangles_in_batches():
+    # every pair of 12 nodes is linked, so each node is in 11*10/2 triangles
+    db = testing.get_test_connection()
+    db.add_nodes("person", 12)
+    db.add_edges("knows", [(a, b) for a in range(1, 13) for b in range(1, 13) if a<b])
+    original_batch_size = algorithms.config.snapshot_batch_size
+    algorithms.config.snapshot_batch_size = 7
+    try:
+        counts = algorithms.triangles(db.snapshot())
+    finally:
+        algorithms.config.snapshot_batch_size = original_batch_size
+    assert list(counts[1:])==[55]*12
+    db.close()
+
+def reference_pagerank(snapshot, damping, jump):
+    nodes = snapshot.node_ids
+    position = dict((node, i) for i, node in enumerate(nodes))
+    transitions = np.zeros((len(nodes), len(nodes)))
+    for node in nodes:
+        destinations = [d for d in snapshot.follow([node]) if d in position]
+        for destination in destinations:
+            transitions[position[destination], position[node]]+=1.0/len(destinations)
+        if len(destinations)==0:
+            transitions[:, position[node]] = jump[nodes]
+    google = damping*transitions + (1-damping)*np.outer(jump[nodes], np.ones(len(nodes)))
+    values, vectors = np.linalg.eig(google)
+    vector = np.real(vectors[:, np.argmax(np.real(values))])
+    result = np.zeros(snapshot.n_nodes)
+    result[nodes] = vector/vector.sum()
+    return result
+
+def test_pagerank():
+    snapshot = get_snapshot()
+    rank = algorithms.pagerank(snapshot)
+    assert abs(rank.sum()-1.0)<1e-9 and rank[0]==0 and rank[9]==0
+    jump = np.zeros(snapshot.n_nodes)
+    jump[snapshot.node_ids] = 1.0/len(snapshot.node_ids)
+    assert np.allclose(rank, reference_pagerank(snapshot, 0.85, jump), atol=1e-8)
+
+def test_personalised_pagerank():
+    snapshot = get_snapshot()
+    rank = algorithms.pagerank(snapshot, damping=0.5, sources=[6])
+    assert np.flatnonzero(rank).tolist()==[6, 7]
+    jump = np.zeros(snapshot.n_nodes)
+    jump[6] = 1.0
+    assert np.allclose(rank, reference_pagerank(snapshot, 0.5, jump), atol=1e-8)
+
+def test_weighted_pagerank():
+    db = testing.get_test_connection()
+    db.add_nodes("person", 3)
+    db.add_edges("knows", [(1, 2), (1, 3), (2, 1), (3, 1)], [{"weight": 3.0}, {"weight": 1.0}, {}, {"weight": 1.0}])
+    snapshot = db.snapshot(edge_properties=["weight"])
+    rank = algorithms.pagerank(snapshot, weights="weight")
+    # 2 has no usable outgoing edges, so its rank is spread evenly
+    assert rank[2]>rank[3]
+    assert np.allclose(rank, algorithms.pagerank(snapshot, weights=snapshot.edge_properties["weight"]))
+    assert not np.allclose(rank, algorithms.pagerank(snapshot))
+    db.close()
+
+def test_random_walks():
+    snapshot = get_snapshot()
+    walks = algorithms.random_walks(snapshot, [1, 6, 8, 1], 20, seed=1)
+    assert walks.shape==(4, 21)
+    assert list(walks[:, 0])==[1, 6, 8, 1]
+    assert set(walks[2])=={8}
+    assert set(walks[1])=={6, 7} # 7 is a dead end, so the walk jumps back to 6
+    for walk in walks:
+        for a, b in zip(walk[:-1], walk[1:]):
+            assert b in snapshot.follow([a]) or b==walk[0]
+    assert np.array_equal(walks, algorithms.random_walks(snapshot, [1, 6, 8, 1], 20, seed=1))
+
+    restarting = algorithms.random_walks(snapshot, [3]*50, 10, restart_probability=0.5, seed=2)
+    assert (restarting[:, 1:]==3).mean()>0.3
+
+def test_random_walks_stay_within_node_category():
+    snapshot = get_snapshot()
+    for direction in "out", "in", "any":
+        walks = algorithms.random_walks(snapshot, [1]*20, 30, direction=direction, seed=3)
+        assert snapshot.node_exists[walks].all() and 9 not in walks
+    assert 9 in algorithms.random_walks(test_db.snapshot("knows"), [1]*20, 30, seed=3)
+    for starts in [9], [0], [100]:
+        try:
+            algorithms.random_walks(snapshot, starts, 3)
+            assert False, "Expected a ValueError"
+        except ValueError:
+            pass
+
+def test_store_node_property():
+    db = testing.get_test_connection()
+    db.add_nodes("person", 5, [{"name": "n%d" % i, "component": 0} for i in range(5)])
+    db.add_edges("knows", [(1, 2), (3, 4)])
+    snapshot = db.snapshot()
+    labels = algorithms.connected_components(snapshot)
+    report = db.store_node_property("component", snapshot.node_ids, labels[snapshot.node_ids], chunk_size=2)
+    assert report.chunks==3 and report.rows==5 and report.property_rows==5
+    properties = db.get_properties([1, 2, 3, 4, 5])
+    assert [properties[i]["component"] for i in range(1, 6)]==[1, 1, 3, 3, 5]
+    assert properties[1]["name"]=="n0"
+    assert db.query_node("person").filter(c.Property("component") == 3).count()==2
+
+    db.store_node_property("rank", [2, 4, 5], np.array([0.5, np.nan, 0.25]))
+    db.store_node_property("rank", [5], [None])
+    properties = db.get_properties([1, 2, 3, 4, 5])
+    assert properties[2]["rank"]==0.5 and "rank" not in properties[4] and "rank" not in properties[5]
+    db.close()
+
+def test_store_node_property_length_mismatch():
+    db = testing.get_test_connection()
+    db.add_nodes("person", 5)
+    for ids, values in [(iter(range(1, 6)), iter(range(4))), (iter(range(1, 5)), iter(range(5))),
+                        ([1, 2, 3], [1, 2])]:
+        try:
+            db.store_node_property("number", ids, values, chunk_size=2)
+            assert False, "Expected a ValueError"
+        except ValueError:
+            pass
+    db.close()
+
+def test_without_edges():
+    db = testing.get_test_connection()
+    for snapshot in db.snapshot(), (db.add_nodes("person", 3) or db.snapshot()):
+        n = snapshot.n_nodes
+        exists = snapshot.node_exists
+        assert list(algorithms.connected_components(snapshot))==[i if exists[i] else -1 for i in range(n)]
+        assert list(algorithms.core_numbers(snapshot))==[0 if exists[i] else -1 for i in range(n)]
+        assert list(algorithms.k_core(snapshot, 1))==[]
+        assert list(algorithms.triangles(snapshot))==[0]*n
+        rank = algorithms.pagerank(snapshot)
+        assert np.allclose(rank, exists/max(1, exists.sum()))
+        walks = algorithms.random_walks(snapshot, snapshot.node_ids, 3, restart_probability=0.5, seed=1)
+        assert walks.shape==(len(snapshot.node_ids), 4)
+        assert all((walk==walk[0]).all() for walk in walks)
+    db.close()
@@ -0,0 +1,59 @@
+import os, shutil, tempfile, threading
+import graff, graff.testing as testing
+from graff import orm
+
+def setup():
+    global temp_dir, db_filename
+    temp_dir = tempfile.mkdtemp()
+    db_filename = os.path.join(temp_dir, "allocation.db")
+
+def teardown():
+    shutil.rmtree(temp_dir)
+
+def test_reserve_ranges():
+    test_db = testing.get_test_connection()
+    test_db.add_nodes("existing", 5) # allocation must start after rows that already exist
+    allocator = test_db.id_allocator
+    first = allocator.reserve(orm.Node, 10)
+    second = allocator.reserve(orm.Node, 3)
+    assert first==6
+    assert second==16
+    assert allocator.reserve(orm.Edge, 2)==1
+    test_db.add_node("after_reservation")
+    assert test_db.query_node("after_reservation").first().id==19
+    test_db.close()
+
+def test_concurrent_writers():
+    connections = [graff.Connection(db_filename) for i in range(4)]
+    errors = []
+
+    def write(worker, db):
+        try:
+            for repeat in range(5):
+                db.add_nodes("worker_node", 20, [{'worker': worker, 'index': i} for i in range(20)])
+                db.load_nodes("loaded_node", properties={'worker': [worker]*15, 'index': list(range(15))},
+                              chunk_size=4)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(worker, db)) for worker, db in enumerate(connections)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors==[]
+
+    db = connections[0]
+    for category, number in ("worker_node", 20), ("loaded_node", 15):
+        rows = db.query_node(category).return_this().return_property("worker", "index").all()
+        assert len(rows)==4*5*number
+        # properties must be attached to the nodes created by the same writer, in order
+        by_worker = {}
+        for node, worker, index in rows:
+            by_worker.setdefault(worker.value, []).append((node.id, index.value))
+        for worker, nodes in by_worker.items():
+            nodes.sort()
+            assert [index for node_id, index in nodes]==list(range(number))*5
+
+    for db in connections:
+        db.close()
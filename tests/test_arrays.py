@@ -0,0 +1,47 @@
+import numpy as np
+from nose.tools import assert_raises
+import graff, graff.testing as testing, graff.condition as c
+from graff import flexible_value
+
+def setup():
+    global test_db
+    test_db = testing.init_ownership_graph()
+    test_db.add_node("mixed", {"value": 1})
+    test_db.add_node("mixed", {"value": 2.5})
+    test_db.add_node("mixed", {"value": "three"})
+    test_db.add_node("mixed")
+
+def test_node_ids_to_array():
+    ids = test_db.query_node("thing").to_arrays()
+    assert ids.dtype==np.int64
+    assert (ids==[n.id for n in test_db.query_node("thing").all()]).all()
+
+def test_properties_to_arrays():
+    person_ids, price = test_db.query_node("person").return_this().follow("owns").return_property("price").to_arrays()
+    assert person_ids.dtype==np.int64
+    assert price.dtype==np.float64
+    assert len(price)==60
+    assert sorted(price)==sorted(test_db.query_node("person").follow("owns").return_property("price").all())
+
+def test_typed_property_arrays():
+    ids, values = test_db.query_node("mixed").return_this().return_property("value").to_arrays()
+    assert values.dtype==object
+    # rows are not necessarily returned in order of node ID, e.g. when the query is evaluated using temp tables
+    assert [values[i] for i in np.argsort(ids)]==[1, 2.5, "three", None]
+
+def test_flexible_values_to_array():
+    ints = flexible_value.flexible_values_to_array([1, 2], [None, None], [None, None])
+    assert ints.dtype==np.int64
+    floats = flexible_value.flexible_values_to_array([1, None, None], [None, 2.5, None], [None, None, None])
+    assert floats.dtype==np.float64
+    assert floats[0]==1.0 and floats[1]==2.5 and np.isnan(floats[2])
+    strs = flexible_value.flexible_values_to_array([None, None], [None, None], ["a", None])
+    assert list(strs)==["a", None]
+
+def test_empty_to_arrays():
+    values = test_db.query_node("thing").filter(c.Property("price") < 0).return_property("value").to_arrays()
+    assert len(values)==0
+
+def test_all_properties_to_arrays_fails():
+    with assert_raises(graff.query.base.QueryStructureError):
+        test_db.query_node("person").return_properties().to_arrays()
@@ -0,0 +1,82 @@
+import asyncio, os, shutil, tempfile
+from nose.tools import assert_raises
+import graff, graff.testing as testing
+
+def setup():
+    global temp_dir, test_db, loop
+    temp_dir = tempfile.mkdtemp()
+    test_db = graff.Connection(os.path.join(temp_dir, "async.db"), thread_safe=True)
+    test_db.add_nodes("person", 10, [{'age': i} for i in range(10)])
+    test_db.add_edges("likes", [(i+1, (i+1)%10+1) for i in range(10)])
+    test_db.release_session()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+def teardown():
+    test_db.close()
+    loop.close()
+    asyncio.set_event_loop(None)
+    shutil.rmtree(temp_dir)
+
+def _collect(iterator):
+    results = []
+    while True:
+        try:
+            results.append(loop.run_until_complete(iterator.__anext__()))
+        except StopAsyncIteration:
+            return results
+
+def test_query_async():
+    q = test_db.query_node("person").follow("likes").return_property("age")
+    results, count, first, exists = loop.run_until_complete(asyncio.gather(
+        q.all_async(), test_db.query_node("person").count_async(),
+        test_db.query_node("person").return_property("age").first_async(),
+        test_db.query_node("person").where_property("age", ">", 100).exists_async()))
+    assert sorted(r.value for r in results)==list(range(10))
+    assert count==10
+    assert first.value==0
+    assert not exists
+
+def test_async_results_outlive_session():
+    # the worker's session has been released, but the results can still be printed and converted to dicts
+    nodes, edges = loop.run_until_complete(asyncio.gather(
+        test_db.query_node("person").all_async(load_properties=True),
+        test_db.query_node("person").edge("likes").all_async()))
+    assert repr(nodes[0])=="<Node id=1 category='person'>"
+    assert "category='likes'" in repr(edges[0])
+    assert sorted(dict(node)['age'] for node in nodes)==list(range(10))
+    first = loop.run_until_complete(test_db.query_node("person").first_async(load_properties=True))
+    assert dict(first)=={'age': 0} and "person" in str([first])
+
+def test_concurrent_queries():
+    futures = [test_db.query_node("person").follow("likes", max_hops=hops).count_async(distinct=True)
+               for hops in range(1, 21)]
+    assert loop.run_until_complete(asyncio.gather(*futures))==[10]*20
+
+def test_async_iterator():
+    q = test_db.query_node("person").return_property("age")
+    assert [r.value for r in _collect(q.stream_async(batch_size=3))]==list(range(10))
+    assert len(_collect(test_db.query_node("person").follow("likes").__aiter__()))==10
+    assert _collect(test_db.query_node("person").where_property("age", ">", 100).stream_async())==[]
+
+def test_async_iterator_close():
+    iterator = test_db.query_node("person").stream_async(batch_size=2)
+    assert loop.run_until_complete(iterator.__anext__()).id==1
+    loop.run_until_complete(iterator.aclose())
+    with assert_raises(StopAsyncIteration):
+        loop.run_until_complete(iterator.__anext__())
+
+def test_add_async():
+    loop.run_until_complete(asyncio.gather(test_db.add_nodes_async("async_node", 5, [{'index': i} for i in range(5)]),
+                                           test_db.add_nodes_async("async_node", 3)))
+    loop.run_until_complete(test_db.add_edges_async("async_edge", [(1, 2), (2, 3)], [{'weight': 1}, {'weight': 2}]))
+    assert test_db.query_node("async_node").count()==8
+    assert sorted(w.value for w in test_db.query_node("person").edge("async_edge").return_property("weight").all())\
+           ==[1, 2]
+    test_db.release_session()
+
+def test_requires_thread_safe_connection():
+    db = testing.get_test_connection()
+    with assert_raises(ValueError):
+        db.query_node().all_async()
+    db.close()
@@ -0,0 +1,34 @@
+import json, os, shutil, tempfile
+from graff.benchmarks import graphs, suite
+
+def test_graph_generators():
+    for name, generator in graphs.graph_generators.items():
+        edges = list(generator(50, 1000))
+        assert len(edges)==1000
+        assert all(0<=a<50 and 0<=b<50 for a, b in edges)
+        assert edges==list(generator(50, 1000)) # reproducible for a given seed
+
+def test_power_law_has_hubs():
+    targets = [b for a, b in graphs.power_law_graph(100, 10000)]
+    assert targets.count(0) > 10*targets.count(99)
+
+def test_chunks():
+    assert list(graphs.chunks(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+def test_run_and_compare():
+    results = suite.run(sizes=[2], graph_types=["random"], backends=["sqlite_memory"], repeats=1)
+    stages = [r['stage'] for r in results['results']]
+    assert stages == ["add_nodes", "add_edges"] + [stage for stage, query in suite.query_stages]
+    counts = dict((r['stage'], r['rows']) for r in results['results'])
+    assert counts['count']==10
+    assert counts['follow']==100
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(temp_dir, "results.json")
+        suite.write_results(results, filename)
+        assert suite.read_results(filename) == json.loads(json.dumps(results))
+        comparison = suite.compare(suite.read_results(filename), results)
+    finally:
+        shutil.rmtree(temp_dir)
+    assert len(comparison)==len(results['results'])
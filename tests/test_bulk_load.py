@@ -0,0 +1,87 @@
+import numpy as np
+import graff.testing as testing
+import graff.condition as c
+from sqlalchemy import event
+
+def setup():
+    global test_db
+    test_db = testing.get_test_connection()
+
+def _count_commits(function):
+    commits = []
+    session = test_db.get_sqlalchemy_session()
+    def record_commit(session):
+        commits.append(True)
+    event.listen(session, "after_commit", record_commit)
+    try:
+        result = function()
+    finally:
+        event.remove(session, "after_commit", record_commit)
+    return result, len(commits)
+
+def test_load_nodes_from_generator():
+    reports = []
+    properties = ({'index': i, 'name': "node %d"%i} for i in range(25))
+    report, commits = _count_commits(lambda: test_db.load_nodes("generated", properties=properties, chunk_size=10,
+                                                                progress=reports.append))
+    assert report.rows==25
+    assert report.property_rows==50
+    assert report.chunks==3
+    assert commits==3
+    assert len(reports)==3
+    assert report.rows_per_second>0
+
+    results = test_db.query_node("generated").return_property("index", "name").all()
+    assert sorted((i.value, n.value) for i, n in results) == [(i, "node %d"%i) for i in range(25)]
+
+def test_load_nodes_from_arrays():
+    values = np.arange(20, dtype=np.int64)
+    weights = np.linspace(0.0, 1.0, 20)
+    report = test_db.load_nodes("columnar", 20, {'value': values, 'weight': weights}, chunk_size=7)
+    assert report.chunks==3
+    assert test_db.query_node("columnar").filter(c.Property("value") >= 10).count()==10
+    ids, loaded_values, loaded_weights = test_db.query_node("columnar").return_this().\
+        return_property("value", "weight").to_arrays()
+    order = np.argsort(ids)
+    assert (loaded_values[order]==values).all()
+    assert np.allclose(loaded_weights[order], weights)
+
+def test_load_nodes_without_properties():
+    report = test_db.load_nodes("bare", 15, chunk_size=4)
+    assert report.rows==15 and report.chunks==4 and report.property_rows==0
+    assert test_db.query_node("bare").count()==15
+
+def test_load_edges():
+    test_db.load_nodes("station", properties={'number': np.arange(10)})
+    ids = np.sort(test_db.query_node("station").to_arrays())
+
+    report = test_db.load_edges("track", ids[:-1], ids[1:], {'length': np.arange(9)*1.5}, chunk_size=4)
+    assert report.rows==9 and report.chunks==3
+
+    pairs = ((int(a), int(b)) for a, b in zip(ids[1:], ids[:-1]))
+    report = test_db.load_edges("reverse_track", pairs, chunk_size=5)
+    assert report.rows==9 and report.chunks==2
+
+    assert test_db.query_node("station").follow("track").follow("track").count()==8
+    assert test_db.query_node("station").follow("reverse_track").count()==9
+    lengths = test_db.query_node("station").edge("track").return_property("length").to_arrays()
+    assert sorted(lengths)==[i*1.5 for i in range(9)]
+
+def test_load_edges_property_mismatch():
+    test_db.load_nodes("mismatch", 3)
+    ids = test_db.query_node("mismatch").to_arrays()
+    try:
+        test_db.load_edges("mismatch_edge", ids, ids, [{'a': 1}])
+        assert False, "Expected a ValueError"
+    except ValueError:
+        pass
+
+def test_load_edges_length_mismatch():
+    test_db.load_nodes("uneven", 5)
+    ids = [int(i) for i in test_db.query_node("uneven").to_arrays()]
+    for node_from, node_to in [(iter(ids), iter(ids[:3])), (iter(ids[:3]), iter(ids)), (ids, ids[:3])]:
+        try:
+            test_db.load_edges("uneven_edge", node_from, node_to, chunk_size=2)
+            assert False, "Expected a ValueError"
+        except ValueError:
+            pass
@@ -0,0 +1,44 @@
+import os, shutil, tempfile
+from sqlalchemy import inspect
+import graff.testing as testing
+
+def setup():
+    global temp_dir, test_db
+    temp_dir = tempfile.mkdtemp()
+    test_db = testing.get_test_connection(os.path.join(temp_dir, "bulk.db"))
+
+def teardown():
+    test_db.close()
+    shutil.rmtree(temp_dir)
+
+def _index_names(table_name):
+    return set(index['name'] for index in inspect(test_db.get_sqlalchemy_session().connection()).get_indexes(table_name))
+
+def _pragma(name):
+    return test_db.get_sqlalchemy_session().execute("PRAGMA %s"%name).scalar()
+
+def test_bulk_load_mode():
+    assert _pragma("synchronous")==2
+    with test_db.bulk_load_mode():
+        assert _pragma("synchronous")==0
+        assert _pragma("journal_mode")=="memory"
+        assert len(_index_names("edges"))==0
+        assert len(_index_names("nodeproperties"))==0
+        test_db.load_nodes("person", properties=({'age': i} for i in range(100)), chunk_size=30)
+        test_db.load_edges("likes", [(i, i%100+1) for i in range(1, 101)], chunk_size=30)
+
+    assert _pragma("synchronous")==2
+    assert _pragma("journal_mode")=="delete"
+    assert "edges_node_from_category_index" in _index_names("edges")
+    assert test_db.ensure_indexes()==[]
+    assert test_db.query_node("person").follow("likes").follow("likes").count()==100
+
+def test_bulk_load_mode_exception():
+    try:
+        with test_db.bulk_load_mode():
+            test_db.add_node("aborted")
+            raise RuntimeError()
+    except RuntimeError:
+        pass
+    assert test_db.ensure_indexes()==[]
+    assert _pragma("synchronous")==2
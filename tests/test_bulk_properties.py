@@ -0,0 +1,77 @@
+import graff.testing as testing
+
+def setup():
+    global test_db
+    test_db = testing.init_ownership_graph()
+    test_db.add_edges("likes", [(1, 3), (2, 4), (2, 5)], [{"strength": 1.0}, {"strength": 2.0}, {"strength": 0.5}])
+
+def teardown():
+    test_db.close()
+
+def test_repr_without_category_queries():
+    things = test_db.query_node("thing").all()
+    edges = test_db.query_edge("owns").all()
+    assert testing.count_statements(test_db, lambda: [repr(x) for x in things+edges])==0
+    assert repr(things[0])=="<Node id=%d category='thing'>"%things[0].id
+
+def test_load_properties():
+    things = test_db.query_node("thing").all(load_properties=True)
+    assert testing.count_statements(test_db, lambda: [dict(x) for x in things])==0
+    assert all(set(dict(x).keys())=={'price', 'value'} for x in things)
+
+    people = test_db.query_node("person").follow("owns").return_this().return_property("price").all(load_properties=True)
+    assert testing.count_statements(test_db, lambda: [dict(node) for node, price in people])==0
+    assert all(dict(node)['price']==price for node, price in people)
+
+    edges = test_db.query_edge("likes").all(load_properties=True)
+    assert testing.count_statements(test_db, lambda: [dict(x) for x in edges])==0
+    assert sorted(dict(x)['strength'] for x in edges)==[0.5, 1.0, 2.0]
+
+    first = test_db.query_node("person").first(load_properties=True)
+    assert testing.count_statements(test_db, lambda: dict(first))==0
+    assert dict(first)['name']=="John McGregor"
+
+def test_stream_load_properties():
+    test_db.get_sqlalchemy_session().expire_all()
+    without_properties = testing.count_statements(test_db, lambda: list(test_db.query_node("thing").stream(batch_size=20)))
+    test_db.get_sqlalchemy_session().expire_all()
+    with testing.recorded_statements(test_db) as statements:
+        things = list(test_db.query_node("thing").stream(batch_size=20, load_properties=True))
+    assert len(things)==50
+    assert len(statements)==without_properties+3 # one query for the properties of each batch
+    assert testing.count_statements(test_db, lambda: [dict(x) for x in things])==0
+
+def test_lazy_properties_unchanged():
+    test_db.get_sqlalchemy_session().expire_all() # discard properties loaded by earlier tests
+    things = test_db.query_node("thing").all()
+    assert testing.count_statements(test_db, lambda: [dict(x) for x in things])==50
+
+def test_get_properties():
+    people = test_db.query_node("person").all()
+    ids = [p.id for p in people]
+    with testing.recorded_statements(test_db) as statements:
+        properties = test_db.get_properties(ids+[1000])
+    assert len(statements)==1
+    assert properties[1000]=={}
+    assert sorted(p['name'] for i, p in properties.items() if i!=1000)==["John McGregor", "Sir Richard Stiltington"]
+    assert properties[ids[0]]==dict(people[0])
+    assert isinstance(properties[ids[0]]['name'], str)
+
+def test_get_properties_in_batches():
+    import graff.config
+    old_batch_size = graff.config.in_clause_batch_size
+    graff.config.in_clause_batch_size = 20
+    try:
+        ids = [x.id for x in test_db.query_node("thing").all()]
+        with testing.recorded_statements(test_db) as statements:
+            properties = test_db.get_properties(ids)
+        assert len(statements)==3
+    finally:
+        graff.config.in_clause_batch_size = old_batch_size
+    assert len(properties)==50
+    assert all(isinstance(p['price'], float) for p in properties.values())
+
+def test_get_edge_properties():
+    edges = test_db.query_edge("likes").all(load_properties=True)
+    properties = test_db.get_edge_properties([e.id for e in edges])
+    assert all(properties[e.id]==dict(e) for e in edges)
@@ -0,0 +1,97 @@
+import os, shutil, tempfile, threading
+from nose.tools import assert_raises
+from sqlalchemy import event
+import graff, graff.testing as testing
+
+def setup():
+    global temp_dir, db_filename
+    temp_dir = tempfile.mkdtemp()
+    db_filename = os.path.join(temp_dir, "category.db")
+
+def teardown():
+    shutil.rmtree(temp_dir)
+
+def test_lookups():
+    db = testing.get_test_connection()
+    db.add_node("person", {"name": "Alice", "age": 30})
+    cache = db.category_cache
+    person, name = cache.get_ids(["person", "name"])
+    assert cache.get_id("person")==person
+    assert cache.get_name(person)=="person"
+    assert cache.get_names([name, person])==["name", "person"]
+    assert cache.get_ids(["age", "nonexistent"], None)[1] is None
+    assert cache.get_name(1000, "unknown")=="unknown"
+    with assert_raises(KeyError):
+        cache.get_id("nonexistent")
+    with assert_raises(KeyError):
+        cache.get_name(1000)
+    db.close()
+
+def test_batch_creation():
+    db = testing.get_test_connection()
+    cache = db.category_cache
+    cache.get_id("x", None) # load the cache
+
+    statements = []
+    def before_execute(conn, clauseelement, multiparams, params):
+        statements.append(clauseelement)
+    engine = db.get_sqlalchemy_session().get_bind()
+    event.listen(engine, "before_execute", before_execute)
+    try:
+        ids = cache.get_existing_or_new_ids(["a", "b", "c", "a"])
+        n_statements = len(statements)
+        assert cache.get_existing_or_new_ids(["c", "b"])==[ids[2], ids[1]]
+        assert len(statements)==n_statements # already cached
+    finally:
+        event.remove(engine, "before_execute", before_execute)
+
+    assert n_statements<=3 # look up the missing names, insert them, and retrieve their IDs
+    assert ids[0]==ids[3] and len(set(ids))==3
+    assert cache.get_names(ids[:3])==["a", "b", "c"]
+    db.close()
+
+def test_categories_from_another_connection():
+    db_query = graff.Connection(db_filename)
+    db_query.add_node("person")
+    assert db_query.query_node("person").count()==1
+
+    db_load = graff.Connection(db_filename)
+    db_load.add_nodes("animal", 3, [{"legs": 4}]*3)
+    db_load.add_edges("owns", [(1, 2)])
+
+    # the categories were created after db_query loaded its cache
+    assert db_query.query_node("animal").return_property("legs").count()==3
+    assert db_query.query_node("person").follow("owns").count()==1
+    assert db_query.category_cache.get_name(db_load.category_cache.get_id("legs"))=="legs"
+
+    db_query.close()
+    db_load.close()
+
+def test_concurrent_creation():
+    connections = [graff.Connection(db_filename) for i in range(4)]
+    for db in connections:
+        db.category_cache.refresh()
+        db.get_sqlalchemy_session().commit() # so that each thread checks out its own sqlite connection
+    names = ["concurrent_%d" % i for i in range(20)]
+    results = []
+    errors = []
+
+    def create(db):
+        try:
+            results.append(db.category_cache.get_existing_or_new_ids(names))
+            db.get_sqlalchemy_session().commit()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=create, args=(db,)) for db in connections]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors==[]
+    assert len(results)==4
+    assert all(r==results[0] for r in results)
+    assert len(set(results[0]))==20
+
+    for db in connections:
+        db.close()
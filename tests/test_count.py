@@ -0,0 +1,54 @@
+import graff.condition as c, graff.testing as testing
+
+def setup():
+    global test_db
+    test_db = testing.init_friends_network(n_people=100, n_connections=500)
+
+def _query_factories():
+    return [
+        lambda: test_db.query_node("person"),
+        lambda: test_db.query_node("person").follow("likes").follow("likes"),
+        lambda: test_db.query_node("person").return_this().follow("likes").return_property("name"),
+        lambda: test_db.query_node("person").edge("likes").filter(c.Property("num_messages") > 50).node(),
+        lambda: test_db.query_node("person").follow("likes").filter(c.Property("age") < 30),
+        lambda: test_db.query_node("person").return_properties().follow("likes"),
+    ]
+
+def test_count():
+    def check():
+        for factory in _query_factories():
+            assert factory().count()==len(factory().all())
+    testing.for_both_engines(test_db, check)
+
+def test_count_distinct():
+    def check():
+        for factory in _query_factories()[:2]:
+            assert factory().count(distinct=True)==len(set(n.id for n in factory().all()))
+        assert test_db.query_node("person").follow("likes").follow("likes").count(distinct=True)<\
+               test_db.query_node("person").follow("likes").follow("likes").count()
+    testing.for_both_engines(test_db, check)
+
+def test_exists():
+    def check():
+        assert test_db.query_node("person").follow("likes").exists()
+        assert not test_db.query_node("person").filter(c.Property("age") > 100).exists()
+    testing.for_both_engines(test_db, check)
+
+def test_first():
+    def check():
+        for factory in _query_factories()[:3]:
+            assert factory().first() in factory().all()
+        assert test_db.query_node("person").filter(c.Property("age") > 100).first() is None
+    testing.for_both_engines(test_db, check)
+
+def test_count_does_not_create_final_table():
+    test_db.use_cte = False
+    try:
+        with testing.recorded_statements(test_db) as statements:
+            test_db.query_node("person").follow("likes").follow("likes").count()
+    finally:
+        test_db.use_cte = True
+
+    creations = [s for s in statements if s.strip().startswith("CREATE TEMPORARY TABLE")]
+    assert len(creations)==2
+    assert any("count(*)" in s for s in statements)
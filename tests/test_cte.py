@@ -0,0 +1,74 @@
+import graff.condition as c, graff.testing as testing
+from graff import orm, flexible_value
+
+def setup():
+    global test_db
+    test_db = testing.init_ownership_graph()
+
+def _comparable(result):
+    # row order is not guaranteed to be the same between the two engines, so compare sorted representations
+    if isinstance(result, (tuple, list)):
+        return tuple(_comparable(r) for r in result)
+    elif isinstance(result, dict):
+        return tuple(sorted(result.items()))
+    elif isinstance(result, (orm.Node, orm.Edge)):
+        return type(result).__name__, result.id
+    elif isinstance(result, flexible_value.FlexibleValue):
+        return result.value
+    else:
+        return result
+
+def _results_with_and_without_cte(query_factory):
+    test_db.use_cte = True
+    try:
+        with_cte = query_factory().all()
+    finally:
+        test_db.use_cte = False
+    try:
+        without_cte = query_factory().all()
+    finally:
+        test_db.use_cte = True
+    return sorted(map(_comparable, with_cte)), sorted(map(_comparable, without_cte))
+
+def test_cte_matches_temp_tables():
+    query_factories = [
+        lambda: test_db.query_node("person").follow("owns").return_property("price"),
+        lambda: test_db.query_node("person").return_this().edge("owns").node().return_property("value"),
+        lambda: test_db.query_node("person").return_properties().follow("owns"),
+        lambda: test_db.query_node("thing").filter(c.Property("value") > 25.0).return_property("price"),
+    ]
+    for factory in query_factories:
+        with_cte, without_cte = _results_with_and_without_cte(factory)
+        assert len(with_cte)>0
+        assert with_cte == without_cte
+
+def test_cte_backreference_in_filter():
+    def factory():
+        q1 = test_db.query_node("person").return_property("net_worth")
+        q2 = q1.follow("owns").return_property("price")
+        return q2.filter(q1['net_worth'] > 100 * q2["price"])
+
+    with_cte, without_cte = _results_with_and_without_cte(factory)
+    assert len(with_cte)==11
+    assert with_cte == without_cte
+
+def test_cte_single_statement():
+    test_db.use_cte = True
+    with testing.recorded_statements(test_db) as statements:
+        assert test_db.query_node("person").follow("owns").follow("owns").count()==0
+    assert len(statements)==1
+    assert statements[0].startswith("WITH")
+    assert "count(*)" in statements[0]
+
+def test_temp_table_filters_applied_on_insert():
+    test_db.use_cte = False
+    try:
+        with testing.recorded_statements(test_db) as statements:
+            results = test_db.query_node("person").follow("owns").filter(c.Property("value") > 25.0).all()
+        assert len(results)==35
+    finally:
+        test_db.use_cte = True
+
+    # filtered rows should never be written, so there is no need to delete them afterwards
+    assert not any(s.startswith("DELETE") for s in statements)
+    assert sum(s.startswith("INSERT") for s in statements)==3
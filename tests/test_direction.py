@@ -0,0 +1,39 @@
+import graff.testing as testing
+
+def setup():
+    import test_basic_query
+    test_basic_query.setup()
+    global test_db, ts_node, ts2_node, halo_node, halo2_node, sim_node
+    test_db = test_basic_query.test_db
+    ts_node, ts2_node = test_basic_query.ts_node, test_basic_query.ts2_node
+    halo_node, halo2_node = test_basic_query.halo_node, test_basic_query.halo2_node
+    sim_node = test_basic_query.sim_node
+
+def test_follow_in():
+    def check():
+        assert test_db.query_node("halo").follow_in("has_halo").all() == [ts_node, ts2_node]
+        assert test_db.query_node("halo").follow_in("has_halo").follow_in("has_timestep").all() == [sim_node, sim_node]
+        assert testing.ids(test_db.query_node("halo").follow_in().all()) == testing.ids([ts_node, ts2_node, halo_node])
+    testing.for_both_engines(test_db, check)
+
+def test_follow_any():
+    def check():
+        assert testing.ids(test_db.query_node("halo").follow_any("is_successor").all()) == \
+               testing.ids([halo_node, halo2_node])
+        assert testing.ids(test_db.query_node("timestep").follow_any().all()) == \
+               testing.ids([sim_node, sim_node, halo_node, halo2_node])
+        assert test_db.query_node("timestep").follow_any().count() == 4
+    testing.for_both_engines(test_db, check)
+
+def test_edge_in():
+    def check():
+        edges = test_db.query_node("halo").edge_in("has_halo").all()
+        assert [e.node_to_id for e in edges] == [halo_node.id, halo2_node.id]
+        assert test_db.query_node("halo").edge_in("has_halo").source_node().all() == [ts_node, ts2_node]
+        assert test_db.query_node("halo").edge_in("has_halo").node().all() == [halo_node, halo2_node]
+    testing.for_both_engines(test_db, check)
+
+def test_source_node():
+    def check():
+        assert test_db.query_edge("has_halo").source_node().all() == [ts_node, ts2_node]
+    testing.for_both_engines(test_db, check)
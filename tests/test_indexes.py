@@ -0,0 +1,28 @@
+from sqlalchemy import inspect
+import graff.testing as testing
+from graff import orm
+from graff.benchmarks import indexes
+
+def setup():
+    global test_db
+    test_db = testing.init_ownership_graph()
+
+def _index_names(table_name):
+    return set(index['name'] for index in inspect(test_db.get_sqlalchemy_session().connection()).get_indexes(table_name))
+
+def test_ensure_indexes():
+    indexes.use_legacy_indexes(test_db)
+    assert "edges_node_from_index" in _index_names("edges")
+    assert "nodeproperties_node_category_index" not in _index_names("nodeproperties")
+
+    created = test_db.ensure_indexes()
+    assert "nodeproperties_node_category_index" in created
+    assert "nodes_category_index" in created
+
+    for table in orm.Base.metadata.sorted_tables:
+        assert set(index.name for index in table.indexes).issubset(_index_names(table.name))
+    assert "edges_node_from_index" not in _index_names("edges")
+    assert "nodeproperties_node_index" not in _index_names("nodeproperties")
+
+    assert test_db.ensure_indexes()==[]
+    assert test_db.query_node("person").follow("owns").count()==60
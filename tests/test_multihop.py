@@ -0,0 +1,45 @@
+from nose.tools import assert_raises
+import graff.testing as testing
+
+def setup():
+    global test_db
+    test_db = testing.init_friends_network(n_people=200, n_connections=400)
+
+def test_multihop_matches_chained_follow():
+    def check():
+        multihop = test_db.query_node("person").follow("likes", min_hops=2, max_hops=3, distinct=False).all()
+        two_hops = test_db.query_node("person").follow("likes").follow("likes").all()
+        three_hops = test_db.query_node("person").follow("likes").follow("likes").follow("likes").all()
+        assert testing.ids(multihop) == testing.ids(two_hops+three_hops)
+    testing.for_both_engines(test_db, check)
+
+def test_multihop_distinct():
+    def check():
+        reached = test_db.query_node("person").follow("likes", max_hops=2).all()
+        one_hop = test_db.query_node("person").follow("likes").all()
+        two_hops = test_db.query_node("person").follow("likes").follow("likes").all()
+        assert testing.ids(reached) == sorted(set(testing.ids(one_hop+two_hops)))
+        assert test_db.query_node("person").follow("likes", max_hops=2).count() == len(reached)
+    testing.for_both_engines(test_db, check)
+
+def test_multihop_with_carried_columns():
+    def check():
+        results = test_db.query_node("person").return_this().follow("likes", min_hops=0, max_hops=2).all()
+        by_source = {}
+        for source, target in results:
+            by_source.setdefault(source.id, []).append(target.id)
+        for source_id, targets in by_source.items():
+            assert source_id in targets
+            assert len(targets)==len(set(targets))
+
+        neighbourhood_of_first = test_db.query_node("person").return_this().follow("likes").follow("likes").all()
+        expected = set([1])
+        expected.update(target.id for source, target in neighbourhood_of_first if source.id==1)
+        expected.update(target.id for source, target in
+                        test_db.query_node("person").return_this().follow("likes").all() if source.id==1)
+        assert set(by_source[1])==expected
+    testing.for_both_engines(test_db, check)
+
+def test_multihop_invalid_hops():
+    with assert_raises(ValueError):
+        test_db.query_node("person").follow("likes", min_hops=3, max_hops=2)
@@ -0,0 +1,67 @@
+import os, shutil, tempfile
+import numpy as np
+import graff, graff.testing as testing
+from graff import parallel_load
+
+def setup():
+    global temp_dir
+    temp_dir = tempfile.mkdtemp()
+
+def teardown():
+    shutil.rmtree(temp_dir)
+
+def _check_parallel_load(test_db):
+    report = parallel_load.load_nodes(test_db, "person", properties={'age': np.arange(100), 'name':
+                                                                     ["person %d"%i for i in range(100)]},
+                                      chunk_size=15, n_workers=2)
+    assert report.rows==100 and report.property_rows==200 and report.chunks==7
+
+    ids, ages, names = test_db.query_node("person").return_this().return_property("age", "name").to_arrays()
+    assert sorted(ages)==list(range(100))
+    assert all(name=="person %d"%age for age, name in zip(ages, names))
+
+    order = np.argsort(ages)
+    ids = ids[order]
+    pairs = ((int(ids[i]), int(ids[(i+1)%100])) for i in range(100))
+    properties = ({'strength': float(i)} for i in range(100))
+    report = parallel_load.load_edges(test_db, "likes", pairs, properties=properties, chunk_size=30, n_workers=2)
+    assert report.rows==100 and report.chunks==4
+
+    results = test_db.query_node("person").return_property("age").edge("likes").return_property("strength").\
+        node().return_property("age").all()
+    assert len(results)==100
+    assert all(b.value==(a.value+1)%100 and strength.value==float(a.value) for a, strength, b in results)
+
+    # indexes dropped during the load should have been rebuilt
+    assert test_db.ensure_indexes()==[]
+
+def test_parallel_load_sqlite_file():
+    test_db = testing.get_test_connection(os.path.join(temp_dir, "parallel.db"))
+    _check_parallel_load(test_db)
+    test_db.close()
+
+def test_parallel_load_sqlite_memory():
+    test_db = graff.Connection()
+    _check_parallel_load(test_db)
+    test_db.close()
+
+def test_parallel_load_test_database():
+    if os.environ.get('GRAFF_TEST_DATABASE_URI'):
+        test_db = testing.get_test_connection()
+        _check_parallel_load(test_db)
+        test_db.close()
+
+def test_worker_engine_kwargs():
+    # workers on database servers connect with the same engine arguments as the connection
+    db_uri = "sqlite:///" + os.path.join(temp_dir, "worker.db")
+    test_db = graff.Connection(db_uri, sqlalchemy_engine_kwargs={'echo': True})
+    assert test_db._engine_kwargs=={'echo': True}
+    category_id = test_db.category_cache.get_existing_or_new_id("person")
+    first_id = test_db.id_allocator.reserve(graff.orm.Node, 3)
+    test_db.get_sqlalchemy_session().commit()
+    assert parallel_load._process_chunk(db_uri, test_db._engine_kwargs, 'node', first_id, category_id, 3, None, {})\
+           ==(3, 0)
+    assert parallel_load._get_worker_engine(db_uri, {'echo': True}).echo
+    assert not parallel_load._get_worker_engine(db_uri, {}).echo
+    assert test_db.query_node("person").count()==3
+    test_db.close()
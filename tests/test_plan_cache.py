@@ -0,0 +1,83 @@
+import graff.condition as c, graff.testing as testing
+from sqlalchemy import event
+
+def setup():
+    global test_db
+    test_db = testing.init_friends_network(n_people=200, n_connections=500)
+    test_db.use_cte = True
+
+def teardown():
+    test_db.close()
+
+def _counts():
+    return test_db.plan_cache_hits, test_db.plan_cache_misses
+
+def _uncached(query_function):
+    plan_cache = test_db.plan_cache
+    test_db.plan_cache = type(plan_cache)(0)
+    try:
+        return query_function()
+    finally:
+        test_db.plan_cache = plan_cache
+
+def _older_friend_ages(min_age):
+    return test_db.query_node("person").filter(c.Property("age") > min_age).follow("likes").return_property("age")
+
+def test_same_shape_reuses_plan():
+    for min_age in 30, 45, 55.5, 20:
+        hits, misses = _counts()
+        results = sorted(v.value for v in _older_friend_ages(min_age).all())
+        assert results == sorted(v.value for v in _uncached(lambda: _older_friend_ages(min_age).all()))
+        assert len(results)>0
+        if min_age in (30, 55.5):
+            # first query of this shape (a float literal gives a different shape to an integer)
+            assert _counts() == (hits, misses+1)
+        else:
+            assert _counts() == (hits+1, misses)
+
+def test_no_sql_compiled_on_hit():
+    test_db.query_node("person").where_property("age", ">", 40).count()
+    statements = []
+    def before_execute(conn, clauseelement, multiparams, params):
+        statements.append(clauseelement)
+    engine = test_db.get_sqlalchemy_session().get_bind()
+    event.listen(engine, "before_execute", before_execute)
+    try:
+        count = test_db.query_node("person").where_property("age", ">", 50).count()
+        test_db.query_node("person").where_property("age", ">", 52).count()
+    finally:
+        event.remove(engine, "before_execute", before_execute)
+    assert count == len(_uncached(lambda: test_db.query_node("person").where_property("age", ">", 50).all()))
+    # both queries execute the very same statement object, whose compiled form is cached
+    assert len(statements)==2
+    assert statements[0] is statements[1]
+
+def test_terminal_operations():
+    for min_age in 25, 35:
+        q = lambda: test_db.query_node("person").where_property("age", ">=", min_age).follow("likes")
+        expected = _uncached(lambda: q().all())
+        assert q().count() == len(expected)
+        assert q().count(distinct=True) == len(set(n.id for n in expected))
+        assert q().exists()
+        assert q().first().id == expected[0].id
+        assert [n.id for n in q().all()] == [n.id for n in expected]
+    assert not test_db.query_node("person").where_property("age", ">", 100).exists()
+    assert test_db.query_node("person").where_property("age", ">", 100).first() is None
+
+def test_different_shapes_not_shared():
+    hits, misses = _counts()
+    test_db.query_node("person").follow("likes").count()
+    test_db.query_node("person").follow_in("likes").count()
+    test_db.query_node("person").follow("likes", max_hops=2).count()
+    test_db.query_node("person").return_property("name").count()
+    test_db.query_node("person").return_property("age").count()
+    assert _counts() == (hits, misses+5)
+
+def test_not_cached_with_temp_tables():
+    test_db.use_cte = False
+    try:
+        before = _counts()
+        _older_friend_ages(30).all()
+        assert _counts() == before
+    finally:
+        test_db.use_cte = True
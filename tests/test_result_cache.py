@@ -0,0 +1,98 @@
+import time
+import graff.condition as c, graff.testing as testing
+from sqlalchemy.orm import object_session
+
+def setup():
+    global test_db
+    test_db = testing.init_ownership_graph()
+    test_db.enable_result_cache()
+
+def teardown():
+    test_db.close()
+
+def _expensive_things(min_price):
+    return test_db.query_node("person").follow("owns").filter(c.Property("price")>min_price).return_property("price")
+
+def test_repeated_reads_skip_sql():
+    test_db.clear_result_cache()
+    for operation in (lambda q: q.all(), lambda q: q.count(), lambda q: q.first(), lambda q: q.exists()):
+        assert testing.count_statements(test_db, lambda: operation(_expensive_things(300)))>0
+        assert testing.count_statements(test_db, lambda: operation(_expensive_things(300)))==0
+    # different literal values are cached separately
+    assert len(_expensive_things(300).all())==19
+    assert len(_expensive_things(400).all())==9
+    assert testing.count_statements(test_db, lambda: _expensive_things(400).all())==0
+
+def test_results_are_copied():
+    results = test_db.query_node("thing").all()
+    results.append(None)
+    assert len(test_db.query_node("thing").all())==50
+
+def test_cached_instances_belong_to_caller():
+    test_db.clear_result_cache()
+    session = test_db.get_sqlalchemy_session()
+    things = test_db.query_node("thing").all(load_properties=True)
+    session.expunge_all() # as when the results are used by another thread, with its own session
+    things[0].category_id = -1
+    assert testing.count_statements(test_db, lambda: test_db.query_node("thing").all(load_properties=True))==0
+    cached = test_db.query_node("thing").all(load_properties=True)
+    assert all(object_session(thing) is session for thing in cached)
+    assert cached[0] is not things[0] and cached[0].category_id!=-1
+    assert [dict(thing) for thing in cached]==[dict(thing) for thing in things]
+    assert test_db.query_node("thing").all(load_properties=True)[0] is cached[0]
+
+def test_invalidation_by_category():
+    test_db.clear_result_cache()
+    assert test_db.query_node("thing").count()==50
+    assert test_db.query_node("person").count()==2
+    assert len(_expensive_things(300).all())==19
+
+    test_db.add_node("thing")
+    assert testing.count_statements(test_db, lambda: test_db.query_node("person").count())==0
+    assert test_db.query_node("thing").count()==51
+    # following edges from people reaches things, but only via edges, which have not changed
+    assert testing.count_statements(test_db, lambda: _expensive_things(300).all())==0
+
+    new_thing = test_db.add_node("thing", {"price": 1000.0})
+    assert len(_expensive_things(300).all())==19
+    test_db.add_edge("owns", 1, new_thing)
+    assert len(_expensive_things(300).all())==20
+    assert testing.count_statements(test_db, lambda: test_db.query_node("person").count())==0
+
+def test_invalidation_by_property():
+    test_db.clear_result_cache()
+    assert test_db.query_node("person").where_property("net_worth", ">", 5000).count()==1
+    test_db.add_nodes("person", 2, [{"net_worth": 7000.0}, {"name": "Nobody"}])
+    assert test_db.query_node("person").where_property("net_worth", ">", 5000).count()==2
+    assert testing.count_statements(test_db, lambda: test_db.query_node("person").where_property("net_worth", ">", 5000).count())==0
+    test_db.add_edges("knows", [(1, 2)], [{"net_worth": 0.0}]) # unrelated edge category, but same property
+    assert testing.count_statements(test_db, lambda: test_db.query_node("person").where_property("net_worth", ">", 5000).count())>0
+
+def test_bulk_load_clears_cache():
+    test_db.load_nodes("bulk", 5)
+    assert test_db.query_node("bulk").count()==5
+    test_db.load_nodes("bulk", 3)
+    assert test_db.query_node("bulk").count()==8
+
+def test_size_and_ttl():
+    test_db.enable_result_cache(max_size=2, ttl=0.2)
+    try:
+        test_db.query_node("thing").count()
+        test_db.query_node("person").count()
+        test_db.query_node("thing").all()
+        assert len(test_db.result_cache)==2
+        # the least recently used result has been discarded
+        assert testing.count_statements(test_db, lambda: test_db.query_node("thing").count())>0
+        assert testing.count_statements(test_db, lambda: test_db.query_node("thing").count())==0
+        time.sleep(0.3)
+        assert testing.count_statements(test_db, lambda: test_db.query_node("thing").count())>0
+    finally:
+        test_db.enable_result_cache()
+
+def test_disable():
+    test_db.disable_result_cache()
+    try:
+        test_db.query_node("thing").count()
+        assert testing.count_statements(test_db, lambda: test_db.query_node("thing").count())>0
+    finally:
+        test_db.enable_result_cache()
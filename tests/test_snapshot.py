@@ -0,0 +1,181 @@
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from nose.tools import assert_raises
+import graff.testing as testing
+from graff import config
+from graff.snapshot import Snapshot
+
+def setup():
+    global test_db
+    test_db = testing.get_test_connection()
+    test_db.add_nodes("place", 6, [{"height": float(i)} for i in range(5)] + [{"height": "unknown"}])
+    test_db.add_edges("road", [(1, 2), (1, 3), (2, 3), (3, 1), (4, 4)], [{"length": 1.0}, {"length": 2.0}, {}, {}, {}])
+    test_db.add_edges("ferry", [(3, 5)])
+
+def teardown():
+    test_db.close()
+
+def test_structure():
+    snapshot = test_db.snapshot("road")
+    assert snapshot.n_nodes==7 # indexed by node ID, from zero
+    assert snapshot.n_edges==5
+    assert list(snapshot.indptr)==[0, 0, 2, 3, 4, 5, 5, 5]
+    assert sorted(snapshot.destinations[0:2])==[2, 3]
+    assert set(snapshot.edge_ids)=={1, 2, 3, 4, 5}
+    assert set(snapshot.edge_category_ids)=={test_db.category_cache.get_id("road")}
+    assert list(snapshot.node_category_ids)==[-1]+[test_db.category_cache.get_id("place")]*6
+
+def test_degree():
+    snapshot = test_db.snapshot("road")
+    assert list(snapshot.degree())==[0, 2, 1, 1, 1, 0, 0]
+    assert list(snapshot.degree(direction="in"))==[0, 1, 1, 2, 1, 0, 0]
+    assert list(snapshot.degree([4, 1], direction="any"))==[1, 3]
+    assert list(test_db.snapshot().degree([3]))==[2]
+    with assert_raises(ValueError):
+        snapshot.degree(direction="sideways")
+
+def test_neighbors_and_follow():
+    snapshot = test_db.snapshot("road")
+    offsets, neighbours = snapshot.neighbors([1, 5, 3])
+    assert list(offsets)==[0, 2, 2, 3]
+    assert sorted(neighbours[0:2])==[2, 3] and list(neighbours[2:3])==[1]
+
+    assert sorted(snapshot.follow([1, 2]))==[2, 3, 3]
+    assert list(snapshot.follow([1, 2], distinct=True))==[2, 3]
+    assert sorted(snapshot.follow([3], direction="in"))==[1, 2]
+    assert sorted(snapshot.follow([3, 4], direction="any"))==[1, 1, 2, 4]
+
+    origins, destinations, positions = snapshot.follow([1, 2], return_edges=True)
+    assert sorted(zip(origins, destinations))==[(1, 2), (1, 3), (2, 3)]
+    assert all(snapshot.edge_ids[p] in (1, 2, 3) for p in positions)
+
+def test_bfs():
+    snapshot = test_db.snapshot()
+    assert list(snapshot.bfs([2]))==[-1, 2, 0, 1, -1, 2, -1]
+    assert list(snapshot.bfs([2], max_depth=1))==[-1, -1, 0, 1, -1, -1, -1]
+    distances = snapshot.bfs([1], direction="any")
+    assert dict((i, d) for i, d in test_db.bfs([1], 10, direction="any").items())==\
+           dict((i, d) for i, d in enumerate(distances) if d>=0)
+
+def test_properties():
+    snapshot = test_db.snapshot("road", node_properties=["height"], edge_properties=["length"])
+    heights = snapshot.node_properties["height"]
+    assert heights.dtype==object
+    assert list(heights[:6])==[None, 0.0, 1.0, 2.0, 3.0, 4.0] and heights[6]=="unknown"
+    lengths = snapshot.edge_properties["length"]
+    assert lengths.dtype==np.float64
+    by_edge = dict(zip(snapshot.edge_ids, lengths))
+    assert by_edge[1]==1.0 and by_edge[2]==2.0 and np.isnan(by_edge[3])
+
+def test_refresh():
+    db = testing.get_test_connection()
+    db.add_nodes("place", 3, [{"height": 1.0}]*3)
+    db.add_edges("road", [(1, 2)], [{"length": 5.0}])
+    snapshot = db.snapshot("road", node_properties=["height"], edge_properties=["length"])
+    assert snapshot.refresh()==0
+
+    db.add_nodes("place", 2, [{"height": 2.0}, {}])
+    db.add_edges("road", [(4, 1), (1, 5)], [{"length": 7.0}, {"length": 8.0}])
+    db.add_edges("ferry", [(2, 3)])
+    db.add_edge("road", 2, 3)
+    assert snapshot.refresh()==3
+    assert snapshot.n_nodes==6
+    assert sorted(snapshot.follow([1]))==[2, 5]
+    assert list(snapshot.degree())==[0, 2, 1, 0, 1, 0]
+    heights = snapshot.node_properties["height"]
+    assert list(heights[1:5])==[1.0, 1.0, 1.0, 2.0] and np.isnan(heights[5])
+
+    fresh = db.snapshot("road", node_properties=["height"], edge_properties=["length"])
+    for attr in "indptr", "destinations", "edge_ids":
+        assert np.array_equal(getattr(fresh, attr), getattr(snapshot, attr))
+    assert np.array_equal(fresh.node_properties["height"], snapshot.node_properties["height"], equal_nan=True)
+    assert np.array_equal(fresh.edge_properties["length"], snapshot.edge_properties["length"], equal_nan=True)
+    db.close()
+
+def test_save_and_load():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "snapshot")
+        snapshot = test_db.snapshot("road", node_properties=["height"], edge_properties=["length"])
+        snapshot.save(path)
+        with assert_raises(ValueError):
+            snapshot.save(path)
+        snapshot.save(path, overwrite=True)
+        assert sorted(os.listdir(directory))==["snapshot"]
+
+        loaded = test_db.load_snapshot(path)
+        for attr in "indptr", "destinations", "edge_ids", "edge_category_ids", "node_exists", "node_category_ids":
+            array = getattr(loaded, attr)
+            assert isinstance(array, np.memmap) and not array.flags.writeable
+            assert np.array_equal(array, getattr(snapshot, attr))
+        assert isinstance(loaded.edge_properties["length"], np.memmap)
+        assert np.array_equal(loaded.edge_properties["length"], snapshot.edge_properties["length"], equal_nan=True)
+        assert list(loaded.node_properties["height"])==list(snapshot.node_properties["height"]) # not memory-mapped
+        assert loaded.edge_category=="road" and loaded.max_edge_id==snapshot.max_edge_id
+        assert list(loaded.bfs([1]))==list(snapshot.bfs([1]))
+        assert list(loaded.degree(direction="any"))==list(snapshot.degree(direction="any"))
+        assert not loaded.is_stale()
+
+        without_connection = Snapshot.load(path)
+        assert list(without_connection.follow([1]))==list(snapshot.follow([1]))
+        with assert_raises(ValueError):
+            without_connection.refresh()
+
+        with open(os.path.join(path, "metadata.json")) as f:
+            metadata = json.load(f)
+        metadata['format_version'] = 0
+        with open(os.path.join(path, "metadata.json"), "w") as f:
+            json.dump(metadata, f)
+        with assert_raises(ValueError):
+            Snapshot.load(path)
+    finally:
+        shutil.rmtree(directory)
+
+def test_staleness():
+    db = testing.get_test_connection()
+    db.add_nodes("place", 3, [{"height": 1.0}]*3)
+    db.add_edges("road", [(1, 2)])
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "snapshot")
+        db.snapshot("road", node_properties=["height"], node_category="place").save(path)
+        snapshot = db.load_snapshot(path)
+        assert not snapshot.is_stale()
+        db.add_edge("ferry", 2, 3)
+        db.add_node("person")
+        assert not snapshot.is_stale() # neither is part of the snapshot
+        db.add_node("place", {"height": 2.0})
+        assert snapshot.is_stale()
+        assert snapshot.refresh()==0 and not snapshot.is_stale()
+        assert snapshot.node_properties["height"][5]==2.0 and list(snapshot.node_ids)==[1, 2, 3, 5]
+        db.add_edge("road", 2, 3)
+        assert snapshot.is_stale()
+        assert snapshot.refresh()==1 and not snapshot.is_stale()
+        assert list(snapshot.follow([2]))==[3]
+
+        db.store_node_property("height", [1], [5.0])
+        assert snapshot.is_stale()
+        snapshot.refresh()
+        assert snapshot.node_properties["height"][1]==5.0
+        snapshot.save(path, overwrite=True)
+        assert not db.load_snapshot(path).is_stale()
+    finally:
+        shutil.rmtree(directory)
+    db.close()
+
+def test_read_in_batches():
+    expected = test_db.snapshot(node_properties=["height"], edge_properties=["length"])
+    original_batch_size = config.snapshot_batch_size
+    config.snapshot_batch_size = 2
+    try:
+        snapshot = test_db.snapshot(node_properties=["height"], edge_properties=["length"])
+    finally:
+        config.snapshot_batch_size = original_batch_size
+    for attr in "indptr", "destinations", "edge_ids", "edge_category_ids", "node_exists", "node_category_ids":
+        assert np.array_equal(getattr(snapshot, attr), getattr(expected, attr))
+    assert list(snapshot.node_properties["height"])==list(expected.node_properties["height"])
+    assert snapshot.node_properties["height"].dtype==object
+    assert np.array_equal(snapshot.edge_properties["length"], expected.edge_properties["length"], equal_nan=True)
@@ -0,0 +1,30 @@
+import graff.testing as testing
+
+def setup():
+    global test_db
+    test_db = testing.init_ownership_graph()
+
+def test_stream_matches_all():
+    for batch_size in 1, 7, 1000:
+        q = test_db.query_node("person").follow("owns").return_property("price")
+        streamed = list(q.stream(batch_size=batch_size))
+        assert streamed == test_db.query_node("person").follow("owns").return_property("price").all()
+        assert len(streamed)==60
+
+def test_stream_properties():
+    streamed = list(test_db.query_node("thing").return_this().return_properties().stream(batch_size=3))
+    assert len(streamed)==50
+    for node, properties in streamed:
+        assert properties['value']==50-properties['price']/10
+
+def test_iterate_query():
+    names = [str(name) for name in test_db.query_node("person").return_property("name")]
+    assert names==["John McGregor", "Sir Richard Stiltington"]
+
+def test_stream_closes_context():
+    q = test_db.query_node("thing").return_property("price")
+    iterator = q.stream(batch_size=5)
+    next(iterator)
+    assert q._temp_table_state._active
+    iterator.close()
+    assert not q._temp_table_state._active
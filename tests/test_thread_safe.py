@@ -0,0 +1,109 @@
+import os, shutil, tempfile, threading, warnings
+from nose.tools import assert_raises
+import graff, graff.condition as c
+
+def setup():
+    global temp_dir, db_filename
+    temp_dir = tempfile.mkdtemp()
+    db_filename = os.path.join(temp_dir, "thread_safe.db")
+    db = graff.Connection(db_filename)
+    db.add_nodes("person", 20, [{'age': i} for i in range(20)])
+    db.add_edges("likes", [(i+1, (i*7)%20+1) for i in range(20)])
+    db.close()
+
+def teardown():
+    shutil.rmtree(temp_dir)
+
+def _liked_ages(db, min_age):
+    return sorted(v.value for v in db.query_node("person").filter(c.Property("age")>=min_age)
+                  .follow("likes").return_property("age").all())
+
+def _run_in_threads(db, n_threads=8, repeats=10):
+    expected = dict((min_age, _liked_ages(db, min_age)) for min_age in range(n_threads))
+    db.release_session()
+    errors = []
+
+    def run(min_age):
+        try:
+            for repeat in range(repeats):
+                assert _liked_ages(db, min_age)==expected[min_age]
+                assert db.query_node("person").follow("likes").count()==20
+            db.release_session()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(min_age,)) for min_age in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors==[]
+
+def test_shared_connection_with_temp_tables():
+    db = graff.Connection(db_filename, use_cte=False, thread_safe=True)
+    _run_in_threads(db)
+    db.close()
+
+def test_shared_connection_with_cte():
+    db = graff.Connection(db_filename, thread_safe=True)
+    _run_in_threads(db)
+    db.close()
+
+def test_session_per_thread():
+    db = graff.Connection(db_filename, thread_safe=True)
+    sessions = []
+    def get_session():
+        sessions.append(db.get_sqlalchemy_session())
+    thread = threading.Thread(target=get_session)
+    thread.start()
+    thread.join()
+    get_session()
+    get_session()
+    assert sessions[0] is not sessions[1]
+    assert sessions[1] is sessions[2]
+    db.release_session()
+    get_session()
+    assert sessions[3] is not sessions[2]
+    db.close()
+
+def test_writes_from_threads():
+    db = graff.Connection(db_filename, thread_safe=True)
+    errors = []
+    def write(worker):
+        try:
+            db.add_nodes("writer", 5, [{'worker': worker}]*5)
+            db.release_session()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=write, args=(worker,)) for worker in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors==[]
+    assert db.query_node("writer").count()==20
+    db.close()
+
+def test_close_sessions_of_all_threads():
+    db = graff.Connection(db_filename, thread_safe=True)
+    other = graff.Connection(db_filename)
+    other_node = other.query_node("person").first()
+    sessions = []
+    def query():
+        db.query_node("person").first()
+        sessions.append(db.get_sqlalchemy_session())
+    thread = threading.Thread(target=query)
+    thread.start()
+    thread.join()
+    query()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        db.close()
+    assert [len(session.identity_map) for session in sessions]==[0, 0]
+    # sessions of other connections are left open
+    assert other_node in other.get_sqlalchemy_session()
+    other.close()
+
+def test_in_memory_not_thread_safe():
+    with assert_raises(ValueError):
+        graff.Connection(thread_safe=True)
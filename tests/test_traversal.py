@@ -0,0 +1,69 @@
+import re
+from nose.tools import assert_raises
+import graff.testing as testing
+
+def setup():
+    global test_db
+    test_db = testing.get_test_connection()
+    test_db.add_nodes("place", 10)
+    # a chain 1 -> 2 -> ... -> 6, a shortcut 1 -> 4 of a different category, a cycle 6 -> 7 -> 8 -> 6, and an
+    # edge 9 -> 1; node 10 is isolated
+    test_db.add_edges("road", [(1, 2), (2, 3), (3, 4), (4, 5), (5, 6), (6, 7), (7, 8), (8, 6), (9, 1)])
+    test_db.add_edges("ferry", [(1, 4)])
+
+def teardown():
+    test_db.close()
+
+def test_bfs():
+    assert test_db.bfs([1], 3, "road")=={1: 0, 2: 1, 3: 2, 4: 3}
+    assert test_db.bfs([1], 3)=={1: 0, 2: 1, 4: 1, 3: 2, 5: 2, 6: 3}
+    assert test_db.bfs([1, 5], 1, "road")=={1: 0, 5: 0, 2: 1, 6: 1}
+    assert test_db.bfs([6], 10, "road")=={6: 0, 7: 1, 8: 2}
+    assert test_db.bfs([10], 5)=={10: 0}
+    assert test_db.bfs([], 5)=={}
+
+def test_bfs_direction():
+    assert test_db.bfs([2], 2, "road", direction="in")=={2: 0, 1: 1, 9: 2}
+    assert test_db.bfs([2], 2, "road", direction="any")=={2: 0, 1: 1, 3: 1, 9: 2, 4: 2}
+    with assert_raises(ValueError):
+        test_db.bfs([2], 2, direction="sideways")
+
+def test_shortest_path():
+    assert test_db.shortest_path(1, 6, "road")==[1, 2, 3, 4, 5, 6]
+    assert test_db.shortest_path(1, 6)==[1, 4, 5, 6]
+    assert test_db.shortest_path(9, 8, "road", max_hops=8)==[9, 1, 2, 3, 4, 5, 6, 7, 8]
+    assert test_db.shortest_path(8, 7, "road")==[8, 6, 7]
+    assert test_db.shortest_path(3, 3)==[3]
+
+def test_no_path():
+    assert test_db.shortest_path(9, 8, "road", max_hops=7) is None
+    assert test_db.shortest_path(6, 1) is None
+    assert test_db.shortest_path(1, 10) is None
+    assert test_db.shortest_path(6, 1, direction="in")==[6, 5, 4, 1]
+    assert test_db.shortest_path(6, 9, "road", direction="any")==[6, 5, 4, 3, 2, 1, 9]
+
+def test_nodes_as_objects():
+    nodes = test_db.query_node("place").all()
+    assert test_db.shortest_path(nodes[0], nodes[2], "road")==[1, 2, 3]
+    assert test_db.bfs(nodes[:1], 1, "ferry")=={1: 0, 4: 1}
+
+def test_many_paths():
+    # every node of each layer links to every node of the next, so there are 20**4 paths of length 4
+    db = testing.get_test_connection()
+    layers = [[1]] + [list(range(2+20*i, 22+20*i)) for i in range(3)] + [[62]]
+    db.add_nodes("layered", 62)
+    db.add_edges("next", [(a, b) for layer, next_layer in zip(layers, layers[1:]) for a in layer for b in next_layer])
+    path = db.shortest_path(1, 62)
+    assert len(path)==5 and path[0]==1 and path[-1]==62
+    depths = db.bfs([1], 4)
+    assert len(depths)==62 and depths[62]==4
+    db.close()
+
+def test_temp_tables_referenced_once_per_statement():
+    # MySQL cannot refer to a temp table more than once in a statement
+    with testing.recorded_statements(test_db) as statements:
+        assert test_db.shortest_path(6, 9, "road", direction="any")==[6, 5, 4, 3, 2, 1, 9]
+        assert len(test_db.bfs([1], 3, direction="any"))==7
+    for statement in statements:
+        for table in set(re.findall(r"temptable_\d+", statement)):
+            assert len(re.findall(r"\b%s\b(?!\.)" % table, statement))<=1, statement
@@ -0,0 +1,68 @@
+import re
+import graff.condition as c, graff.testing as testing
+
+def setup():
+    global test_db
+    test_db = testing.init_friends_network(n_people=200, n_connections=500)
+
+def test_where_property_matches_filter():
+    for op, value, condition in [(">", 55, c.Property("age") > 55), ("<=", 20, c.Property("age") <= 20),
+                                 ("==", 30, c.Property("age") == 30), ("!=", 30, c.Property("age") != 30)]:
+        expected = testing.ids(test_db.query_node("person").filter(condition).all())
+        assert len(expected)>0
+        assert testing.ids(test_db.query_node("person").where_property("age", op, value).all()) == expected
+
+def test_where_property_float_and_string_literals():
+    assert testing.ids(test_db.query_node("person").where_property("age", ">=", 55.5).all()) == \
+           testing.ids(test_db.query_node("person").where_property("age", ">", 55).all())
+    name = test_db.query_node("person").return_property("name").first().value
+    matches = test_db.query_node("person").where_property("name", "==", name).return_property("name").all()
+    assert len(matches)>0
+    assert all(m.value==name for m in matches)
+
+def test_where_property_chained():
+    in_range = test_db.query_node("person").filter((c.Property("age") > 30) & (c.Property("age") < 35))
+    expected = testing.ids(in_range.all())
+    assert len(expected)>0
+    chained = test_db.query_node("person").where_property("age", ">", 30).where_property("age", "<", 35)
+    assert testing.ids(chained.all()) == expected
+
+def test_where_property_continues_chain():
+    expected = test_db.query_node("person").filter(c.Property("age") > 55).follow("likes").count()
+    assert test_db.query_node("person").where_property("age", ">", 55).follow("likes").count() == expected
+
+def test_where_property_bad_operator():
+    try:
+        test_db.query_node("person").where_property("age", "~", 3)
+        assert False, "Expected a ValueError"
+    except ValueError:
+        pass
+
+def test_typed_comparison_sql():
+    with testing.recorded_statements(test_db) as numeric_statements:
+        test_db.query_node("person").filter(c.Property("age") > 55).count()
+    with testing.recorded_statements(test_db) as string_statements:
+        test_db.query_node("person").filter(c.Property("name") == "x").count()
+
+    # literals should only be compared with the value columns of the matching type; the others are only tested for
+    # NULL, so that a value of another type makes the comparison false
+    def compares(column, statement):
+        return re.search(r"%s (?!IS )" % column, statement) is not None
+    assert any(compares("value_int", s) for s in numeric_statements)
+    assert not any(compares("value_str", s) for s in numeric_statements)
+    assert any(compares("value_str", s) for s in string_statements)
+    assert not any(compares("value_int", s) or compares("value_float", s) for s in string_statements)
+
+def test_filter_with_mismatched_literal_type():
+    # a property stored with a different type from the literal fails the comparison; only nodes without the property
+    # at all are kept
+    db = testing.get_test_connection()
+    db.add_nodes("person", 3, [{"age": 30}, {"name": "Ann"}, {"name": "Bob"}])
+    assert testing.ids(db.query_node("person").filter(c.Property("age") == "x").all()) == [2, 3]
+    assert testing.ids(db.query_node("person").filter(c.Property("age") == "30").all()) == [2, 3]
+    assert testing.ids(db.query_node("person").filter(c.Property("name") == 5).all()) == [1]
+    assert testing.ids(db.query_node("person").filter(c.Property("name") > 5).all()) == [1]
+    assert testing.ids(db.query_node("person").filter(c.Property("age") == 30).all()) == [1, 2, 3]
+    assert testing.ids(db.query_node("person").filter(c.Property("name") == "Ann").all()) == [1, 2]
+    assert testing.ids(db.query_node("person").where_property("age", "==", "x").all()) == []
+    db.close()